@@ -0,0 +1,170 @@
+"""
+Local cache of COG internal blocks, shared by all downloads of the scene search worker.
+
+Blocks are stored compressed, exactly as fetched, one file per block named after the hash
+of (scene id, asset, level, block index), with an SQLite index for LRU eviction under a
+size cap. Overlapping AOIs over the same scenes then only fetch the blocks not seen before.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from stac_cache import CACHE_DIR_ENV, DEFAULT_CACHE_DIR
+
+BLOCK_CACHE_DIRNAME = "blocks"
+BLOCK_INDEX_FILENAME = "index.sqlite"
+
+# Size cap of the cached blocks, overridable with the FTW_BLOCK_CACHE_MB environment variable
+BLOCK_CACHE_SIZE_ENV = "FTW_BLOCK_CACHE_MB"
+BLOCK_CACHE_MAX_BYTES = 4 * 1024 ** 3
+# Eviction frees space down to this fraction of the cap, so it doesn't run on every insert
+BLOCK_CACHE_EVICT_TO = 0.9
+
+
+def default_block_cache_dir():
+    return os.path.join(os.environ.get(CACHE_DIR_ENV, DEFAULT_CACHE_DIR), BLOCK_CACHE_DIRNAME)
+
+
+def default_block_cache_max_bytes():
+    size_mb = os.environ.get(BLOCK_CACHE_SIZE_ENV)
+    return int(float(size_mb) * 1024 ** 2) if size_mb else BLOCK_CACHE_MAX_BYTES
+
+
+class BlockCache:
+    """
+    LRU cache of compressed COG blocks on disk.
+
+    The index stores the size, last access time and content hash of each block; a block
+    whose file is missing or doesn't match its hash is treated as a miss. The connection is
+    shared between threads behind a lock; block files are read and written outside it. The
+    index is also shared by the worker processes of the download queue, so the cache size is
+    always summed from it, in the same transaction as the eviction.
+    """
+
+    def __init__(self, directory=None, max_bytes=None):
+        self.directory = directory or default_block_cache_dir()
+        self.max_bytes = max_bytes if max_bytes is not None else default_block_cache_max_bytes()
+        os.makedirs(self.directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(os.path.join(self.directory, BLOCK_INDEX_FILENAME),
+                                           timeout=30, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS blocks (key TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+                "accessed REAL NOT NULL, digest TEXT NOT NULL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS blocks_accessed ON blocks (accessed)")
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def block_key(scene_id, asset, level, index):
+        """Hash identifying a block of a scene's asset."""
+        return hashlib.sha256(f"{scene_id}/{asset}/{level}/{index}".encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        """Return the bytes of a cached block, or None."""
+        with self._lock:
+            row = self._connection.execute("SELECT digest FROM blocks WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        try:
+            with open(self._path(key), "rb") as f:
+                data = f.read()
+        except OSError:
+            data = None
+        if data is None or hashlib.sha256(data).hexdigest() != row[0]:
+            self._forget(key)
+            return None
+        with self._lock, self._connection:
+            self._connection.execute("UPDATE blocks SET accessed = ? WHERE key = ?", (time.time(), key))
+        return data
+
+    def put(self, key, data):
+        """Store the bytes of a block, evicting the least recently used blocks above the size cap."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        with self._lock, self._connection:
+            self._connection.execute("BEGIN IMMEDIATE")
+            self._connection.execute(
+                "INSERT OR REPLACE INTO blocks (key, size, accessed, digest) VALUES (?, ?, ?, ?)",
+                (key, len(data), time.time(), hashlib.sha256(data).hexdigest())
+            )
+            evicted = []
+            if self._total_bytes() > self.max_bytes:
+                evicted = self._evict_keys(int(self.max_bytes * BLOCK_CACHE_EVICT_TO))
+        self._remove_files(evicted)
+
+    def _forget(self, key):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM blocks WHERE key = ?", (key,))
+
+    def _total_bytes(self):
+        return self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM blocks").fetchone()[0]
+
+    def _evict_keys(self, target_bytes):
+        # Delete the least recently used index rows down to target_bytes, inside the caller's transaction
+        total_bytes = self._total_bytes()
+        evicted = []
+        for key, size in self._connection.execute("SELECT key, size FROM blocks ORDER BY accessed"):
+            if total_bytes <= target_bytes:
+                break
+            evicted.append(key)
+            total_bytes -= size
+        self._connection.executemany("DELETE FROM blocks WHERE key = ?", [(key,) for key in evicted])
+        return evicted
+
+    def _remove_files(self, keys):
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    @property
+    def total_bytes(self):
+        """Size of the cached blocks, summed over all processes sharing the index."""
+        with self._lock:
+            return self._total_bytes()
+
+    def evict(self, target_bytes):
+        """Delete the least recently used blocks until the cache holds at most target_bytes."""
+        with self._lock, self._connection:
+            self._connection.execute("BEGIN IMMEDIATE")
+            evicted = self._evict_keys(target_bytes)
+        self._remove_files(evicted)
+
+    def read_block(self, reader, scene_id, asset, level, index):
+        """
+        Read and decode a block of a CogReader, from the cache when possible.
+
+        Args:
+            reader: CogReader of the asset
+            scene_id: Item id of the scene
+            asset: Asset key, e.g. 'B04'
+            level: Resolution level of the block
+            index: Block index in the level
+        """
+        key = self.block_key(scene_id, asset, level, index)
+        data = self.get(key)
+        if data is None:
+            self.misses += 1
+            data = reader.block_bytes(level, index)
+            self.put(key, data)
+        else:
+            self.hits += 1
+        return reader.decode_block(level, data)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,695 @@
+"""
+Windowed reader for Cloud Optimized GeoTIFFs, run inside the FTW conda environment.
+
+Only the TIFF header and the internal blocks that intersect the requested window are
+fetched, with HTTP range requests (or plain file reads for local assets), so a small AOI
+costs a few blocks per band instead of whole scenes. Blocks are fetched concurrently and
+decoded with zlib/numpy. Assets with a layout this reader does not decode (e.g. LZW or JPEG
+compression) are read through GDAL instead, see read_stack().
+"""
+import math
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urlparse
+
+import numpy as np
+
+from download_manifest import DownloadManifest
+from storage_profiles import (DEFAULT_STORAGE_BLOCK_SIZE, DEFAULT_STORAGE_PROFILE, incremental_options, needs_copy,
+                              save_as)
+
+# Bands of each window, in the order `ftw inference download` stacks them
+STACK_BANDS = ("B04", "B03", "B02", "B08")
+STACK_NODATA = 0
+
+# Bytes fetched first to parse the header; COGs keep all IFDs and tile indexes at the start
+HEADER_FETCH_BYTES = 64 * 1024
+# Concurrent block requests
+READ_WORKERS = 16
+HTTP_RETRIES = 3
+HTTP_TIMEOUT_SECONDS = 60
+# Chunks in which the whole file is downloaded from a server without range requests
+SPOOL_CHUNK_BYTES = 1024 * 1024
+# How often a throttle with a rate file reads its cap again
+THROTTLE_RATE_CHECK_SECONDS = 1.0
+# Rows of a band read and checkpointed at once
+UNIT_ROWS = 1024
+
+# TIFF tags used
+TAG_NEW_SUBFILE_TYPE = 254
+TAG_IMAGE_WIDTH = 256
+TAG_IMAGE_LENGTH = 257
+TAG_BITS_PER_SAMPLE = 258
+TAG_COMPRESSION = 259
+TAG_SAMPLES_PER_PIXEL = 277
+TAG_PREDICTOR = 317
+TAG_TILE_WIDTH = 322
+TAG_TILE_LENGTH = 323
+TAG_TILE_OFFSETS = 324
+TAG_TILE_BYTE_COUNTS = 325
+TAG_SAMPLE_FORMAT = 339
+TAG_MODEL_PIXEL_SCALE = 33550
+TAG_MODEL_TIEPOINT = 33922
+TAG_GEO_KEY_DIRECTORY = 34735
+TAG_GDAL_NODATA = 42113
+
+GEO_KEY_PROJECTED_CRS = 3072
+GEO_KEY_GEOGRAPHIC_CRS = 2048
+
+COMPRESSION_NONE = 1
+COMPRESSION_DEFLATE = (8, 32946)
+COMPRESSION_ZSTD = 50000
+
+# TIFF field types: struct format and size
+FIELD_TYPES = {
+    1: ("B", 1), 2: ("s", 1), 3: ("H", 2), 4: ("I", 4), 5: ("II", 8), 6: ("b", 1), 7: ("B", 1),
+    8: ("h", 2), 9: ("i", 4), 10: ("ii", 8), 11: ("f", 4), 12: ("d", 8), 16: ("Q", 8), 17: ("q", 8), 18: ("Q", 8),
+}
+SAMPLE_FORMATS = {1: "u", 2: "i", 3: "f"}
+
+
+class UnsupportedCogError(Exception):
+    """The asset uses a TIFF layout or compression this reader does not decode."""
+
+
+class Throttle:
+    """
+    Count the bytes read by all range requests of the process and optionally cap their rate.
+
+    The cap is a token bucket: reads are delayed so that, averaged over a second, they stay
+    under max_bytes_per_second. With a rate file, the cap is read from it again every
+    THROTTLE_RATE_CHECK_SECONDS, so another process (the download queue) can move bandwidth
+    between workers while they download; an empty file means no cap.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self, max_bytes_per_second=None, rate_file=None):
+        with self._lock:
+            self.bytes_read = 0
+            self.max_bytes_per_second = max_bytes_per_second
+            self.rate_file = rate_file
+            self._available = max_bytes_per_second or 0
+            self._updated = time.monotonic()
+            self._checked = self._updated
+
+    def _read_rate_file(self, now):
+        # Called with the lock held
+        self._checked = now
+        try:
+            with open(self.rate_file) as f:
+                text = f.read().strip()
+        except OSError:
+            return
+        try:
+            rate = float(text) if text else None
+        except ValueError:
+            return
+        if rate != self.max_bytes_per_second:
+            self.max_bytes_per_second = rate
+            self._available = min(self._available, rate) if rate else 0
+
+    def consume(self, n_bytes):
+        """Record a read of n_bytes, first waiting as long as the cap requires."""
+        with self._lock:
+            self.bytes_read += n_bytes
+            if self.rate_file and time.monotonic() - self._checked >= THROTTLE_RATE_CHECK_SECONDS:
+                self._read_rate_file(time.monotonic())
+            rate = self.max_bytes_per_second
+            if not rate:
+                return
+            now = time.monotonic()
+            self._available = min(rate, self._available + (now - self._updated) * rate) - n_bytes
+            self._updated = now
+            wait = -self._available / rate
+        if wait > 0:
+            time.sleep(wait)
+
+
+# Shared by all readers of the process; the worker resets it for each request
+THROTTLE = Throttle()
+
+
+class RangeSource:
+    """
+    Byte ranges of a local file or HTTP(S) URL.
+
+    A server that ignores range requests answers with the whole file; the first such answer
+    is spooled to a temporary file, and all reads are served from it from then on.
+    """
+
+    def __init__(self, href, session=None):
+        self.href = href
+        parsed = urlparse(href)
+        self.is_http = parsed.scheme in ("http", "https")
+        self.path = unquote(parsed.path) if parsed.scheme == "file" else href
+        if self.is_http and session is None:
+            session = http_session()
+        self.session = session
+        self._spool = None
+        self._spool_lock = threading.Lock()
+
+    def _spool_response(self, response):
+        with self._spool_lock:
+            if self._spool is not None:
+                # Another thread downloaded the file meanwhile
+                return
+            print(f"{self.href} is served without range requests, downloading it once")
+            spool = tempfile.TemporaryFile(prefix="ftw_cog_")
+            for chunk in response.iter_content(SPOOL_CHUNK_BYTES):
+                THROTTLE.consume(len(chunk))
+                spool.write(chunk)
+            self._spool = spool
+
+    def _read_spool(self, offset, length):
+        with self._spool_lock:
+            self._spool.seek(offset)
+            return self._spool.read(length)
+
+    def read(self, offset, length):
+        if length <= 0:
+            return b""
+        if self._spool is not None:
+            return self._read_spool(offset, length)
+        if not self.is_http:
+            THROTTLE.consume(length)
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                return f.read(length)
+
+        headers = {"Range": f"bytes={offset}-{offset + length - 1}"}
+        for attempt in range(HTTP_RETRIES):
+            try:
+                with self.session.get(self.href, headers=headers, timeout=HTTP_TIMEOUT_SECONDS, stream=True) as response:
+                    response.raise_for_status()
+                    if response.status_code == 206:
+                        THROTTLE.consume(length)
+                        return response.content
+                    self._spool_response(response)
+                return self._read_spool(offset, length)
+            except Exception:
+                if attempt == HTTP_RETRIES - 1:
+                    raise
+                time.sleep(2 ** attempt)
+
+
+def http_session(pool_size=READ_WORKERS):
+    """Return a requests session with enough pooled connections for concurrent block reads."""
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class CogLevel:
+    """One resolution level of a COG: the full-resolution image or one of its overviews."""
+
+    def __init__(self, width, height, tile_width, tile_height, offsets, byte_counts):
+        self.width = width
+        self.height = height
+        self.tile_width = tile_width
+        self.tile_height = tile_height
+        self.offsets = offsets
+        self.byte_counts = byte_counts
+        self.tiles_across = math.ceil(width / tile_width)
+        self.tiles_down = math.ceil(height / tile_height)
+
+
+class CogReader:
+    """
+    Parse the header of a single-band tiled GeoTIFF and read windows of it block by block.
+
+    Attributes:
+        levels: CogLevel of the full-resolution image, then of each overview
+        dtype: numpy dtype of the samples
+        nodata: Nodata value, or None
+        epsg: EPSG code of the CRS, or None
+        transform: (x_origin, pixel_width, y_origin, pixel_height) of the full-resolution image
+    """
+
+    def __init__(self, href, session=None):
+        self.href = href
+        self.source = RangeSource(href, session)
+        self._header = self.source.read(0, HEADER_FETCH_BYTES)
+        self._lock = threading.Lock()
+        self._parse()
+
+    # Header parsing
+
+    def _bytes(self, offset, length):
+        # Header bytes, fetching more when tag data lies past what was read so far
+        with self._lock:
+            if offset + length > len(self._header):
+                self._header += self.source.read(len(self._header), offset + length - len(self._header))
+            return self._header[offset:offset + length]
+
+    def _parse(self):
+        byte_order = self._bytes(0, 2)
+        if byte_order not in (b"II", b"MM"):
+            raise UnsupportedCogError(f"{self.href} is not a TIFF file")
+        self._order = "<" if byte_order == b"II" else ">"
+        version = struct.unpack(self._order + "H", self._bytes(2, 2))[0]
+        self._big = version == 43
+        if self._big:
+            ifd_offset = struct.unpack(self._order + "Q", self._bytes(8, 8))[0]
+        elif version == 42:
+            ifd_offset = struct.unpack(self._order + "I", self._bytes(4, 4))[0]
+        else:
+            raise UnsupportedCogError(f"{self.href} is not a TIFF file")
+
+        ifds = []
+        while ifd_offset:
+            tags, ifd_offset = self._read_ifd(ifd_offset)
+            ifds.append(tags)
+
+        first = ifds[0]
+        if first.get(TAG_SAMPLES_PER_PIXEL, (1,))[0] != 1:
+            raise UnsupportedCogError(f"{self.href} has several samples per pixel")
+        if TAG_TILE_WIDTH not in first:
+            raise UnsupportedCogError(f"{self.href} is not tiled")
+        self.compression = first.get(TAG_COMPRESSION, (COMPRESSION_NONE,))[0]
+        if self.compression not in (COMPRESSION_NONE, COMPRESSION_ZSTD) + COMPRESSION_DEFLATE:
+            raise UnsupportedCogError(f"{self.href} uses TIFF compression {self.compression}")
+        if self.compression == COMPRESSION_ZSTD:
+            try:
+                import zstandard  # noqa: F401
+            except ImportError:
+                raise UnsupportedCogError(f"{self.href} uses ZSTD compression and zstandard is not installed")
+        self.predictor = first.get(TAG_PREDICTOR, (1,))[0]
+        if self.predictor not in (1, 2):
+            raise UnsupportedCogError(f"{self.href} uses TIFF predictor {self.predictor}")
+        bits = first[TAG_BITS_PER_SAMPLE][0]
+        sample_format = SAMPLE_FORMATS[first.get(TAG_SAMPLE_FORMAT, (1,))[0]]
+        self.dtype = np.dtype(f"{self._order}{sample_format}{bits // 8}")
+
+        nodata = first.get(TAG_GDAL_NODATA)
+        self.nodata = float(nodata.strip("\x00")) if nodata else None
+
+        self.epsg = None
+        geo_keys = first.get(TAG_GEO_KEY_DIRECTORY)
+        if geo_keys:
+            for i in range(4, 4 + 4 * geo_keys[3], 4):
+                key, location, _, value = geo_keys[i:i + 4]
+                if key in (GEO_KEY_PROJECTED_CRS, GEO_KEY_GEOGRAPHIC_CRS) and location == 0:
+                    self.epsg = value
+        scale = first.get(TAG_MODEL_PIXEL_SCALE)
+        tiepoint = first.get(TAG_MODEL_TIEPOINT)
+        self.transform = None
+        if scale and tiepoint:
+            self.transform = (tiepoint[3] - tiepoint[0] * scale[0], scale[0],
+                              tiepoint[4] + tiepoint[1] * scale[1], scale[1])
+
+        # Full-resolution image, then reduced-resolution overviews; masks are skipped
+        self.levels = []
+        for tags in ifds:
+            subfile_type = tags.get(TAG_NEW_SUBFILE_TYPE, (0,))[0]
+            if subfile_type & 4 or TAG_TILE_OFFSETS not in tags:
+                continue
+            self.levels.append(CogLevel(
+                tags[TAG_IMAGE_WIDTH][0], tags[TAG_IMAGE_LENGTH][0],
+                tags[TAG_TILE_WIDTH][0], tags[TAG_TILE_LENGTH][0],
+                tags[TAG_TILE_OFFSETS], tags[TAG_TILE_BYTE_COUNTS],
+            ))
+
+    def _read_ifd(self, offset):
+        count_format, entry_size, value_size = ("Q", 20, 8) if self._big else ("H", 12, 4)
+        count_size = 8 if self._big else 2
+        count = struct.unpack(self._order + count_format, self._bytes(offset, count_size))[0]
+        entries = self._bytes(offset + count_size, count * entry_size)
+        tags = {}
+        for i in range(count):
+            entry = entries[i * entry_size:(i + 1) * entry_size]
+            if self._big:
+                tag, field_type, n_values = struct.unpack(self._order + "HHQ", entry[:12])
+            else:
+                tag, field_type, n_values = struct.unpack(self._order + "HHI", entry[:8])
+            value_bytes = entry[entry_size - value_size:]
+            if field_type not in FIELD_TYPES:
+                continue
+            fmt, size = FIELD_TYPES[field_type]
+            length = size * n_values
+            if length > value_size:
+                data_offset = struct.unpack(self._order + ("Q" if self._big else "I"), value_bytes)[0]
+                value_bytes = self._bytes(data_offset, length)
+            if field_type == 2:
+                tags[tag] = value_bytes[:length].decode("ascii", "replace")
+            else:
+                values = struct.unpack(self._order + fmt[0] * (n_values * len(fmt)), value_bytes[:length])
+                if len(fmt) == 2:
+                    values = tuple(values[i] / values[i + 1] if values[i + 1] else 0.0 for i in range(0, len(values), 2))
+                tags[tag] = values
+        next_format = "Q" if self._big else "I"
+        next_offset = struct.unpack(
+            self._order + next_format,
+            self._bytes(offset + count_size + count * entry_size, value_size)
+        )[0]
+        return tags, next_offset
+
+    def level_resolution(self, level, axis=0):
+        """
+        Pixel width (axis 0) or height (axis 1) of a level: the image extent over the level's size.
+
+        Overview sizes are rounded up, e.g. 10980 pixels decimated by 8 give 1373, so their
+        pixels are slightly smaller than an integer multiple of the full resolution.
+        """
+        if axis == 0:
+            return self.transform[1] * self.levels[0].width / self.levels[level].width
+        return self.transform[3] * self.levels[0].height / self.levels[level].height
+
+    def level_for_resolution(self, resolution):
+        """
+        Index of the level with a pixel size of resolution, or None if there is none.
+
+        resolution is either the level's pixel size or its nominal one, the full resolution
+        times the decimation factor (e.g. 80 for the 1/8 overview of a 10 m band).
+        """
+        for level in range(len(self.levels)):
+            nominal = self.transform[1] * round(self.levels[0].width / self.levels[level].width)
+            if (math.isclose(self.level_resolution(level), resolution, rel_tol=1e-6)
+                    or math.isclose(nominal, resolution, rel_tol=1e-6)):
+                return level
+        return None
+
+    # Block reading
+
+    def block_bytes(self, level, index):
+        """Fetch the compressed bytes of a block (b'' for sparse blocks)."""
+        level = self.levels[level]
+        byte_count = level.byte_counts[index]
+        if byte_count == 0:
+            return b""
+        return self.source.read(level.offsets[index], byte_count)
+
+    def decode_block(self, level, data):
+        """Decode the compressed bytes of a block into a (tile_height, tile_width) array."""
+        level = self.levels[level]
+        shape = (level.tile_height, level.tile_width)
+        if not data:
+            return np.full(shape, self.nodata if self.nodata is not None else 0, dtype=self.dtype.newbyteorder("="))
+        if self.compression in COMPRESSION_DEFLATE:
+            data = zlib.decompress(data)
+        elif self.compression == COMPRESSION_ZSTD:
+            import zstandard
+            data = zstandard.ZstdDecompressor().decompress(data, max_output_size=shape[0] * shape[1] * self.dtype.itemsize)
+        block = np.frombuffer(data, dtype=self.dtype, count=shape[0] * shape[1]).reshape(shape)
+        block = block.astype(self.dtype.newbyteorder("="), copy=False)
+        if self.predictor == 2:
+            block = np.cumsum(block, axis=1, dtype=block.dtype)
+        return block
+
+    def read_block(self, level, index):
+        return self.decode_block(level, self.block_bytes(level, index))
+
+    def blocks_in_window(self, level, col_off, row_off, width, height):
+        """Return the indices of the blocks intersecting a pixel window of a level."""
+        level = self.levels[level]
+        col0 = max(0, col_off // level.tile_width)
+        col1 = min(level.tiles_across - 1, (col_off + width - 1) // level.tile_width)
+        row0 = max(0, row_off // level.tile_height)
+        row1 = min(level.tiles_down - 1, (row_off + height - 1) // level.tile_height)
+        return [row * level.tiles_across + col for row in range(row0, row1 + 1) for col in range(col0, col1 + 1)]
+
+    def read_window(self, col_off, row_off, width, height, level=0, executor=None, read_block=None):
+        """
+        Read a pixel window of a level; pixels outside the image are nodata (or 0).
+
+        Args:
+            col_off, row_off, width, height: Window in pixels of the level
+            level: Index into levels, 0 for full resolution
+            executor: Optional executor to fetch the blocks concurrently
+            read_block: Optional replacement of read_block(level, index), e.g. a cached one
+        """
+        read_block = read_block or self.read_block
+        out = np.full((height, width), self.nodata if self.nodata is not None else 0, dtype=self.dtype.newbyteorder("="))
+        info = self.levels[level]
+        indices = self.blocks_in_window(level, col_off, row_off, width, height)
+        if col_off >= info.width or row_off >= info.height or col_off + width <= 0 or row_off + height <= 0:
+            return out
+        if executor is None:
+            blocks = [read_block(level, index) for index in indices]
+        else:
+            blocks = list(executor.map(lambda index: read_block(level, index), indices))
+
+        for index, block in zip(indices, blocks):
+            block_row, block_col = divmod(index, info.tiles_across)
+            x0, y0 = block_col * info.tile_width, block_row * info.tile_height
+            # Intersection of the block, the window and the image, in level pixels
+            left, right = max(x0, col_off), min(x0 + info.tile_width, col_off + width, info.width)
+            top, bottom = max(y0, row_off), min(y0 + info.tile_height, row_off + height, info.height)
+            if left >= right or top >= bottom:
+                continue
+            out[top - row_off:bottom - row_off, left - col_off:right - col_off] = \
+                block[top - y0:bottom - y0, left - x0:right - x0]
+        return out
+
+
+def stack_grid(reader, bbox, resolution):
+    """
+    Grid of a stack: the pixels covering a bbox, aligned with the pixels of the reference band.
+
+    Args:
+        reader: CogReader of the reference band (window A, first band)
+        bbox: [min_lon, min_lat, max_lon, max_lat]
+        resolution: Pixel size, a multiple of the reference band's; the pixel size of the
+            matching overview is used, which may differ slightly (see CogReader.level_resolution)
+
+    Returns:
+        tuple: (crs, (x_origin, pixel_size, y_origin, -pixel_size), width, height)
+    """
+    from rasterio.warp import transform_bounds
+
+    level = reader.level_for_resolution(resolution)
+    if level is not None:
+        resolution = reader.level_resolution(level)
+    crs = f"EPSG:{reader.epsg}"
+    x0, _, y0, _ = reader.transform
+    left, bottom, right, top = transform_bounds("EPSG:4326", crs, *bbox, densify_pts=21)
+    col0, col1 = math.floor((left - x0) / resolution), math.ceil((right - x0) / resolution)
+    row0, row1 = math.floor((y0 - top) / resolution), math.ceil((y0 - bottom) / resolution)
+    return crs, (x0 + col0 * resolution, resolution, y0 - row0 * resolution, -resolution), col1 - col0, row1 - row0
+
+
+def aligned_window(reader, grid_transform, level=0):
+    """
+    Return the (col_off, row_off) of a stack grid in the pixels of a band's level, or None if
+    they are not aligned with the grid and the band has to be resampled.
+    """
+    x0, _, y0, _ = reader.transform
+    x_res, y_res = reader.level_resolution(level), reader.level_resolution(level, axis=1)
+    grid_x0, grid_res, grid_y0, _ = grid_transform
+    col = (grid_x0 - x0) / x_res
+    row = (y0 - grid_y0) / y_res
+    if not (math.isclose(x_res, grid_res) and math.isclose(y_res, grid_res)
+            and abs(col - round(col)) < 1e-6 and abs(row - round(row)) < 1e-6):
+        return None
+    return round(col), round(row)
+
+
+def upsampled_window(reader, grid_transform):
+    """
+    Return the (col_off, row_off, factor) of a stack grid in a band's full-resolution pixels
+    when they are an integer factor coarser than the grid and aligned with it (e.g. the 20 m
+    SCL on a 10 m grid), or None. col_off and row_off are in grid pixels.
+    """
+    x0, x_res, y0, y_res = reader.transform
+    grid_x0, grid_res, grid_y0, _ = grid_transform
+    factor = round(x_res / grid_res)
+    col = (grid_x0 - x0) / grid_res
+    row = (y0 - grid_y0) / grid_res
+    if not (factor > 1 and math.isclose(x_res, factor * grid_res) and math.isclose(y_res, x_res)
+            and abs(col - round(col)) < 1e-6 and abs(row - round(row)) < 1e-6):
+        return None
+    return round(col), round(row), factor
+
+
+def open_band(href, session):
+    """Open a band with CogReader, or return None if it has to be read through GDAL."""
+    try:
+        return CogReader(href, session)
+    except UnsupportedCogError as e:
+        print(f"Reading {href} through GDAL: {e}")
+        return None
+
+
+def unit_strips(height, row_off=0, tile_height=1):
+    """
+    Cut the rows of a stack into resumable strips of about UNIT_ROWS rows.
+
+    Args:
+        height: Rows of the stack
+        row_off: Row of the stack's first row in the reference band's level
+        tile_height: Tile height of that level; strips start on its tile rows, except the first
+
+    Returns:
+        list of [row_off, rows] in the stack
+    """
+    step = max(1, UNIT_ROWS // tile_height) * tile_height
+    first = (-row_off) % tile_height or step
+    edges = [0] + list(range(first, height, step)) + [height]
+    return [[top, bottom - top] for top, bottom in zip(edges, edges[1:])]
+
+
+def read_stack(window_items, bbox, output_path, bands=STACK_BANDS, resolution=None, max_workers=READ_WORKERS,
+               session=None, block_cache=None, storage_profile=DEFAULT_STORAGE_PROFILE,
+               block_size=DEFAULT_STORAGE_BLOCK_SIZE, grid=None, resampling="average"):
+    """
+    Read the bbox of each window's bands and write them as one stack, e.g. the 8-band
+    window A + window B input of FTW.
+
+    The output grid is the pixel grid of window A's first band. Bands aligned with it are read
+    block by block straight from the COG; others (another UTM zone, an unsupported layout)
+    are resampled through GDAL. A coarser resolution, e.g. for previews, is read from the
+    COG overviews with that pixel size, so it costs a fraction of the full-resolution blocks.
+    Bands an integer factor coarser than the grid (e.g. the 20 m SCL) are read natively too and
+    upsampled by repeating their pixels.
+
+    The download is resumable: each band is read in strips of about UNIT_ROWS rows, cut on the
+    tile rows of the reference band so no block is fetched for two strips, and every strip
+    is checkpointed in a DownloadManifest (see download_manifest.py). Running the same request
+    again after an interruption only reads the strips that are missing or fail their checksum.
+
+    Args:
+        window_items: Item dicts with signed asset hrefs, one per window
+        bbox: [min_lon, min_lat, max_lon, max_lat]
+        output_path: GeoTIFF to write
+        bands: Asset keys read from each item
+        resolution: Pixel size in meters, a multiple of the bands' (e.g. 20, 40, 80 for 10 m
+            bands); defaults to the full resolution
+        max_workers: Concurrent block requests
+        session: Optional requests session
+        block_cache: Optional BlockCache blocks are read from first (see block_cache.py)
+        storage_profile: Layout of the output, one of STORAGE_PROFILES (see storage_profiles.py)
+        block_size: Side of the output's internal tiles, in pixels
+        grid: Optional (crs, transform, width, height) from stack_grid() to write instead of the
+            grid of window A's first band, e.g. to stack several scenes on one grid
+        resampling: rasterio resampling method name of the bands resampled through GDAL,
+            e.g. 'nearest' for classifications
+
+    Returns:
+        str: output_path
+    """
+    import rasterio
+    from rasterio.transform import Affine
+    from rasterio.windows import Window
+
+    assets = [(item["id"], band) for item in window_items for band in bands]
+    hrefs = [item["assets"][band]["href"] for item in window_items for band in bands]
+    if session is None and any(urlparse(href).scheme in ("http", "https") for href in hrefs):
+        session = http_session(max_workers)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        readers = list(executor.map(lambda href: open_band(href, session), hrefs))
+        reference = readers[0]
+        if grid is None:
+            if reference is None or reference.epsg is None or reference.transform is None:
+                raise UnsupportedCogError(f"{hrefs[0]} cannot be used as the reference grid")
+            grid = stack_grid(reference, bbox, resolution or reference.transform[1])
+        crs, grid_transform, width, height = grid
+        resolution = grid_transform[1]
+        if reference is not None:
+            dtype = reference.dtype.newbyteorder("=")
+        else:
+            with rasterio.open(hrefs[0]) as src:
+                dtype = np.dtype(src.dtypes[0])
+        affine = Affine(grid_transform[1], 0, grid_transform[0], 0, grid_transform[3], grid_transform[2])
+
+        # Where each band's window starts in its own pixels, None for the bands resampled by GDAL
+        band_windows = []
+        upsampled = []
+        for reader in readers:
+            offsets = upsample = None
+            if reader is not None and f"EPSG:{reader.epsg}" == crs and reader.transform is not None:
+                band_level = reader.level_for_resolution(resolution)
+                if band_level is not None:
+                    offsets = aligned_window(reader, grid_transform, band_level)
+                else:
+                    upsample = upsampled_window(reader, grid_transform)
+            band_windows.append(None if offsets is None else (offsets, band_level))
+            upsampled.append(upsample)
+
+        def read_unit(i, row_off, rows):
+            reader = readers[i]
+            block_reader = None
+            if block_cache is not None and reader is not None:
+                scene_id, asset = assets[i]
+                block_reader = lambda lvl, index: block_cache.read_block(reader, scene_id, asset, lvl, index)
+            if band_windows[i] is not None:
+                (col, row), band_level = band_windows[i]
+                return reader.read_window(col, row + row_off, width, rows, band_level,
+                                          executor=executor, read_block=block_reader)
+            if upsampled[i] is not None:
+                # Coarser band pixels covering the unit, repeated to the grid's pixels
+                col, row, factor = upsampled[i]
+                col0, row0 = col // factor, (row + row_off) // factor
+                col1, row1 = (col + width - 1) // factor, (row + row_off + rows - 1) // factor
+                data = reader.read_window(col0, row0, col1 - col0 + 1, row1 - row0 + 1,
+                                          executor=executor, read_block=block_reader)
+                data = data.repeat(factor, axis=0).repeat(factor, axis=1)
+                top, left = row + row_off - row0 * factor, col - col0 * factor
+                return data[top:top + rows, left:left + width]
+            return read_resampled(hrefs[i], crs, affine, width, height, Window(0, row_off, width, rows), resampling)
+
+        # Units are read one after the other, each with its blocks fetched concurrently,
+        # so memory holds at most one strip plus the blocks in flight
+        if band_windows[0] is None:
+            strips = unit_strips(height)
+        else:
+            (_, row), band_level = band_windows[0]
+            strips = unit_strips(height, row, reference.levels[band_level].tile_height)
+        manifest = DownloadManifest(output_path, {
+            "assets": assets, "bbox": list(bbox), "resolution": resolution,
+            "grid": [crs, list(grid_transform), width, height], "dtype": dtype.str, "strips": strips,
+            "resampling": resampling,
+        })
+        creation = dict(
+            incremental_options(storage_profile, block_size), dtype=dtype.name, count=len(hrefs), crs=crs,
+            transform=affine, width=width, height=height, nodata=STACK_NODATA,
+        )
+        stack_path = os.path.join(manifest.directory, "stack.tif")
+        resumed = 0
+        with rasterio.open(stack_path, "w", **creation) as dst:
+            for i in range(len(hrefs)):
+                for strip, (row_off, rows) in enumerate(strips):
+                    unit = f"{i}/{strip}"
+                    data = manifest.load_unit(unit, (rows, width), dtype)
+                    if data is None:
+                        data = read_unit(i, row_off, rows).astype(dtype, copy=False)
+                        manifest.save_unit(unit, data)
+                    else:
+                        resumed += 1
+                    dst.write(data, i + 1, window=Window(0, row_off, width, rows))
+        if resumed:
+            print(f"Resumed {output_path}: reused {resumed} finished units")
+        if needs_copy(storage_profile):
+            save_as(stack_path, output_path, storage_profile, block_size)
+        else:
+            os.replace(stack_path, output_path)
+        manifest.remove()
+    return output_path
+
+
+def read_resampled(href, crs, transform, width, height, window=None, resampling="average"):
+    """
+    Read a band resampled to a grid, or a window of it, through GDAL (which also uses range requests).
+
+    Pixels are averaged by default, like the overviews the other bands of a preview are read from.
+    """
+    import rasterio
+    from rasterio.enums import Resampling
+    from rasterio.vrt import WarpedVRT
+
+    with rasterio.open(href) as src:
+        with WarpedVRT(src, crs=crs, transform=transform, width=width, height=height,
+                       resampling=Resampling[resampling], nodata=STACK_NODATA) as vrt:
+            return vrt.read(1, window=window)
@@ -0,0 +1,154 @@
+"""
+Per-pixel cloud-free compositing across several Sentinel-2 scenes, run inside the FTW
+conda environment.
+
+Instead of taking every pixel from one scene per window, the top scenes of each window are
+read with their scene classification (SCL) layer and each output pixel is taken from the
+clear observations only. Scenes are read with the native COG reader (cog_reader.py) and the
+output grid is processed block by block, so memory stays bounded by the block size and the
+number of scenes, whatever the size of the ROI.
+"""
+import os
+import shutil
+import warnings
+from urllib.parse import urlparse
+
+import numpy as np
+
+# Bands of each window, in the order `ftw inference download` stacks them
+COMPOSITE_BANDS = ("B04", "B03", "B02", "B08")
+SCL_ASSET = "SCL"
+# SCL classes kept as clear: dark area, vegetation, bare soil, water, unclassified, snow.
+# Dropped: no data (0), saturated (1), cloud shadow (3), clouds (8, 9) and cirrus (10)
+SCL_CLEAR_CLASSES = (2, 4, 5, 6, 7, 11)
+
+COMPOSITE_RESOLUTION_M = 10
+COMPOSITE_BLOCK_SIZE = 512
+COMPOSITE_NODATA = 0
+
+# 'median' takes the per-pixel median of the clear observations, 'first' the clear
+# observation of the best ranked scene
+COMPOSITE_METHODS = ("median", "first")
+
+
+def composite_block(values, clear, method="median"):
+    """
+    Composite one block of observations.
+
+    Args:
+        values: (n_scenes, n_bands, rows, cols) array, best ranked scene first
+        clear: (n_scenes, rows, cols) boolean array of clear observations
+        method: 'median' or 'first'
+
+    Returns:
+        (n_bands, rows, cols) array of values.dtype. Pixels without a clear observation take
+        the first observation with data, or COMPOSITE_NODATA.
+    """
+    has_data = (values != COMPOSITE_NODATA).any(axis=1)
+    clear = clear & has_data
+
+    # Fallback: first scene with any data at each pixel
+    first_data = np.argmax(has_data, axis=0)
+    result = np.take_along_axis(values, first_data[None, None], axis=0)[0]
+
+    if method == "median":
+        masked = np.where(clear[:, None], values.astype(np.float32), np.nan)
+        with warnings.catch_warnings():
+            # All-NaN pixels have no clear observation and are filled below
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            median = np.nanmedian(masked, axis=0)
+            composite = np.round(median).astype(values.dtype, copy=False)
+    elif method == "first":
+        first_clear = np.argmax(clear, axis=0)
+        composite = np.take_along_axis(values, first_clear[None, None], axis=0)[0]
+    else:
+        raise ValueError(f"Unknown composite method: {method}")
+
+    any_clear = clear.any(axis=0)
+    result = np.where(any_clear[None], composite, result)
+    result[:, ~has_data.any(axis=0)] = COMPOSITE_NODATA
+    return result
+
+
+def write_composite(windows, bbox, output_path, method="median", block_size=COMPOSITE_BLOCK_SIZE,
+                    resolution=COMPOSITE_RESOLUTION_M, block_cache=None):
+    """
+    Write an 8-band composite of windows A and B.
+
+    Each scene's bands and SCL are first read with cog_reader.read_stack onto the grid of the
+    best ranked scene of window A, so they go through the block cache, the bandwidth cap and
+    resumable downloads like any other stack; the composite is then computed from these local
+    stacks block by block.
+
+    Args:
+        windows: [items of window A, items of window B], item dicts with signed asset hrefs,
+            best ranked first
+        bbox: [min_lon, min_lat, max_lon, max_lat]
+        output_path: GeoTIFF to write
+        method: One of COMPOSITE_METHODS
+        block_size: Side of the blocks processed at once, in pixels
+        resolution: Pixel size in meters, coarser for previews
+        block_cache: Optional BlockCache blocks are read from first (see block_cache.py)
+
+    Returns:
+        str: output_path
+    """
+    import rasterio
+    from rasterio.transform import Affine
+    from rasterio.windows import Window
+
+    from cog_reader import READ_WORKERS, UnsupportedCogError, http_session, open_band, read_stack, stack_grid
+
+    if method not in COMPOSITE_METHODS:
+        raise ValueError(f"Unknown composite method: {method}")
+
+    reference_href = windows[0][0]["assets"][COMPOSITE_BANDS[0]]["href"]
+    session = http_session(READ_WORKERS) if urlparse(reference_href).scheme in ("http", "https") else None
+    reference = open_band(reference_href, session)
+    if reference is None or reference.epsg is None or reference.transform is None:
+        raise UnsupportedCogError(f"{reference_href} cannot be used as the reference grid")
+    grid = stack_grid(reference, bbox, resolution)
+    crs, grid_transform, width, height = grid
+
+    # Stacks of each scene on the output grid; the SCL classes are never averaged
+    scenes_dir = output_path + ".scenes"
+    os.makedirs(scenes_dir, exist_ok=True)
+    scene_paths = []
+    for w, items in enumerate(windows):
+        window_paths = []
+        for k, item in enumerate(items):
+            stem = os.path.join(scenes_dir, f"{w}_{k}")
+            bands_path = read_stack([item], bbox, stem + "_bands.tif", bands=COMPOSITE_BANDS, grid=grid,
+                                    session=session, block_cache=block_cache)
+            scl_path = read_stack([item], bbox, stem + "_scl.tif", bands=(SCL_ASSET,), grid=grid,
+                                  session=session, block_cache=block_cache, resampling="nearest")
+            window_paths.append((bands_path, scl_path))
+        scene_paths.append(window_paths)
+
+    profile = dict(
+        driver="GTiff", dtype="uint16", count=len(COMPOSITE_BANDS) * len(windows), nodata=COMPOSITE_NODATA,
+        tiled=True, blockxsize=block_size, blockysize=block_size, compress="deflate", predictor=2, crs=crs,
+        transform=Affine(grid_transform[1], 0, grid_transform[0], 0, grid_transform[3], grid_transform[2]),
+        width=width, height=height,
+    )
+    sources = [[(rasterio.open(bands_path), rasterio.open(scl_path)) for bands_path, scl_path in window_paths]
+               for window_paths in scene_paths]
+    try:
+        with rasterio.open(output_path, "w", **profile) as dst:
+            for row in range(0, height, block_size):
+                for col in range(0, width, block_size):
+                    window = Window(col, row, min(block_size, width - col), min(block_size, height - row))
+                    blocks = []
+                    for window_sources in sources:
+                        values = np.stack([bands.read(window=window) for bands, _ in window_sources])
+                        clear = np.stack([np.isin(scl.read(1, window=window), SCL_CLEAR_CLASSES)
+                                          for _, scl in window_sources])
+                        blocks.append(composite_block(values, clear, method))
+                    dst.write(np.concatenate(blocks).astype(np.uint16, copy=False), window=window)
+    finally:
+        for window_sources in sources:
+            for bands, scl in window_sources:
+                bands.close()
+                scl.close()
+    shutil.rmtree(scenes_dir, ignore_errors=True)
+    return output_path
@@ -0,0 +1,481 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+
+# Crop calendar rasters for each season, as published under resources/global_crop_calendars
+CROP_CALENDAR_FILES = {
+    "summer": {
+        "start": "sc_sos_3x3_v2.tiff",
+        "end": "sc_eos_3x3_v2.tiff"
+    },
+    "winter": {
+        "start": "wc_sos_3x3_v2.tiff",
+        "end": "wc_eos_3x3_v2.tiff"
+    }
+}
+
+# Single-file packed version of all the crop calendar layers, see pack_crop_calendars()
+CROP_CALENDAR_PACKED_FILE = "crop_calendars_3x3_v2.ftwcal"
+PACKED_MAGIC = b"FTWCAL01"
+PACKED_ALIGNMENT = 64
+
+# Fraction of a calendar pixel a bbox must overlap for the pixel to be part of its window
+WINDOW_EDGE_TOLERANCE = 0.01
+
+# Search radius, in calendar pixels, of the nearest-valid-pixel fallback for pixels without data
+NEAREST_VALID_MAX_PIXELS = 6
+
+# Day-of-year value used by the calendars for pixels without a crop season
+CALENDAR_NODATA = 0
+
+
+def calendar_paths(calendar_dir):
+    """Return the {season: {"start": path, "end": path}} mapping for a calendar directory."""
+    return {
+        season: {kind: os.path.join(calendar_dir, filename) for kind, filename in files.items()}
+        for season, files in CROP_CALENDAR_FILES.items()
+    }
+
+
+def get_date_from_day_of_year(day_of_year: int, year: int) -> str:
+    if day_of_year < 1 or day_of_year > 366:
+        raise ValueError("day_of_year must be between 1 and 366")
+    base_date = datetime(year, 1, 1)
+    result_date = base_date + timedelta(days=day_of_year - 1)
+    if day_of_year == 366 and result_date.year != year:
+        raise ValueError(f"{year} is not a leap year.")
+    return result_date.strftime("%Y-%m-%d")
+
+
+class CropCalendarIndex:
+    """
+    Resident, in-memory index over the global crop calendar rasters.
+
+    The start/end of season rasters are held as compact uint16 arrays sharing a single
+    geotransform, so that looking up the day-of-year for a coordinate is plain array
+    indexing with no disk I/O. Build it with from_tifs() or, without GDAL/rasterio,
+    from_packed().
+    """
+
+    def __init__(self, seasons, transform, nodata=CALENDAR_NODATA):
+        """
+        Args:
+            seasons: mapping {season: {"start": uint16 array, "end": uint16 array}}
+            transform: (a, b, c, d, e, f) affine geotransform shared by all layers
+            nodata: day-of-year value marking pixels without a crop season
+        """
+        self.seasons = seasons
+        self.transform = tuple(float(v) for v in transform)
+        self.shape = next(iter(seasons.values()))["start"].shape
+        self.nodata = nodata
+        self._nearest_valid = {}
+
+    @classmethod
+    def from_tifs(cls, seasons):
+        """
+        Read the crop calendar GeoTIFFs with rasterio.
+
+        Args:
+            seasons: mapping {season: {"start": tif_path, "end": tif_path}}
+        """
+        import rasterio
+
+        arrays = {}
+        grid = None
+
+        for season, paths in seasons.items():
+            layers = {}
+            for kind in ("start", "end"):
+                with rasterio.open(paths[kind]) as src:
+                    t = src.transform
+                    transform = (t.a, t.b, t.c, t.d, t.e, t.f)
+                    if grid is None:
+                        grid = (transform, (src.height, src.width))
+                    elif (transform, (src.height, src.width)) != grid:
+                        raise ValueError(f"Crop calendar {paths[kind]} does not share the calendar grid")
+                    data = src.read(1)
+                    nodata = src.nodata if src.nodata is not None else CALENDAR_NODATA
+                    data = np.where((data == nodata) | ~np.isfinite(data), CALENDAR_NODATA, data)
+                    layers[kind] = np.ascontiguousarray(data, dtype=np.uint16)
+            arrays[season] = layers
+
+        return cls(arrays, grid[0])
+
+    @classmethod
+    def from_packed(cls, path, verify=True):
+        """
+        Memory-map a packed crop calendar file written by pack_crop_calendars().
+
+        Args:
+            path: path to the packed calendar file
+            verify: check the SHA-256 of the layer data against the header
+        """
+        with open(path, 'rb') as f:
+            magic = f.read(len(PACKED_MAGIC))
+            if magic != PACKED_MAGIC:
+                raise ValueError(f"{path} is not a packed crop calendar file")
+            header_size = int.from_bytes(f.read(4), 'little')
+            header = json.loads(f.read(header_size).decode('utf-8'))
+
+        data = np.memmap(path, dtype=np.dtype(header["dtype"]), mode='r',
+                         offset=header["data_offset"], shape=tuple(header["shape"]))
+        if verify and hashlib.sha256(data).hexdigest() != header["sha256"]:
+            raise ValueError(f"Checksum mismatch in packed crop calendar {path}")
+
+        seasons = {}
+        for i, name in enumerate(header["layers"]):
+            season, kind = name.split("/")
+            seasons.setdefault(season, {})[kind] = data[i]
+
+        return cls(seasons, header["transform"], header.get("nodata", CALENDAR_NODATA))
+
+    def pixel(self, lon, lat):
+        """Return the (row, col) of the calendar pixel containing lon/lat, or None if outside the grid."""
+        a, b, c, d, e, f = self.transform
+        col = int(np.floor((lon - c) / a))
+        row = int(np.floor((lat - f) / e))
+        if row < 0 or col < 0 or row >= self.shape[0] or col >= self.shape[1]:
+            return None
+        return row, col
+
+    def pixels(self, lons, lats):
+        """
+        Vectorized version of pixel() for arrays of coordinates.
+
+        Returns:
+            (rows, cols, inside) where inside is a boolean mask of coordinates within the grid;
+            rows/cols are clipped to the grid so they can always be used for indexing.
+        """
+        a, b, c, d, e, f = self.transform
+        cols = np.floor((np.asarray(lons, dtype=np.float64) - c) / a).astype(np.int64)
+        rows = np.floor((np.asarray(lats, dtype=np.float64) - f) / e).astype(np.int64)
+        inside = (rows >= 0) & (cols >= 0) & (rows < self.shape[0]) & (cols < self.shape[1])
+        return np.clip(rows, 0, self.shape[0] - 1), np.clip(cols, 0, self.shape[1] - 1), inside
+
+    def nearest_valid_index(self, season):
+        """
+        Return the nearest-valid-pixel index of a season, building it on first use.
+
+        Returns:
+            int32 array of the calendar shape holding, for every pixel, the flat index of the
+            nearest pixel with start and end of season data (the pixel itself if it has data),
+            or -1 if there is none within NEAREST_VALID_MAX_PIXELS
+        """
+        index = self._nearest_valid.get(season)
+        if index is None:
+            layers = self.seasons[season]
+            valid = (np.asarray(layers["start"]) != self.nodata) & (np.asarray(layers["end"]) != self.nodata)
+            index = nearest_valid_index(valid, NEAREST_VALID_MAX_PIXELS)
+            self._nearest_valid[season] = index
+        return index
+
+    def day_of_year(self, lon, lat, season, nearest_valid=True):
+        """
+        Look up the start and end of season day-of-year for a coordinate.
+
+        Args:
+            nearest_valid: on a pixel without calendar data, fall back to the nearest pixel with data
+
+        Returns:
+            (start_day, end_day) as ints
+        """
+        if season not in self.seasons:
+            raise ValueError(f"Unknown season '{season}'")
+        pixel = self.pixel(lon, lat)
+        if pixel is None:
+            raise ValueError(f"Coordinate ({lon}, {lat}) is outside the crop calendar extent")
+        if nearest_valid:
+            nearest = int(self.nearest_valid_index(season)[pixel])
+            if nearest < 0:
+                raise ValueError(f"No {season} crop calendar data at or near ({lon}, {lat})")
+            pixel = divmod(nearest, self.shape[1])
+        layers = self.seasons[season]
+        start_day = int(layers["start"][pixel])
+        end_day = int(layers["end"][pixel])
+        if start_day == self.nodata or end_day == self.nodata:
+            raise ValueError(f"No {season} crop calendar data at ({lon}, {lat})")
+        return start_day, end_day
+
+    def dates(self, lon, lat, season, year, nearest_valid=True):
+        """
+        Look up the start and end of season dates for a coordinate.
+
+        Returns:
+            (start_date_str, end_date_str) formatted as YYYY-MM-DD
+        """
+        start_day, end_day = self.day_of_year(lon, lat, season, nearest_valid)
+
+        # Handle crop calendars that span across years, like a season starting in September and ending in March
+        end_year = year + 1 if end_day < start_day else year
+
+        return get_date_from_day_of_year(start_day, year), get_date_from_day_of_year(end_day, end_year)
+
+    def day_of_year_batch(self, lons, lats, season, nearest_valid=True):
+        """
+        Look up the start and end of season day-of-year for arrays of coordinates.
+
+        Args:
+            nearest_valid: on pixels without calendar data, fall back to the nearest pixel with data
+
+        Returns:
+            (start_days, end_days, valid) where start_days/end_days are uint16 arrays and
+            valid is False for coordinates outside the grid or without (nearby) calendar data
+        """
+        if season not in self.seasons:
+            raise ValueError(f"Unknown season '{season}'")
+        rows, cols, inside = self.pixels(lons, lats)
+        if nearest_valid:
+            nearest = self.nearest_valid_index(season)[rows, cols]
+            inside = inside & (nearest >= 0)
+            rows, cols = np.divmod(np.maximum(nearest, 0), self.shape[1])
+        layers = self.seasons[season]
+        start_days = layers["start"][rows, cols]
+        end_days = layers["end"][rows, cols]
+        valid = inside & (start_days != self.nodata) & (end_days != self.nodata)
+        return start_days, end_days, valid
+
+    def dates_batch(self, lons, lats, season, year, nearest_valid=True):
+        """
+        Look up the start and end of season dates for arrays of coordinates.
+
+        Returns:
+            dict with 'start_day', 'end_day' (uint16), 'sos', 'eos' (datetime64[D], NaT where
+            no date could be determined) and the boolean 'valid' mask
+        """
+        start_days, end_days, valid = self.day_of_year_batch(lons, lats, season, nearest_valid)
+        sos = days_to_dates(start_days, np.full(start_days.shape, year))
+        # Handle crop calendars that span across years, like a season starting in September and ending in March
+        eos = days_to_dates(end_days, np.where(end_days < start_days, year + 1, year))
+        valid = valid & ~np.isnat(sos) & ~np.isnat(eos)
+        return {
+            "start_day": start_days,
+            "end_day": end_days,
+            "sos": np.where(valid, sos, np.datetime64("NaT")),
+            "eos": np.where(valid, eos, np.datetime64("NaT")),
+            "valid": valid,
+        }
+
+    def window(self, min_lon, min_lat, max_lon, max_lat):
+        """
+        Return the (row_slice, col_slice) of calendar pixels intersecting a bbox, clipped to the grid.
+
+        Edge pixels the bbox overlaps by less than WINDOW_EDGE_TOLERANCE of a pixel are left out,
+        but the window always holds at least one pixel per axis.
+        """
+        a, b, c, d, e, f = self.transform
+        col_start = int(np.floor((min_lon - c) / a + WINDOW_EDGE_TOLERANCE))
+        col_stop = max(int(np.ceil((max_lon - c) / a - WINDOW_EDGE_TOLERANCE)), col_start + 1)
+        row_start = int(np.floor((max_lat - f) / e + WINDOW_EDGE_TOLERANCE))
+        row_stop = max(int(np.ceil((min_lat - f) / e - WINDOW_EDGE_TOLERANCE)), row_start + 1)
+        rows = slice(max(row_start, 0), max(min(row_stop, self.shape[0]), 0))
+        cols = slice(max(col_start, 0), max(min(col_stop, self.shape[1]), 0))
+        return rows, cols
+
+    def zonal_day_of_year(self, min_lon, min_lat, max_lon, max_lat, season):
+        """
+        Collect the start and end of season day-of-year of every calendar pixel in a bbox.
+
+        Only the bbox window of each layer is read, and pixels without calendar data are dropped.
+
+        Returns:
+            (start_days, end_days) as 1D uint16 arrays of equal length
+        """
+        if season not in self.seasons:
+            raise ValueError(f"Unknown season '{season}'")
+        rows, cols = self.window(min_lon, min_lat, max_lon, max_lat)
+        layers = self.seasons[season]
+        start_days = np.asarray(layers["start"][rows, cols]).ravel()
+        end_days = np.asarray(layers["end"][rows, cols]).ravel()
+        valid = (start_days != self.nodata) & (end_days != self.nodata)
+        return start_days[valid], end_days[valid]
+
+
+def nearest_valid_index(valid, max_distance):
+    """
+    Map every pixel of a grid to the flat index of its nearest valid pixel.
+
+    Nearest sources are propagated one pixel per iteration to the 8 neighbours, keeping the
+    candidate with the smallest euclidean distance, for at most max_distance iterations.
+
+    Args:
+        valid: 2D boolean array of pixels with data
+        max_distance: search radius in pixels
+
+    Returns:
+        int32 array shaped like valid, -1 where no valid pixel is within max_distance
+    """
+    n_rows, n_cols = valid.shape
+    row_index, col_index = np.indices(valid.shape)
+    nearest = np.where(valid, np.arange(valid.size).reshape(valid.shape), -1)
+    distance2 = np.where(valid, 0, np.inf)
+
+    for _ in range(max_distance):
+        for d_row in (-1, 0, 1):
+            for d_col in (-1, 0, 1):
+                if d_row == 0 and d_col == 0:
+                    continue
+                # candidate[r, c] = nearest[r + d_row, c + d_col]
+                candidate = np.full(valid.shape, -1)
+                candidate[max(-d_row, 0):n_rows - max(d_row, 0), max(-d_col, 0):n_cols - max(d_col, 0)] = \
+                    nearest[max(d_row, 0):n_rows - max(-d_row, 0), max(d_col, 0):n_cols - max(-d_col, 0)]
+                candidate_row, candidate_col = np.divmod(candidate, n_cols)
+                candidate_distance2 = np.where(
+                    candidate >= 0, (candidate_row - row_index) ** 2 + (candidate_col - col_index) ** 2, np.inf
+                )
+                better = candidate_distance2 < distance2
+                nearest = np.where(better, candidate, nearest)
+                distance2 = np.where(better, candidate_distance2, distance2)
+
+    nearest[distance2 > max_distance ** 2] = -1
+    return nearest.astype(np.int32)
+
+
+def unwrap_day_of_year(days, days_in_year=365):
+    """
+    Unwrap circular day-of-year values onto a continuous axis centred on their circular mean.
+
+    E.g. [360, 5] becomes [360, 370], so differences and percentiles are meaningful for
+    seasons around the new year.
+    """
+    days = np.asarray(days, dtype=np.float64)
+    angles = 2 * np.pi * (days - 1) / days_in_year
+    mean_angle = np.arctan2(np.sin(angles).mean(), np.cos(angles).mean())
+    reference = 1 + mean_angle * days_in_year / (2 * np.pi)
+    half_year = days_in_year / 2
+    return reference + (days - reference + half_year) % days_in_year - half_year
+
+
+def day_of_year_stats(days, days_in_year=365):
+    """
+    Summarize the distribution of day-of-year values.
+
+    Days are treated as circular, so a set of dates around the new year (e.g. 360 and 5)
+    is summarized as a narrow spread rather than as opposite ends of the year.
+
+    Returns:
+        dict with 'count', 'median', 'mode' (day-of-year, 1-based), 'p10', 'p90' and
+        'spread' (p90 - p10, in days)
+    """
+    days = np.asarray(days, dtype=np.float64)
+    if days.size == 0:
+        raise ValueError("No crop calendar data to summarize")
+
+    # Percentiles are taken on the unwrapped, continuous axis
+    unwrapped = unwrap_day_of_year(days, days_in_year)
+
+    p10, median, p90 = np.percentile(unwrapped, [10, 50, 90])
+    mode = np.bincount(days.astype(np.int64)).argmax()
+
+    def wrap(day):
+        return int((np.rint(day) - 1) % days_in_year + 1)
+
+    return {
+        "count": int(days.size),
+        "median": wrap(median),
+        "mode": int(mode),
+        "p10": wrap(p10),
+        "p90": wrap(p90),
+        "spread": float(p90 - p10),
+    }
+
+
+def days_to_dates(days, years):
+    """
+    Vectorized get_date_from_day_of_year: convert day-of-year and year arrays to datetime64[D].
+
+    Out of range days (including day 366 of a non-leap year) become NaT.
+    """
+    days = np.asarray(days, dtype=np.int64)
+    years = np.asarray(years, dtype=np.int64)
+    jan_first = (years - 1970).astype("datetime64[Y]").astype("datetime64[D]")
+    dates = jan_first + (days - 1).astype("timedelta64[D]")
+    in_year = (days >= 1) & (days <= 366) & (dates.astype("datetime64[Y]").astype(np.int64) + 1970 == years)
+    return np.where(in_year, dates, np.datetime64("NaT"))
+
+
+def pack_crop_calendars(seasons, output_path):
+    """
+    Pack the crop calendar GeoTIFFs into a single checksummed, memory-mappable file.
+
+    Layout: PACKED_MAGIC, a little-endian uint32 header size, a JSON header (layer names,
+    shape, dtype, geotransform, nodata, SHA-256 of the data, data offset), then the layers
+    as one C-ordered uint16 array of shape (layers, rows, cols) aligned to 64 bytes.
+
+    Args:
+        seasons: mapping {season: {"start": tif_path, "end": tif_path}}
+        output_path: path of the packed file to write
+
+    Returns:
+        output_path
+    """
+    index = CropCalendarIndex.from_tifs(seasons)
+    names = [f"{season}/{kind}" for season in sorted(index.seasons) for kind in ("start", "end")]
+    data = np.stack([index.seasons[name.split("/")[0]][name.split("/")[1]] for name in names]).astype('<u2')
+
+    header = {
+        "layers": names,
+        "shape": list(data.shape),
+        "dtype": data.dtype.str,
+        "transform": list(index.transform),
+        "nodata": index.nodata,
+        "sha256": hashlib.sha256(data).hexdigest(),
+        "data_offset": 0,
+    }
+    # The data offset is part of the header, so iterate until the encoded size is stable
+    while True:
+        encoded = json.dumps(header).encode('utf-8')
+        prefix_size = len(PACKED_MAGIC) + 4 + len(encoded)
+        data_offset = -(-prefix_size // PACKED_ALIGNMENT) * PACKED_ALIGNMENT
+        if data_offset == header["data_offset"]:
+            break
+        header["data_offset"] = data_offset
+
+    with open(output_path, 'wb') as f:
+        f.write(PACKED_MAGIC)
+        f.write(len(encoded).to_bytes(4, 'little'))
+        f.write(encoded)
+        f.write(b'\0' * (data_offset - prefix_size))
+        f.write(data.tobytes())
+
+    return output_path
+
+
+_calendar_indexes = {}
+# Date lookups run in worker threads; only one of them loads a calendar
+_calendar_indexes_lock = threading.Lock()
+
+
+def get_crop_calendar_index(calendar):
+    """
+    Return the session-wide CropCalendarIndex for a calendar, loading it on first use.
+
+    Args:
+        calendar: path to a packed calendar file, or a {season: {"start": path, "end": path}}
+            mapping of GeoTIFFs
+    """
+    if isinstance(calendar, dict):
+        key = tuple(sorted((season, paths["start"], paths["end"]) for season, paths in calendar.items()))
+    else:
+        key = calendar
+    with _calendar_indexes_lock:
+        index = _calendar_indexes.get(key)
+        if index is None:
+            if isinstance(calendar, dict):
+                index = CropCalendarIndex.from_tifs(calendar)
+            else:
+                index = CropCalendarIndex.from_packed(calendar)
+            _calendar_indexes[key] = index
+    return index
+
+
+if __name__ == "__main__":
+    # Build step: python crop_calendar.py <calendar_dir> [output_file]
+    calendar_dir = sys.argv[1]
+    output_path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(calendar_dir, CROP_CALENDAR_PACKED_FILE)
+    pack_crop_calendars(calendar_paths(calendar_dir), output_path)
+    print(output_path)
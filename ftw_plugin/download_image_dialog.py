@@ -3,7 +3,7 @@ from qgis.PyQt import uic
 from qgis.PyQt import QtWidgets
 from qgis.PyQt import QtCore
 from qgis.PyQt.QtCore import QDate
-from qgis.core import QgsProject, QgsMapLayer, QgsRectangle, QgsCoordinateTransform
+from qgis.core import QgsProject, QgsMapLayer, QgsRectangle, QgsCoordinateTransform, QgsCoordinateReferenceSystem, QgsWkbTypes
 from qgis.gui import QgsMapCanvas
 import tempfile
 import sys
@@ -12,6 +12,21 @@ import json
 import urllib.request
 from qgis.core import QgsApplication
 from .ftw_plugin_dialog import setup_ftw_env
+from .crop_calendar import CROP_CALENDAR_PACKED_FILE, CropCalendarIndex, get_crop_calendar_index
+
+# Delay after the last ROI/season/year edit before season dates are recomputed
+DATE_UPDATE_DELAY_MS = 400
+
+def format_extent(extent, crs):
+    """
+    Format an extent as an ROI string 'xmin, ymax; xmax, ymin [authid]'.
+
+    Coordinates keep sub-meter precision: 8 decimals for geographic CRSs (about 1 mm) and
+    3 decimals for projected ones.
+    """
+    precision = 8 if crs.isGeographic() else 3
+    return (f"{extent.xMinimum():.{precision}f}, {extent.yMaximum():.{precision}f}; "
+            f"{extent.xMaximum():.{precision}f}, {extent.yMinimum():.{precision}f} [{crs.authid()}]")
 
 # This loads your .ui file so that PyQt can populate your plugin with the elements from Qt Designer
 FORM_CLASS, _ = uic.loadUiType(os.path.join(
@@ -31,32 +46,18 @@ class DownloadImageDialog(QtWidgets.QDialog, FORM_CLASS):
         )
         os.makedirs(self.crop_calendar_dir, exist_ok=True)
         
-        # Define crop calendar files
-        self.crop_calendar_files = {
-            "summer": {
-                "start": "sc_sos_3x3_v2.tiff",
-                "end": "sc_eos_3x3_v2.tiff"
-            },
-            "winter": {
-                "start": "wc_sos_3x3_v2.tiff",
-                "end": "wc_eos_3x3_v2.tiff"
-            }
-        }
+        # Packed crop calendar file holding all season layers
+        self.crop_calendar_file = os.path.join(self.crop_calendar_dir, CROP_CALENDAR_PACKED_FILE)
         
-        # Download crop calendar files if needed
+        # Download crop calendar file if needed
         self.download_crop_calendars()
         
-        # Define season TIF paths using local files
-        self.seasons = {
-            "summer": {
-                "start": os.path.join(self.crop_calendar_dir, self.crop_calendar_files["summer"]["start"]),
-                "end": os.path.join(self.crop_calendar_dir, self.crop_calendar_files["summer"]["end"])
-            },
-            "winter": {
-                "start": os.path.join(self.crop_calendar_dir, self.crop_calendar_files["winter"]["start"]),
-                "end": os.path.join(self.crop_calendar_dir, self.crop_calendar_files["winter"]["end"])
-            }
-        }
+        # Debounce date recomputation: it runs once edits have stopped for DATE_UPDATE_DELAY_MS
+        self.date_update_timer = QtCore.QTimer(self)
+        self.date_update_timer.setSingleShot(True)
+        self.date_update_timer.timeout.connect(self.update_dates_from_season)
+        self.date_request_id = 0
+        self.date_threads = set()
         
         # Set default dates
         self.sos_date.setDate(QDate(2024, 6, 1))  # 01/06/2024
@@ -84,6 +85,40 @@ class DownloadImageDialog(QtWidgets.QDialog, FORM_CLASS):
         self.layer_menu = QtWidgets.QMenu("Calculate from layer", self)
         self.roi_menu.addMenu(self.layer_menu)
         
+        # Create submenu and action for polygon areas of interest
+        self.polygon_layer_menu = QtWidgets.QMenu("Use polygons from layer", self)
+        self.roi_menu.addMenu(self.polygon_layer_menu)
+        self.enter_polygon_action = self.roi_menu.addAction("Enter polygon (WKT or GeoJSON)...")
+        self.enter_polygon_action.triggered.connect(self.enter_polygon)
+        
+        # Create submenu and action to queue the downloads of several AOIs
+        self.queue_layer_menu = QtWidgets.QMenu("Queue downloads of layer features", self)
+        self.roi_menu.addMenu(self.queue_layer_menu)
+        self.queue_bboxes_action = self.roi_menu.addAction("Queue downloads of ROIs...")
+        self.queue_bboxes_action.triggered.connect(self.queue_bboxes)
+        
+        # Polygon area of interest in EPSG:4326, and the ROI text set for it
+        self.aoi_geometry = None
+        self.aoi_bbox_text = None
+        # Download size and Sentinel-2 tiles of the ROI, shown in its tooltip
+        self.roi_size_text = ""
+        
+        # Create menu for download options
+        self.options_menu = QtWidgets.QMenu(self)
+        self.zonal_dates_action = self.options_menu.addAction("Season dates from whole area (zonal)")
+        self.zonal_dates_action.setCheckable(True)
+        self.zonal_dates_action.toggled.connect(self.on_roi_changed)
+        self.split_zones_action = self.options_menu.addAction("Separate windows per calendar zone")
+        self.split_zones_action.setCheckable(True)
+        self.vet_quicklooks_action = self.options_menu.addAction("Vet top scenes with quicklooks")
+        self.vet_quicklooks_action.setCheckable(True)
+        self.composite_action = self.options_menu.addAction("Cloud-free composite of several scenes")
+        self.composite_action.setCheckable(True)
+        self.native_reader_action = self.options_menu.addAction("Read only the ROI from the COGs (native reader)")
+        self.native_reader_action.setCheckable(True)
+        self.native_reader_action.setChecked(True)
+        self.download_options_button.setMenu(self.options_menu)
+        
         # Connect the property override button
         self.roi_extraction_button.clicked.connect(self.show_roi_menu)
         
@@ -110,6 +145,9 @@ class DownloadImageDialog(QtWidgets.QDialog, FORM_CLASS):
         # Initialize conda environment
         self.conda_env = None
         
+        # STAC source scenes are searched in, Planetary Computer unless set in the settings
+        self.stac_source = None
+        
         # Import download utilities only after UI is set up
         self.setup_download_utils()
         
@@ -121,49 +159,52 @@ class DownloadImageDialog(QtWidgets.QDialog, FORM_CLASS):
         self.refresh_raster_list()
     
     def download_crop_calendars(self):
-        """Download crop calendar files if they don't exist."""
+        """Download the packed crop calendar file if it doesn't exist."""
         base_url = "https://github.com/fieldsoftheworld/ftw-qgis-plugin/raw/main/resources/global_crop_calendars/"
-        
-        for season, files in self.crop_calendar_files.items():
-            for file_type, filename in files.items():
-                local_path = os.path.join(self.crop_calendar_dir, filename)
+        filename = CROP_CALENDAR_PACKED_FILE
+        local_path = self.crop_calendar_file
+        
+        if not os.path.exists(local_path):
+            try:
+                # Show progress dialog
+                progress = QtWidgets.QProgressDialog(
+                    f"Downloading {filename}...",
+                    "Cancel",
+                    0,
+                    100,
+                    self
+                )
+                progress.setWindowTitle("Downloading Crop Calendars")
+                progress.setWindowModality(QtCore.Qt.WindowModal)
+                progress.show()
+                
+                def update_progress(block_num, block_size, total_size):
+                    if total_size > 0:
+                        percent = min(100, int(block_num * block_size * 100 / total_size))
+                        progress.setValue(percent)
+                        QtWidgets.QApplication.processEvents()
+                
+                # Download to a temporary name so an interrupted download is never picked up
+                partial_path = local_path + ".part"
+                urllib.request.urlretrieve(
+                    base_url + filename,
+                    partial_path,
+                    reporthook=update_progress
+                )
                 
-                if not os.path.exists(local_path):
-                    try:
-                        # Show progress dialog
-                        progress = QtWidgets.QProgressDialog(
-                            f"Downloading {filename}...",
-                            "Cancel",
-                            0,
-                            100,
-                            self
-                        )
-                        progress.setWindowTitle("Downloading Crop Calendars")
-                        progress.setWindowModality(QtCore.Qt.WindowModal)
-                        progress.show()
-                        
-                        def update_progress(block_num, block_size, total_size):
-                            if total_size > 0:
-                                percent = min(100, int(block_num * block_size * 100 / total_size))
-                                progress.setValue(percent)
-                                QtWidgets.QApplication.processEvents()
-                        
-                        # Download the file
-                        urllib.request.urlretrieve(
-                            base_url + filename,
-                            local_path,
-                            reporthook=update_progress
-                        )
-                        
-                        progress.close()
-                        
-                    except Exception as e:
-                        QtWidgets.QMessageBox.critical(
-                            self,
-                            "Error",
-                            f"Failed to download {filename}: {str(e)}"
-                        )
-                        return False
+                # Verify the checksum before putting the file in place
+                CropCalendarIndex.from_packed(partial_path)
+                os.replace(partial_path, local_path)
+                
+                progress.close()
+                
+            except Exception as e:
+                QtWidgets.QMessageBox.critical(
+                    self,
+                    "Error",
+                    f"Failed to download {filename}: {str(e)}"
+                )
+                return False
         
         return True
     
@@ -191,6 +232,9 @@ class DownloadImageDialog(QtWidgets.QDialog, FORM_CLASS):
             if not conda_path:
                 raise RuntimeError("Conda path not found in settings. Please configure the plugin first.")
             
+            # Optional STAC source: a STAC API URL or a local catalog/directory mirror
+            self.stac_source = settings.get('stac_source')
+            
             # Extract the base conda path from conda.sh path
             if conda_path.endswith('conda.sh'):
                 conda_base = os.path.dirname(os.path.dirname(os.path.dirname(conda_path)))
@@ -208,11 +252,58 @@ class DownloadImageDialog(QtWidgets.QDialog, FORM_CLASS):
                 self.conda_env = os.path.join(conda_base, 'envs', env_name)
             
             # Now import the download utilities
-            from .download_utils import parse_coordinates, calculate_window_dates, extract_patch, get_dates_from_tifs
+            from .download_utils import parse_coordinates, calculate_window_dates, extract_patch, get_zonal_season_dates
+            from .download_utils import split_roi_by_calendar_zones, extract_zone_patches, mosaic_patches
+            from .download_utils import estimate_download_size, get_sentinel2_tiles, QUICKLOOK_CANDIDATES, COMPOSITE_SCENES, PREVIEW_RESOLUTIONS
+            from .download_utils import STORAGE_PROFILES, STORAGE_BLOCK_SIZES, DEFAULT_STORAGE_BLOCK_SIZE
+            from .download_utils import parse_aoi_geometry, aoi_from_layer, restrict_tiles_to_aoi, restrict_zones_to_aoi, mask_to_aoi, aois_from_layer_features
             self.parse_coordinates = parse_coordinates
             self.calculate_window_dates = calculate_window_dates
             self.extract_patch = extract_patch
-            self.get_dates_from_tifs = get_dates_from_tifs
+            self.get_zonal_season_dates = get_zonal_season_dates
+            self.split_roi_by_calendar_zones = split_roi_by_calendar_zones
+            self.extract_zone_patches = extract_zone_patches
+            self.mosaic_patches = mosaic_patches
+            self.estimate_download_size = estimate_download_size
+            self.get_sentinel2_tiles = get_sentinel2_tiles
+            self.quicklook_candidates = QUICKLOOK_CANDIDATES
+            self.composite_scenes = COMPOSITE_SCENES
+            
+            # Download at full resolution, or a preview read from the COG overviews
+            self.preview_menu = self.options_menu.addMenu("Resolution")
+            self.preview_resolution_group = QtWidgets.QActionGroup(self)
+            for resolution in (None,) + PREVIEW_RESOLUTIONS:
+                action = self.preview_menu.addAction(
+                    "Full resolution (10 m)" if resolution is None else f"Preview at {resolution} m"
+                )
+                action.setCheckable(True)
+                action.setChecked(resolution is None)
+                action.setData(resolution)
+                self.preview_resolution_group.addAction(action)
+            
+            # Layout of the output GeoTIFF (see storage_profiles.py)
+            self.storage_menu = self.options_menu.addMenu("Storage profile")
+            self.storage_profile_group = QtWidgets.QActionGroup(self)
+            for profile in (None,) + tuple(STORAGE_PROFILES):
+                action = self.storage_menu.addAction("Default layout" if profile is None else profile)
+                action.setCheckable(True)
+                action.setChecked(profile is None)
+                action.setData(profile)
+                self.storage_profile_group.addAction(action)
+            self.storage_menu.addSeparator()
+            self.block_size_group = QtWidgets.QActionGroup(self)
+            for block_size in STORAGE_BLOCK_SIZES:
+                action = self.storage_menu.addAction(f"{block_size} px blocks")
+                action.setCheckable(True)
+                action.setChecked(block_size == DEFAULT_STORAGE_BLOCK_SIZE)
+                action.setData(block_size)
+                self.block_size_group.addAction(action)
+            self.parse_aoi_geometry = parse_aoi_geometry
+            self.aoi_from_layer = aoi_from_layer
+            self.restrict_tiles_to_aoi = restrict_tiles_to_aoi
+            self.restrict_zones_to_aoi = restrict_zones_to_aoi
+            self.mask_to_aoi = mask_to_aoi
+            self.aois_from_layer_features = aois_from_layer_features
             
         except Exception as e:
             QtWidgets.QMessageBox.critical(
@@ -294,45 +385,128 @@ class DownloadImageDialog(QtWidgets.QDialog, FORM_CLASS):
             # Get the output filename
             output_filename = os.path.basename(output_path)
             
-            # Get cloud cover threshold
+            # Get cloud cover threshold and the download options
             max_cloud_cover = self.cloud_cover_threshold.value()
+            options = self.get_download_options()
+            preview_resolution = options['preview_resolution']
+            storage_profile = options['storage_profile']
+            block_size = options['block_size']
+            
+            # Polygon area of interest, if any
+            aoi = self.aoi_geometry
             
             # Update progress
+            if preview_resolution:
+                size = self.estimate_download_size((tl_lon, tl_lat), (br_lon, br_lat), resolution=preview_resolution)
+            else:
+                size = self.estimate_download_size((tl_lon, tl_lat), (br_lon, br_lat))
             self.progressBar.setValue(20)
-            self.progressBar.setFormat("Downloading images...")
+            self.progressBar.setFormat(f"Downloading images (~{size['bytes'] / 1024 ** 2:.0f} MB)...")
             QtWidgets.QApplication.processEvents()
             
-            # Extract patch using conda environment
-            output_file = self.extract_patch(
-                top_left=(tl_lon, tl_lat),
-                bottom_right=(br_lon, br_lat),
-                win_a_start=win_a_start,
-                win_a_end=win_a_end,
-                win_b_start=win_b_start,
-                win_b_end=win_b_end,
-                output_dir=output_dir,
-                output_filename=output_filename,
-                max_cloud_cover=max_cloud_cover,
-                conda_env=self.conda_env
-            )
+            if self.split_zones_action.isChecked():
+                # Search and download each crop calendar zone with its own windows
+                season = "winter" if self.winter_crops.isChecked() else "summer"
+                zones = self.split_roi_by_calendar_zones(
+                    (tl_lon, tl_lat), (br_lon, br_lat), self.crop_calendar_file,
+                    season_type=season, year=self.crop_year.value()
+                )
+                if aoi is not None:
+                    zones = self.restrict_zones_to_aoi(zones, aoi)
+                self.progressBar.setFormat(f"Downloading images for {len(zones)} calendar zones...")
+                QtWidgets.QApplication.processEvents()
+                
+                patch_files = self.extract_zone_patches(
+                    zones,
+                    output_dir=output_dir,
+                    output_filename=output_filename,
+                    max_cloud_cover=max_cloud_cover,
+                    conda_env=self.conda_env,
+                    options=options
+                )
+                
+                # Stitch the zone patches, or keep them as separate tiles if they can't be mosaicked;
+                # a mosaic masked below is only an intermediate VRT
+                mosaic_file = self.mosaic_patches(
+                    patch_files, os.path.splitext(output_path)[0] + ".vrt",
+                    storage_profile=storage_profile if aoi is None else None, block_size=block_size
+                )
+                output_files = [mosaic_file] if mosaic_file else patch_files
+            elif aoi is not None:
+                # Only download the parts of the bbox that intersect the polygon
+                tiles = self.restrict_tiles_to_aoi([[tl_lon, br_lat, br_lon, tl_lat]], aoi)
+                patch_files = self.extract_patch(
+                    top_left=(tl_lon, tl_lat),
+                    bottom_right=(br_lon, br_lat),
+                    win_a_start=win_a_start,
+                    win_a_end=win_a_end,
+                    win_b_start=win_b_start,
+                    win_b_end=win_b_end,
+                    output_dir=output_dir,
+                    output_filename=output_filename,
+                    max_cloud_cover=max_cloud_cover,
+                    conda_env=self.conda_env,
+                    tiles=tiles,
+                    options=options
+                )
+                mosaic_file = self.mosaic_patches(patch_files, os.path.splitext(output_path)[0] + ".vrt")
+                output_files = [mosaic_file] if mosaic_file else patch_files
+            else:
+                # Extract patch using conda environment
+                output_files = self.extract_patch(
+                    top_left=(tl_lon, tl_lat),
+                    bottom_right=(br_lon, br_lat),
+                    win_a_start=win_a_start,
+                    win_a_end=win_a_end,
+                    win_b_start=win_b_start,
+                    win_b_end=win_b_end,
+                    output_dir=output_dir,
+                    output_filename=output_filename,
+                    max_cloud_cover=max_cloud_cover,
+                    conda_env=self.conda_env,
+                    options=options
+                )
+                if isinstance(output_files, list):
+                    # Parts downloaded from several scenes
+                    mosaic_file = self.mosaic_patches(
+                        output_files, os.path.splitext(output_path)[0] + ".vrt",
+                        storage_profile=storage_profile, block_size=block_size
+                    )
+                    output_files = [mosaic_file] if mosaic_file else output_files
+                else:
+                    output_files = [output_files]
+            
+            # Mask everything outside the polygon
+            if aoi is not None:
+                self.progressBar.setFormat("Masking to the area of interest...")
+                QtWidgets.QApplication.processEvents()
+                if len(output_files) == 1:
+                    output_files = [self.mask_to_aoi(output_files[0], aoi, output_path, storage_profile, block_size)]
+                else:
+                    output_files = [
+                        self.mask_to_aoi(path, aoi, os.path.splitext(path)[0] + "_aoi.tif", storage_profile, block_size)
+                        for path in output_files
+                    ]
+            output_file = "\n".join(output_files)
             
             # Update progress
             self.progressBar.setValue(100)
             self.progressBar.setFormat("Download complete!")
             
-            # Add the layer to the map
+            # Add the layers to the map
             from qgis.core import QgsRasterLayer
-            layer = QgsRasterLayer(output_file, output_filename)
-            if layer.isValid():
-                QgsProject.instance().addMapLayer(layer)
-                # Center and zoom to the layer extent with proper CRS handling
-                self.center_map_on_layer(layer)
-            else:
-                QtWidgets.QMessageBox.warning(
-                    self,
-                    "Warning",
-                    "Image downloaded but could not be added to the map."
-                )
+            for path in output_files:
+                layer = QgsRasterLayer(path, os.path.basename(path))
+                if layer.isValid():
+                    QgsProject.instance().addMapLayer(layer)
+                    # Center and zoom to the layer extent with proper CRS handling
+                    self.center_map_on_layer(layer)
+                else:
+                    QtWidgets.QMessageBox.warning(
+                        self,
+                        "Warning",
+                        f"Image downloaded but could not be added to the map:\n{path}"
+                    )
             
             # Show success message
             QtWidgets.QMessageBox.information(
@@ -353,6 +527,126 @@ class DownloadImageDialog(QtWidgets.QDialog, FORM_CLASS):
             self.progressBar.setValue(0)
             self.progressBar.setFormat("Download failed")
     
+    def get_download_options(self):
+        """Return the extract_patch options set in the settings and the download options menu."""
+        return {
+            'stac_source': self.stac_source,
+            # Number of top scenes to vet with their quicklooks, 0 to take the least cloudy
+            'quicklook_candidates': self.quicklook_candidates if self.vet_quicklooks_action.isChecked() else 0,
+            # Number of scenes per window to composite, 0 to download one scene per window
+            'composite_scenes': self.composite_scenes if self.composite_action.isChecked() else 0,
+            # Read the bands' COGs directly rather than through `ftw inference download`
+            'native_reader': self.native_reader_action.isChecked(),
+            # Pixel size of a preview download, None for full resolution
+            'preview_resolution': self.preview_resolution_group.checkedAction().data(),
+            # Output GeoTIFF layout, None for the default one
+            'storage_profile': self.storage_profile_group.checkedAction().data(),
+            'block_size': self.block_size_group.checkedAction().data(),
+        }
+    
+    def queue_downloads(self, aois):
+        """
+        Open the download queue for several AOIs.
+        
+        Every AOI uses the windows of the form's season dates and the current download options,
+        and is downloaded next to the output path suffixed with _q1, _q2, ...; polygon AOIs are
+        restricted to the tiles they intersect and masked like a single polygon AOI.
+        
+        Args:
+            aois: list of (name, shapely geometry in EPSG:4326, True for a polygon AOI or False for a bbox)
+        """
+        from .download_queue import DownloadQueueDialog, QueueItem
+        
+        sos_date = self.sos_date.date().toString('yyyy-MM-dd')
+        eos_date = self.eos_date.date().toString('yyyy-MM-dd')
+        win_a_start, win_a_end, win_b_start, win_b_end = self.calculate_window_dates(sos_date, eos_date)
+        
+        output_path = self.download_tif_name.text() or os.path.join(tempfile.gettempdir(), "ftw_download_output.tif")
+        output_dir = os.path.dirname(output_path) or os.getcwd()
+        stem, ext = os.path.splitext(os.path.basename(output_path))
+        max_cloud_cover = self.cloud_cover_threshold.value()
+        options = self.get_download_options()
+        items = [QueueItem(name, geometry, polygon) for name, geometry, polygon in aois]
+        
+        def download(item, slot, max_bytes_per_second, rate_file, progress):
+            min_lon, min_lat, max_lon, max_lat = item.geometry.bounds
+            index = items.index(item) + 1
+            item_path = os.path.join(output_dir, f"{stem}_q{index}{ext}")
+            stats = {}
+            # Only download the parts of a polygon's bbox that intersect the polygon
+            tiles = self.restrict_tiles_to_aoi([[min_lon, min_lat, max_lon, max_lat]], item.geometry) if item.polygon else None
+            outputs = self.extract_patch(
+                top_left=(min_lon, max_lat),
+                bottom_right=(max_lon, min_lat),
+                win_a_start=win_a_start,
+                win_a_end=win_a_end,
+                win_b_start=win_b_start,
+                win_b_end=win_b_end,
+                output_dir=output_dir,
+                output_filename=f"{stem}_q{index}{ext}",
+                max_cloud_cover=max_cloud_cover,
+                conda_env=self.conda_env,
+                tiles=tiles,
+                options=dict(options, max_bytes_per_second=max_bytes_per_second, rate_file=rate_file),
+                worker_slot=slot,
+                stats=stats,
+                progress=progress
+            )
+            storage_profile, block_size = options['storage_profile'], options['block_size']
+            if isinstance(outputs, list):
+                mosaic_file = self.mosaic_patches(
+                    outputs, os.path.splitext(item_path)[0] + ".vrt",
+                    storage_profile=None if item.polygon else storage_profile, block_size=block_size
+                )
+                outputs = [mosaic_file] if mosaic_file else outputs
+            else:
+                outputs = [outputs]
+            if item.polygon:
+                if len(outputs) == 1:
+                    outputs = [self.mask_to_aoi(outputs[0], item.geometry, item_path, storage_profile, block_size)]
+                else:
+                    outputs = [
+                        self.mask_to_aoi(path, item.geometry, os.path.splitext(path)[0] + "_aoi.tif", storage_profile, block_size)
+                        for path in outputs
+                    ]
+            return outputs, stats
+        
+        DownloadQueueDialog(items, download, self).exec_()
+    
+    def queue_layer_features(self, layer_id):
+        """Queue the downloads of the (selected) features of a layer, one AOI per feature."""
+        layer = QgsProject.instance().mapLayer(layer_id)
+        if layer:
+            try:
+                aois = self.aois_from_layer_features(layer, selected_only=layer.selectedFeatureCount() > 0)
+            except Exception as e:
+                QtWidgets.QMessageBox.warning(self, "Error", f"Could not queue the features of {layer.name()}: {str(e)}")
+                return
+            self.queue_downloads([(name, geometry, True) for name, geometry in aois])
+    
+    def queue_bboxes(self):
+        """Queue the downloads of ROIs entered one per line, in the ROI field's format."""
+        from shapely.geometry import box
+        
+        text, ok = QtWidgets.QInputDialog.getMultiLineText(
+            self,
+            "Queue Downloads",
+            "One ROI per line (top left lon, top left lat; bottom right lon, bottom right lat [EPSG:XXXX]):"
+        )
+        if not ok or not text.strip():
+            return
+        aois = []
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            try:
+                _, (tl_lon, tl_lat), (br_lon, br_lat) = self.parse_coordinates(line)
+            except Exception as e:
+                QtWidgets.QMessageBox.warning(self, "Error", f"Invalid ROI '{line.strip()}': {str(e)}")
+                return
+            aois.append((line.strip(), box(tl_lon, br_lat, br_lon, tl_lat), False))
+        self.queue_downloads(aois)
+    
     def show_roi_menu(self):
         """Show the ROI extraction menu."""
         # Clear previous layer menu items
@@ -368,6 +662,10 @@ class DownloadImageDialog(QtWidgets.QDialog, FORM_CLASS):
                 action.setData(layer_id)
                 action.triggered.connect(lambda checked, lid=layer_id: self.calculate_from_layer(lid))
         
+        # Add polygon layers to the polygon submenu
+        self.populate_polygon_layer_menu(layers)
+        self.populate_queue_layer_menu(layers)
+        
         # Show the menu
         self.roi_menu.exec_(self.roi_extraction_button.mapToGlobal(
             self.roi_extraction_button.rect().bottomLeft()))
@@ -379,8 +677,7 @@ class DownloadImageDialog(QtWidgets.QDialog, FORM_CLASS):
         crs = canvas.mapSettings().destinationCrs()
         
         # Format the coordinates
-        coords = f"{extent.xMinimum():.2f}, {extent.yMaximum():.2f}; {extent.xMaximum():.2f}, {extent.yMinimum():.2f} [{crs.authid()}]"
-        self.roi_bbox.setText(coords)
+        self.roi_bbox.setText(format_extent(extent, crs))
     
     def calculate_from_layer(self, layer_id):
         """Calculate ROI from selected layer."""
@@ -390,8 +687,7 @@ class DownloadImageDialog(QtWidgets.QDialog, FORM_CLASS):
             crs = layer.crs()
             
             # Format the coordinates
-            coords = f"{extent.xMinimum():.2f}, {extent.yMaximum():.2f}; {extent.xMaximum():.2f}, {extent.yMinimum():.2f} [{crs.authid()}]"
-            self.roi_bbox.setText(coords)
+            self.roi_bbox.setText(format_extent(extent, crs))
     
     def browse_output(self):
         """Open file dialog to select output location."""
@@ -432,6 +728,69 @@ class DownloadImageDialog(QtWidgets.QDialog, FORM_CLASS):
                 action = self.layer_menu.addAction(layer.name())
                 action.setData(layer_id)
                 action.triggered.connect(lambda checked, lid=layer_id: self.calculate_from_layer(lid))
+        
+        # Add polygon layers to the polygon submenu
+        self.populate_polygon_layer_menu(layers)
+        self.populate_queue_layer_menu(layers)
+    
+    def populate_polygon_layer_menu(self, layers):
+        """Fill the polygon AOI submenu with the project's polygon layers."""
+        self.polygon_layer_menu.clear()
+        for layer_id, layer in layers.items():
+            if layer.type() == QgsMapLayer.VectorLayer and layer.geometryType() == QgsWkbTypes.PolygonGeometry:
+                action = self.polygon_layer_menu.addAction(layer.name())
+                action.setData(layer_id)
+                action.triggered.connect(lambda checked, lid=layer_id: self.use_polygons_from_layer(lid))
+    
+    def populate_queue_layer_menu(self, layers):
+        """Fill the queue submenu with the project's polygon layers."""
+        self.queue_layer_menu.clear()
+        for layer_id, layer in layers.items():
+            if layer.type() == QgsMapLayer.VectorLayer and layer.geometryType() == QgsWkbTypes.PolygonGeometry:
+                action = self.queue_layer_menu.addAction(layer.name())
+                action.setData(layer_id)
+                action.triggered.connect(lambda checked, lid=layer_id: self.queue_layer_features(lid))
+    
+    def use_polygons_from_layer(self, layer_id):
+        """Use the (selected) polygons of a layer as area of interest."""
+        layer = QgsProject.instance().mapLayer(layer_id)
+        if layer:
+            try:
+                self.set_aoi_geometry(self.aoi_from_layer(layer, selected_only=layer.selectedFeatureCount() > 0))
+            except Exception as e:
+                QtWidgets.QMessageBox.warning(self, "Error", f"Could not use {layer.name()} as area of interest: {str(e)}")
+    
+    def enter_polygon(self):
+        """Ask for a polygon area of interest as WKT or GeoJSON in EPSG:4326."""
+        text, ok = QtWidgets.QInputDialog.getMultiLineText(
+            self,
+            "Polygon Area of Interest",
+            "Polygon as WKT or GeoJSON (EPSG:4326):"
+        )
+        if ok and text.strip():
+            try:
+                self.set_aoi_geometry(self.parse_aoi_geometry(text))
+            except Exception as e:
+                QtWidgets.QMessageBox.warning(self, "Error", f"Invalid polygon: {str(e)}")
+    
+    def set_aoi_geometry(self, geometry):
+        """Use a polygon (EPSG:4326) as area of interest and set the ROI to its bbox."""
+        min_lon, min_lat, max_lon, max_lat = geometry.bounds
+        self.aoi_bbox_text = format_extent(
+            QgsRectangle(min_lon, min_lat, max_lon, max_lat), QgsCoordinateReferenceSystem('EPSG:4326')
+        )
+        self.aoi_geometry = geometry
+        self.roi_bbox.setText(self.aoi_bbox_text)
+        self.update_roi_tooltip()
+    
+    def update_roi_tooltip(self):
+        """Show whether a polygon area of interest is active, and the ROI's download size and tiles."""
+        lines = []
+        if self.aoi_geometry is not None:
+            lines.append(f"Polygon area of interest ({self.aoi_geometry.geom_type})")
+        if self.roi_size_text:
+            lines.append(self.roi_size_text)
+        self.roi_bbox.setToolTip("\n".join(lines))
     
     def on_crop_type_changed(self, checked):
         """Handle crop type radio button changes."""
@@ -440,88 +799,172 @@ class DownloadImageDialog(QtWidgets.QDialog, FORM_CLASS):
             
         # Only update dates if winter or summer is selected
         if self.winter_crops.isChecked() or self.summer_crops.isChecked():
-            self.update_dates_from_season()
+            self.schedule_date_update()
 
     def on_roi_changed(self):
         """Handle ROI text changes."""
+        # Editing the ROI by hand replaces a polygon area of interest
+        if self.aoi_geometry is not None and self.roi_bbox.text() != self.aoi_bbox_text:
+            self.aoi_geometry = None
+            self.aoi_bbox_text = None
+            self.update_roi_tooltip()
+        
         # Only update dates if winter or summer is selected
         if self.winter_crops.isChecked() or self.summer_crops.isChecked():
-            self.update_dates_from_season()
+            self.schedule_date_update()
 
     def on_year_changed(self, value):
         """Handle year spinbox changes."""
         # Only update dates if winter or summer is selected
         if self.winter_crops.isChecked() or self.summer_crops.isChecked():
-            self.update_dates_from_season()
+            self.schedule_date_update()
+
+    def schedule_date_update(self):
+        """(Re)start the debounce timer, so dates are recomputed once edits stop."""
+        self.date_update_timer.start(DATE_UPDATE_DELAY_MS)
 
     def update_dates_from_season(self):
-        """Update dates based on selected season and coordinates."""
-        try:
-            # Check if we have coordinates
-            if not self.roi_bbox.text():
-                return
-            
-            # Get the selected season
-            season = "winter" if self.winter_crops.isChecked() else "summer"
-            
-            # Get the center point from coordinates
-            (center_lon, center_lat), _, _ = self.parse_coordinates(self.roi_bbox.text())
-            
-            # Create a point geometry
-            from shapely.geometry import Point
-            point = Point(center_lon, center_lat)
-            
-            # Get the TIF paths for the selected season
-            start_tif = self.seasons[season]["start"]
-            end_tif = self.seasons[season]["end"]
-            
-            # Get the year from the spinbox
-            year = self.crop_year.value()
-            
-            # Get dates from TIFs
-            start_date, end_date = self.get_dates_from_tifs(
-                point=point,
-                start_season_tif_path=start_tif,
-                end_season_tif_path=end_tif,
-                year=year,
-                season_type=season
+        """Recompute dates for the current season and coordinates in a background thread."""
+        # Check if we have coordinates
+        if not self.roi_bbox.text():
+            return
+        
+        # Every request gets a new id; results of older requests are dropped when they arrive
+        self.date_request_id += 1
+        
+        thread = SeasonDatesThread(
+            self,
+            self.date_request_id,
+            self.compute_season_dates,
+            self.roi_bbox.text(),
+            "winter" if self.winter_crops.isChecked() else "summer",
+            self.crop_year.value(),
+            self.zonal_dates_action.isChecked()
+        )
+        thread.result_ready.connect(self.apply_season_dates)
+        # Keep a reference until the thread is done so it isn't garbage collected while running
+        self.date_threads.add(thread)
+        thread.finished.connect(lambda: self.date_threads.discard(thread))
+        thread.start()
+
+    def compute_season_dates(self, roi_text, season, year, zonal):
+        """
+        Compute season and window dates for an ROI. Runs in a SeasonDatesThread, so it must not touch widgets.
+
+        Returns:
+            dict with the season, year, center, start/end dates, window dates, zonal warning,
+            download size and Sentinel-2 tiles
+        """
+        # Get the center point and corners from coordinates
+        (center_lon, center_lat), top_left, bottom_right = self.parse_coordinates(roi_text)
+        
+        # Look up dates in the resident crop calendar index, loaded once per session
+        calendar_index = get_crop_calendar_index(self.crop_calendar_file)
+        warning = None
+        if zonal:
+            zonal = self.get_zonal_season_dates(
+                top_left, bottom_right, self.crop_calendar_file, season_type=season, year=year
             )
-            
-            # Update the date widgets
-            start_qdate = QDate.fromString(start_date, "yyyy-MM-dd")
-            end_qdate = QDate.fromString(end_date, "yyyy-MM-dd")
-            
-            self.sos_date.setDate(start_qdate)
-            self.eos_date.setDate(end_qdate)
-            
-            # Calculate window dates
-            win_a_start, win_a_end, win_b_start, win_b_end = self.calculate_window_dates(start_date, end_date)
-            
-            # Convert window dates to M/d/yy format
-            win_a_start_date = QDate.fromString(win_a_start, "yyyy-MM-dd").toString("M/d/yy")
-            win_a_end_date = QDate.fromString(win_a_end, "yyyy-MM-dd").toString("M/d/yy")
-            win_b_start_date = QDate.fromString(win_b_start, "yyyy-MM-dd").toString("M/d/yy")
-            win_b_end_date = QDate.fromString(win_b_end, "yyyy-MM-dd").toString("M/d/yy")
-            
-            # Update window date fields
-            self.win_a_start_date.setText(win_a_start_date)
-            self.win_a_end_date.setText(win_a_end_date)
-            self.win_b_start_date.setText(win_b_start_date)
-            self.win_b_end_date.setText(win_b_end_date)
-            
-            # Print selected parameters for inspection
-            print("\nSelected Parameters:")
-            print(f"Season: {season}")
-            print(f"Year: {year}")
-            print(f"Center Coordinates: ({center_lon}, {center_lat})")
-            print(f"Start of Season: {start_date}")
-            print(f"End of Season: {end_date}")
-            print(f"Window A: {win_a_start_date} to {win_a_end_date}")
-            print(f"Window B: {win_b_start_date} to {win_b_end_date}")
-            print(f"Start TIF: {start_tif}")
-            print(f"End TIF: {end_tif}")
-            
+            start_date, end_date = zonal['start_date'], zonal['end_date']
+            warning = zonal['warning']
+        else:
+            start_date, end_date = calendar_index.dates(center_lon, center_lat, season, year)
+        
+        return {
+            'season': season,
+            'year': year,
+            'center': (center_lon, center_lat),
+            'start_date': start_date,
+            'end_date': end_date,
+            'windows': self.calculate_window_dates(start_date, end_date),
+            'warning': warning,
+            'size': self.estimate_download_size(top_left, bottom_right),
+            'sentinel2_tiles': self.get_sentinel2_tiles(top_left, bottom_right),
+        }
+
+    def done(self, result):
+        """Wait for the running date lookups before closing, so no thread outlives the dialog."""
+        # Also reached from closeEvent, through reject()
+        self.date_update_timer.stop()
+        for thread in list(self.date_threads):
+            thread.wait()
+        super().done(result)
+
+    def apply_season_dates(self, request_id, result, error):
+        """Update the date widgets with the result of a SeasonDatesThread, if it is the newest request."""
+        if request_id != self.date_request_id:
+            return
+        
+        if error:
+            # Don't show a message box here to avoid spamming the user while typing,
+            # only flag it on the progress bar. The error will be caught during the actual download
+            self.progressBar.setValue(0)
+            self.progressBar.setFormat("Could not set season dates for this area")
+            self.progressBar.setToolTip(error)
+            return
+        
+        # Flag on the progress bar when one window pair does not fit the whole area
+        warning = result['warning']
+        if warning:
+            self.progressBar.setValue(0)
+            self.progressBar.setFormat("Warning: season dates vary widely across the area")
+            self.progressBar.setToolTip(warning)
+        else:
+            self.progressBar.setFormat("%p%")
+            self.progressBar.setToolTip("")
+        
+        # Update the date widgets
+        start_date, end_date = result['start_date'], result['end_date']
+        self.sos_date.setDate(QDate.fromString(start_date, "yyyy-MM-dd"))
+        self.eos_date.setDate(QDate.fromString(end_date, "yyyy-MM-dd"))
+        
+        # Convert window dates to M/d/yy format
+        win_a_start, win_a_end, win_b_start, win_b_end = result['windows']
+        win_a_start_date = QDate.fromString(win_a_start, "yyyy-MM-dd").toString("M/d/yy")
+        win_a_end_date = QDate.fromString(win_a_end, "yyyy-MM-dd").toString("M/d/yy")
+        win_b_start_date = QDate.fromString(win_b_start, "yyyy-MM-dd").toString("M/d/yy")
+        win_b_end_date = QDate.fromString(win_b_end, "yyyy-MM-dd").toString("M/d/yy")
+        
+        # Update window date fields
+        self.win_a_start_date.setText(win_a_start_date)
+        self.win_a_end_date.setText(win_a_end_date)
+        self.win_b_start_date.setText(win_b_start_date)
+        self.win_b_end_date.setText(win_b_end_date)
+        
+        # Report what downloading the ROI will cost
+        size = result['size']
+        size_text = (f"Download size: {size['width']} x {size['height']} pixels, "
+                     f"about {size['bytes'] / 1024 ** 2:.1f} MB uncompressed")
+        tiles = result['sentinel2_tiles']
+        size_text += (f"\nSentinel-2 tiles: {', '.join(tiles['tiles'])} "
+                      f"(UTM zones {', '.join(f'EPSG:{epsg}' for epsg in tiles['utm_zones'])})")
+        self.roi_size_text = size_text
+        self.update_roi_tooltip()
+        
+        # Print selected parameters for inspection
+        center_lon, center_lat = result['center']
+        print("\nSelected Parameters:")
+        print(f"Season: {result['season']}")
+        print(f"Year: {result['year']}")
+        print(f"Center Coordinates: ({center_lon}, {center_lat})")
+        print(f"Start of Season: {start_date}")
+        print(f"End of Season: {end_date}")
+        print(f"Window A: {win_a_start_date} to {win_a_end_date}")
+        print(f"Window B: {win_b_start_date} to {win_b_end_date}")
+
+
+class SeasonDatesThread(QtCore.QThread):
+    """Run DownloadImageDialog.compute_season_dates off the GUI thread."""
+    result_ready = QtCore.pyqtSignal(int, object, str)  # request id, result, error message
+    
+    def __init__(self, parent, request_id, compute, *args):
+        super().__init__(parent)
+        self.request_id = request_id
+        self.compute = compute
+        self.args = args
+    
+    def run(self):
+        try:
+            self.result_ready.emit(self.request_id, self.compute(*self.args), "")
         except Exception as e:
-            # Don't show error message here to avoid spamming the user
-            # The error will be caught during the actual download
-            print(f"Error updating dates: {str(e)}") 
\ No newline at end of file
+            self.result_ready.emit(self.request_id, None, str(e))
@@ -0,0 +1,84 @@
+"""
+Progress manifest of a resumable stack download, run inside the FTW conda environment.
+
+A download is split into units (one band of one window over a strip of rows, see
+cog_reader.read_stack). Each finished unit is saved next to the output as a compressed file
+and recorded in a JSON manifest with its checksum, so an interrupted download picks up the
+missing units only and verifies the finished ones before reusing them.
+"""
+import hashlib
+import json
+import os
+import shutil
+import zlib
+
+import numpy as np
+
+MANIFEST_VERSION = 1
+# Fast compression: unit files only live until the output is assembled
+UNIT_COMPRESSION_LEVEL = 1
+
+
+class DownloadManifest:
+    """
+    Units done so far for one output file, kept in <output>.parts/manifest.json.
+
+    A manifest written for another request (other scenes, bbox, level or bands) is discarded
+    along with its units.
+    """
+
+    def __init__(self, output_path, signature):
+        self.directory = output_path + ".parts"
+        self.path = os.path.join(self.directory, "manifest.json")
+        # Compared with the signature read back from JSON, so normalized the same way
+        self.signature = json.loads(json.dumps(signature))
+        self.units = {}
+        try:
+            with open(self.path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = None
+        if manifest and manifest.get("version") == MANIFEST_VERSION and manifest.get("signature") == self.signature:
+            self.units = manifest["units"]
+        elif os.path.isdir(self.directory):
+            shutil.rmtree(self.directory)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _unit_path(self, unit):
+        return os.path.join(self.directory, unit.replace("/", "_") + ".bin")
+
+    def _write_manifest(self):
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"version": MANIFEST_VERSION, "signature": self.signature, "units": self.units}, f)
+        os.replace(temp_path, self.path)
+
+    def load_unit(self, unit, shape, dtype):
+        """Return the array of a finished unit, or None if it is missing or fails its checksum."""
+        record = self.units.get(unit)
+        if record is None:
+            return None
+        try:
+            with open(self._unit_path(unit), "rb") as f:
+                data = f.read()
+        except OSError:
+            data = None
+        if data is None or hashlib.sha256(data).hexdigest() != record:
+            print(f"Unit {unit} is missing or corrupt, downloading it again")
+            del self.units[unit]
+            return None
+        return np.frombuffer(zlib.decompress(data), dtype=dtype).reshape(shape)
+
+    def save_unit(self, unit, array):
+        """Save the array of a finished unit and record it."""
+        data = zlib.compress(np.ascontiguousarray(array).tobytes(), UNIT_COMPRESSION_LEVEL)
+        temp_path = self._unit_path(unit) + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, self._unit_path(unit))
+        self.units[unit] = hashlib.sha256(data).hexdigest()
+        self._write_manifest()
+
+    def remove(self):
+        """Delete the manifest and its units once the output is complete."""
+        shutil.rmtree(self.directory, ignore_errors=True)
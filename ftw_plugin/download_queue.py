@@ -0,0 +1,296 @@
+"""
+Queue of AOI downloads, run a few at a time next to the QGIS GUI.
+
+Each concurrent slot has its own scene search worker process (see get_scene_search_worker in
+download_utils.py), so slots search and download independently. A global bandwidth cap is
+shared equally between the slots that are downloading: each slot's share is written to a rate
+file its worker reads again while downloading, so the bandwidth of a slot going idle moves to
+the others. A failed item goes back to the end of the queue to be retried later, without
+holding up the other items.
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import deque
+
+from qgis.PyQt import QtCore, QtWidgets
+from qgis.core import QgsProject, QgsRasterLayer
+
+QUEUE_MAX_CONCURRENT = 2
+# Each slot runs its own worker process in the FTW conda environment
+QUEUE_MAX_CONCURRENT_LIMIT = 4
+QUEUE_RETRIES = 2
+QUEUE_RETRY_DELAY_SECONDS = 15
+
+QUEUED = "Queued"
+RUNNING = "Running"
+RETRYING = "Retrying"
+DONE = "Done"
+FAILED = "Failed"
+CANCELLED = "Cancelled"
+
+
+class QueueItem:
+    """One AOI of the queue and the state of its download."""
+
+    def __init__(self, name, geometry, polygon=False):
+        self.name = name
+        self.geometry = geometry  # shapely geometry in EPSG:4326
+        self.polygon = polygon  # True to download only the polygon, False for its bbox
+        self.status = QUEUED
+        self.attempts = 0
+        self.bytes_read = 0
+        self.seconds = 0.0
+        self.outputs = []
+        self.error = ""
+        self.not_before = 0.0  # time.monotonic() before which a retry doesn't start
+
+    @property
+    def throughput(self):
+        """Bytes per second of the last attempt, or None."""
+        return self.bytes_read / self.seconds if self.seconds else None
+
+
+class DownloadQueue(QtCore.QObject):
+    """
+    Run the downloads of queued items with at most max_concurrent at a time.
+
+    download(item, slot, max_bytes_per_second, rate_file, progress) runs in a slot's thread and
+    returns (output files, stats dict with 'bytes_read' and 'seconds'); rate_file, if not None,
+    holds the slot's current share of the bandwidth cap in bytes per second. While it runs, it
+    can call progress with a stats dict so far, so the item's throughput is shown live.
+    """
+    item_changed = QtCore.pyqtSignal(int)  # item index
+    finished = QtCore.pyqtSignal()
+
+    def __init__(self, items, download, max_concurrent=QUEUE_MAX_CONCURRENT, max_bytes_per_second=None,
+                 retries=QUEUE_RETRIES, retry_delay=QUEUE_RETRY_DELAY_SECONDS):
+        super().__init__()
+        self.items = items
+        self.download = download
+        self.max_concurrent = max(1, min(max_concurrent, len(items)))
+        self.max_bytes_per_second = max_bytes_per_second
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self._pending = deque(range(len(items)))
+        self._running = 0
+        self._running_slots = set()
+        self._active_slots = 0
+        self._cancelled = False
+        self._condition = threading.Condition()
+        self._rate_dir = None
+
+    def start(self):
+        self._active_slots = self.max_concurrent
+        if self.max_bytes_per_second:
+            self._rate_dir = tempfile.mkdtemp(prefix="ftw_download_queue_")
+        for slot in range(self.max_concurrent):
+            threading.Thread(target=self._run_slot, args=(slot,), daemon=True).start()
+
+    def cancel(self):
+        """Cancel the items that haven't started; running downloads finish."""
+        with self._condition:
+            self._cancelled = True
+            cancelled = list(self._pending)
+            self._pending.clear()
+            for index in cancelled:
+                self.items[index].status = CANCELLED
+            self._condition.notify_all()
+        for index in cancelled:
+            self.item_changed.emit(index)
+
+    def _rate_file(self, slot):
+        return os.path.join(self._rate_dir, f"slot{slot}.rate") if self._rate_dir else None
+
+    def _share(self):
+        # Bandwidth share of each downloading slot; called with the condition held
+        if not self.max_bytes_per_second:
+            return None
+        return self.max_bytes_per_second / max(1, len(self._running_slots))
+
+    def _rebalance(self):
+        # Give each downloading slot its new share; called with the condition held
+        share = self._share()
+        if share is None:
+            return
+        for slot in self._running_slots:
+            temp_path = self._rate_file(slot) + ".tmp"
+            with open(temp_path, "w") as f:
+                f.write(str(share))
+            os.replace(temp_path, self._rate_file(slot))
+
+    def _next_item(self, slot):
+        # Index of the next item ready to start, or None once nothing is left to run
+        with self._condition:
+            while True:
+                if self._cancelled:
+                    return None
+                now = time.monotonic()
+                for index in self._pending:
+                    if self.items[index].not_before <= now:
+                        self._pending.remove(index)
+                        self._running += 1
+                        self._running_slots.add(slot)
+                        self._rebalance()
+                        return index
+                if not self._pending and self._running == 0:
+                    return None
+                # Wait for a retry delay to pass, or for a running item to be requeued or finish
+                delays = [self.items[index].not_before - now for index in self._pending]
+                self._condition.wait(timeout=min(delays) if delays else None)
+
+    def _run_slot(self, slot):
+        while True:
+            index = self._next_item(slot)
+            if index is None:
+                break
+            with self._condition:
+                share = self._share()
+            item = self.items[index]
+            item.status = RUNNING
+            item.attempts += 1
+            item.error = ""
+            item.bytes_read = 0
+            item.seconds = 0.0
+            self.item_changed.emit(index)
+
+            def progress(stats, item=item, index=index):
+                item.bytes_read = stats.get('bytes_read', 0)
+                item.seconds = stats.get('seconds', 0.0)
+                self.item_changed.emit(index)
+
+            start = time.monotonic()
+            try:
+                item.outputs, stats = self.download(item, slot, share, self._rate_file(slot), progress)
+                item.bytes_read = stats.get('bytes_read', 0)
+                item.seconds = stats.get('seconds', time.monotonic() - start)
+                item.status = DONE
+            except Exception as e:
+                item.error = str(e)
+                item.seconds = time.monotonic() - start
+                item.status = RETRYING if item.attempts <= self.retries and not self._cancelled else FAILED
+            with self._condition:
+                self._running -= 1
+                self._running_slots.discard(slot)
+                self._rebalance()
+                if item.status == RETRYING:
+                    item.not_before = time.monotonic() + self.retry_delay * item.attempts
+                    self._pending.append(index)
+                self._condition.notify_all()
+            self.item_changed.emit(index)
+
+        with self._condition:
+            self._active_slots -= 1
+            last = self._active_slots == 0
+        if last:
+            if self._rate_dir:
+                shutil.rmtree(self._rate_dir, ignore_errors=True)
+            self.finished.emit()
+
+
+class DownloadQueueDialog(QtWidgets.QDialog):
+    """Table of queued AOI downloads with their status and throughput."""
+
+    COLUMNS = ["AOI", "Status", "Attempts", "Downloaded (MB)", "MB/s", "Output / error"]
+
+    def __init__(self, items, download, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Download Queue")
+        self.resize(800, 400)
+        self.items = items
+        self.download = download
+        self.queue = None
+
+        layout = QtWidgets.QVBoxLayout(self)
+        form = QtWidgets.QFormLayout()
+        self.concurrency = QtWidgets.QSpinBox()
+        self.concurrency.setRange(1, QUEUE_MAX_CONCURRENT_LIMIT)
+        self.concurrency.setValue(QUEUE_MAX_CONCURRENT)
+        form.addRow("Concurrent downloads", self.concurrency)
+        self.bandwidth_cap = QtWidgets.QDoubleSpinBox()
+        self.bandwidth_cap.setRange(0, 10000)
+        self.bandwidth_cap.setSuffix(" MB/s")
+        self.bandwidth_cap.setSpecialValueText("Unlimited")
+        form.addRow("Bandwidth cap", self.bandwidth_cap)
+        self.retries = QtWidgets.QSpinBox()
+        self.retries.setRange(0, 10)
+        self.retries.setValue(QUEUE_RETRIES)
+        form.addRow("Retries per AOI", self.retries)
+        layout.addLayout(form)
+
+        self.table = QtWidgets.QTableWidget(len(items), len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.table.horizontalHeader().setStretchLastSection(True)
+        layout.addWidget(self.table)
+        for index in range(len(items)):
+            self.update_row(index)
+
+        buttons = QtWidgets.QDialogButtonBox()
+        self.start_button = buttons.addButton("Start", QtWidgets.QDialogButtonBox.AcceptRole)
+        self.cancel_button = buttons.addButton("Cancel queued", QtWidgets.QDialogButtonBox.ActionRole)
+        self.close_button = buttons.addButton(QtWidgets.QDialogButtonBox.Close)
+        self.cancel_button.setEnabled(False)
+        self.start_button.clicked.connect(self.start)
+        self.cancel_button.clicked.connect(self.cancel)
+        self.close_button.clicked.connect(self.close)
+        layout.addWidget(buttons)
+
+    def start(self):
+        cap = self.bandwidth_cap.value()
+        self.queue = DownloadQueue(
+            self.items, self.download,
+            max_concurrent=self.concurrency.value(),
+            max_bytes_per_second=cap * 1024 ** 2 if cap else None,
+            retries=self.retries.value(),
+        )
+        # Signals from the slot threads are delivered on the GUI thread
+        self.queue.item_changed.connect(self.on_item_changed)
+        self.queue.finished.connect(self.on_finished)
+        for widget in (self.start_button, self.concurrency, self.bandwidth_cap, self.retries):
+            widget.setEnabled(False)
+        self.cancel_button.setEnabled(True)
+        self.queue.start()
+
+    def cancel(self):
+        if self.queue is not None:
+            self.queue.cancel()
+
+    def update_row(self, index):
+        item = self.items[index]
+        throughput = item.throughput
+        values = [
+            item.name,
+            item.status,
+            str(item.attempts),
+            f"{item.bytes_read / 1024 ** 2:.1f}" if item.bytes_read else "",
+            f"{throughput / 1024 ** 2:.2f}" if throughput else "",
+            item.error or "\n".join(item.outputs),
+        ]
+        for column, value in enumerate(values):
+            self.table.setItem(index, column, QtWidgets.QTableWidgetItem(value))
+
+    def on_item_changed(self, index):
+        self.update_row(index)
+        item = self.items[index]
+        if item.status == DONE:
+            for path in item.outputs:
+                layer = QgsRasterLayer(path, os.path.basename(path))
+                if layer.isValid():
+                    QgsProject.instance().addMapLayer(layer)
+
+    def on_finished(self):
+        self.cancel_button.setEnabled(False)
+        done = sum(item.status == DONE for item in self.items)
+        QtWidgets.QMessageBox.information(
+            self,
+            "Download Queue",
+            f"{done} of {len(self.items)} AOIs downloaded."
+        )
+
+    def closeEvent(self, event):
+        # Running downloads finish in the background; nothing new starts
+        self.cancel()
+        super().closeEvent(event)
@@ -1,12 +1,53 @@
 import os
+from collections import OrderedDict, deque
 from datetime import datetime, timedelta
-from qgis.core import QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsProject
+from qgis.core import QgsCoordinateReferenceSystem, QgsCoordinateTransform, QgsProject, QgsRectangle
+import json
+import queue
 import subprocess
 import sys
 import tempfile
-import rasterio
-from rasterio.transform import rowcol
-from shapely.geometry import Point
+import threading
+import time
+import numpy as np
+from .crop_calendar import day_of_year_stats, get_crop_calendar_index, get_date_from_day_of_year, unwrap_day_of_year
+from .mgrs_grid import get_tile_index
+from .storage_profiles import STORAGE_PROFILES, STORAGE_BLOCK_SIZES, DEFAULT_STORAGE_PROFILE, DEFAULT_STORAGE_BLOCK_SIZE, gdal_creation_options
+
+# Maximum number of CRS kept in the process-wide cache
+CRS_CACHE_SIZE = 32
+
+_crs_cache = OrderedDict()
+_crs_cache_lock = threading.Lock()
+
+def get_crs(authid):
+    """Return a cached QgsCoordinateReferenceSystem for an authid (e.g. 'EPSG:32636'), evicting the least recently used if needed."""
+    with _crs_cache_lock:
+        crs = _crs_cache.get(authid)
+        if crs is not None:
+            _crs_cache.move_to_end(authid)
+            return crs
+    
+    crs = QgsCoordinateReferenceSystem(authid)
+    if not crs.isValid():
+        raise ValueError(f"Invalid CRS: {authid}")
+    
+    with _crs_cache_lock:
+        _crs_cache[authid] = crs
+        _crs_cache.move_to_end(authid)
+        while len(_crs_cache) > CRS_CACHE_SIZE:
+            _crs_cache.popitem(last=False)
+    return crs
+
+def get_coordinate_transform(source_authid, dest_authid='EPSG:4326'):
+    """
+    Return a QgsCoordinateTransform between two CRS authids (e.g. 'EPSG:32636').
+
+    The CRS are cached, so building the transform is cheap; it is built on every call rather
+    than cached because QgsCoordinateTransform objects must not be shared between threads
+    (date lookups run off the GUI thread), and so it uses the project's current transform context.
+    """
+    return QgsCoordinateTransform(get_crs(source_authid), get_crs(dest_authid), QgsProject.instance().transformContext())
 
 def parse_coordinates(coord_str):
     """
@@ -16,6 +57,9 @@ def parse_coordinates(coord_str):
     - top-left coordinates in WGS84 (EPSG:4326)
     - bottom-right coordinates in WGS84 (EPSG:4326)
     Each coordinate is returned as (lon, lat)
+
+    ROIs in another projection are reprojected with densified edges, so the returned corners
+    are the tight WGS84 bbox of the whole ROI rather than of its two reprojected corners.
     """
     # Extract coordinates and projection
     coords_part = coord_str.split('[')[0].strip()
@@ -28,16 +72,15 @@ def parse_coordinates(coord_str):
     
     # If projection is not WGS84, transform coordinates
     if proj_part != 'EPSG:4326':
-        source_crs = QgsCoordinateReferenceSystem(proj_part)
-        dest_crs = QgsCoordinateReferenceSystem('EPSG:4326')
-        transform = QgsCoordinateTransform(source_crs, dest_crs, QgsProject.instance())
+        transform = get_coordinate_transform(proj_part)
         
-        # Transform all coordinates
-        tl_point = transform.transform(tl_lon, tl_lat)
-        br_point = transform.transform(br_lon, br_lat)
+        # Transform the ROI center, and the ROI with points densified along its edges
+        center_point = transform.transform((tl_lon + br_lon) / 2, (tl_lat + br_lat) / 2)
+        extent = transform.transformBoundingBox(QgsRectangle(tl_lon, br_lat, br_lon, tl_lat))
         
-        tl_lon, tl_lat = tl_point.x(), tl_point.y()
-        br_lon, br_lat = br_point.x(), br_point.y()
+        tl_lon, tl_lat = extent.xMinimum(), extent.yMaximum()
+        br_lon, br_lat = extent.xMaximum(), extent.yMinimum()
+        return (center_point.x(), center_point.y()), (tl_lon, tl_lat), (br_lon, br_lat)
     
     # Calculate center
     center_lon = (tl_lon + br_lon) / 2
@@ -45,46 +88,63 @@ def parse_coordinates(coord_str):
     
     return (center_lon, center_lat), (tl_lon, tl_lat), (br_lon, br_lat)
 
+# Sentinel-2 stack written by `ftw inference download`: 4 bands (B02, B03, B04, B08) for each of the two windows
+DOWNLOAD_RESOLUTION_M = 10
+DOWNLOAD_BANDS = 8
+DOWNLOAD_BYTES_PER_SAMPLE = 2
 
-def get_date_from_day_of_year(day_of_year: int, year: int) -> str:
-    if day_of_year < 1 or day_of_year > 366:
-        raise ValueError("day_of_year must be between 1 and 366")
-    base_date = datetime(year, 1, 1)
-    result_date = base_date + timedelta(days=day_of_year - 1)
-    if day_of_year == 366 and result_date.year != year:
-        raise ValueError(f"{year} is not a leap year.")
-    return result_date.strftime("%Y-%m-%d")
-
-def get_dates_from_tifs(point: Point, start_season_tif_path: str, end_season_tif_path: str, year=2020, season_type='winter'):
+def estimate_download_size(top_left, bottom_right, resolution=DOWNLOAD_RESOLUTION_M, bands=DOWNLOAD_BANDS, bytes_per_sample=DOWNLOAD_BYTES_PER_SAMPLE):
     """
-    Extract start and end crop calendar dates (day-of-year and date) from GeoTIFFs using rasterio.
+    Estimate how many pixels and bytes downloading an ROI will cost.
 
     Args:
-        point: shapely.geometry.Point
-        start_season_tif_path: path to the start season GeoTIFF
-        end_season_tif_path: path to the end season GeoTIFF
-        year: crop calendar reference year
+        top_left: (lon, lat) in EPSG:4326
+        bottom_right: (lon, lat) in EPSG:4326
+        resolution: output pixel size in meters
+        bands: number of bands in the output stack
+        bytes_per_sample: size of one band sample
 
     Returns:
-        (start_day, end_day, start_date_str, end_date_str)
+        dict with 'width' and 'height' in pixels, 'pixels' per band and uncompressed 'bytes'
     """
-    with rasterio.open(start_season_tif_path) as start_src:
-        row, col = rowcol(start_src.transform, point.x, point.y)
-        start_day = start_src.read(1)[row, col]
+    # Local meters per degree at the ROI center latitude (WGS84 ellipsoid approximation)
+    center_lat = np.radians((top_left[1] + bottom_right[1]) / 2)
+    meters_per_degree_lat = 111132.92 - 559.82 * np.cos(2 * center_lat) + 1.175 * np.cos(4 * center_lat)
+    meters_per_degree_lon = 111412.84 * np.cos(center_lat) - 93.5 * np.cos(3 * center_lat)
+    
+    width = int(np.ceil(abs(bottom_right[0] - top_left[0]) * meters_per_degree_lon / resolution))
+    height = int(np.ceil(abs(top_left[1] - bottom_right[1]) * meters_per_degree_lat / resolution))
+    pixels = width * height
+    
+    return {
+        'width': width,
+        'height': height,
+        'pixels': pixels,
+        'bytes': pixels * bands * bytes_per_sample,
+    }
 
-    with rasterio.open(end_season_tif_path) as end_src:
-        row, col = rowcol(end_src.transform, point.x, point.y)
-        end_day = end_src.read(1)[row, col]
+def get_sentinel2_tiles(top_left, bottom_right):
+    """
+    Find the Sentinel-2 tiles and UTM zones an ROI touches, from the bundled MGRS grid index.
 
-    # Handle crop calendars that span across years, like a season starting in September and ending in March
-    end_year = year + 1 if end_day < start_day else year
+    Args:
+        top_left: (lon, lat) in EPSG:4326
+        bottom_right: (lon, lat) in EPSG:4326
 
-    start_date = get_date_from_day_of_year(int(start_day), year)
-    end_date = get_date_from_day_of_year(int(end_day), end_year)
-    
-    return start_date, end_date
+    Returns:
+        dict with the sorted 'tiles' ids (e.g. '31TCJ') and 'utm_zones' EPSG codes
+    """
+    index = get_tile_index()
+    bbox = [top_left[0], bottom_right[1], bottom_right[0], top_left[1]]
+    return {'tiles': index.tiles(bbox), 'utm_zones': index.utm_zones(bbox)}
 
 
+# Acquisition windows around the season, in days: window A is centred on the start of season,
+# window B covers the last month before the end of season
+WINDOW_A_DAYS_BEFORE_SOS = 15
+WINDOW_A_DAYS_AFTER_SOS = 15
+WINDOW_B_DAYS_BEFORE_EOS = 30
+
 
 def calculate_window_dates(sos_date, eos_date):
     """
@@ -95,184 +155,719 @@ def calculate_window_dates(sos_date, eos_date):
     eos = datetime.strptime(eos_date, '%Y-%m-%d')
     
     # Calculate window dates
-    win_a_start = (sos - timedelta(days=15)).strftime('%Y-%m-%d')
-    win_a_end = (sos + timedelta(days=15)).strftime('%Y-%m-%d')
-    win_b_start = (eos - timedelta(days=30)).strftime('%Y-%m-%d')
+    win_a_start = (sos - timedelta(days=WINDOW_A_DAYS_BEFORE_SOS)).strftime('%Y-%m-%d')
+    win_a_end = (sos + timedelta(days=WINDOW_A_DAYS_AFTER_SOS)).strftime('%Y-%m-%d')
+    win_b_start = (eos - timedelta(days=WINDOW_B_DAYS_BEFORE_EOS)).strftime('%Y-%m-%d')
     win_b_end = eos.strftime('%Y-%m-%d')
     
     return win_a_start, win_a_end, win_b_start, win_b_end
 
-def extract_patch(top_left, bottom_right, win_a_start, win_a_end, win_b_start, win_b_end, output_dir, output_filename, max_cloud_cover=20, conda_env=None):
-    """Extract a patch of Sentinel-2 data using the specified parameters."""
-    try:
-        # Create a temporary Python script
-        script_content = """
-import os
-import sys
-import subprocess
-import pystac_client
-import planetary_computer
-
-MSPC_URL = "https://planetarycomputer.microsoft.com/api/stac/v1"
-COLLECTION_ID = "sentinel-2-l2a"
-
-def get_best_image_ids(top_left, bottom_right, win_a_start, win_a_end, win_b_start, win_b_end, max_cloud_cover=20):
-    catalog = pystac_client.Client.open(
-        MSPC_URL,
-        modifier=planetary_computer.sign_inplace,
-    )
-
-    min_lon, min_lat = top_left[0], bottom_right[1]
-    max_lon, max_lat = bottom_right[0], top_left[1]
-    bbox_geom = {
-        "type": "Polygon",
-        "coordinates": [[
-            [min_lon, min_lat],
-            [min_lon, max_lat],
-            [max_lon, max_lat],
-            [max_lon, min_lat],
-            [min_lon, min_lat],
-        ]]
+def calculate_window_dates_batch(sos_dates, eos_dates):
+    """
+    Vectorized calculate_window_dates for arrays of SOS and EOS dates.
+
+    Args:
+        sos_dates: array-like of datetime64 (or 'YYYY-MM-DD' strings)
+        eos_dates: array-like of datetime64 (or 'YYYY-MM-DD' strings)
+
+    Returns:
+        (win_a_start, win_a_end, win_b_start, win_b_end) as datetime64[D] arrays; NaT inputs stay NaT
+    """
+    sos = np.asarray(sos_dates, dtype='datetime64[D]')
+    eos = np.asarray(eos_dates, dtype='datetime64[D]')
+    
+    win_a_start = sos - np.timedelta64(WINDOW_A_DAYS_BEFORE_SOS, 'D')
+    win_a_end = sos + np.timedelta64(WINDOW_A_DAYS_AFTER_SOS, 'D')
+    win_b_start = eos - np.timedelta64(WINDOW_B_DAYS_BEFORE_EOS, 'D')
+    win_b_end = eos
+    
+    return win_a_start, win_a_end, win_b_start, win_b_end
+
+def get_season_windows_batch(lons, lats, calendar, season_type='winter', year=2020):
+    """
+    Look up crop calendar dates and acquisition windows for many points at once.
+
+    Args:
+        lons: array-like of longitudes (EPSG:4326)
+        lats: array-like of latitudes (EPSG:4326)
+        calendar: path to the packed crop calendar file, or a {season: {"start": tif_path, "end": tif_path}}
+            mapping of the crop calendar GeoTIFFs
+        season_type: 'winter' or 'summer'
+        year: crop calendar reference year
+
+    Returns:
+        dict of arrays, one entry per point: 'start_day', 'end_day', 'sos', 'eos',
+        'win_a_start', 'win_a_end', 'win_b_start', 'win_b_end' and the boolean 'valid' mask
+    """
+    index = get_crop_calendar_index(calendar)
+    result = index.dates_batch(lons, lats, season_type, year)
+    (result['win_a_start'], result['win_a_end'],
+     result['win_b_start'], result['win_b_end']) = calculate_window_dates_batch(result['sos'], result['eos'])
+    return result
+
+# Largest spread (p90 - p10, in days) of SOS/EOS across an ROI that a single window pair can cover
+ZONAL_MAX_SPREAD_DAYS = WINDOW_A_DAYS_BEFORE_SOS + WINDOW_A_DAYS_AFTER_SOS
+
+def get_zonal_season_dates(top_left, bottom_right, calendar, season_type='winter', year=2020, statistic='median'):
+    """
+    Compute crop calendar dates from every calendar pixel in an ROI instead of only its centre.
+
+    Args:
+        top_left: (lon, lat) in EPSG:4326
+        bottom_right: (lon, lat) in EPSG:4326
+        calendar: path to the packed crop calendar file, or a {season: {"start": tif_path, "end": tif_path}}
+            mapping of the crop calendar GeoTIFFs
+        season_type: 'winter' or 'summer'
+        year: crop calendar reference year
+        statistic: 'median' or 'mode', the day-of-year used for the returned dates
+
+    Returns:
+        dict with 'start_date', 'end_date', the 'sos' and 'eos' day-of-year statistics
+        (see crop_calendar.day_of_year_stats), 'too_spread' and a 'warning' message
+        (None when one window pair fits the whole ROI)
+    """
+    if statistic not in ('median', 'mode'):
+        raise ValueError("statistic must be 'median' or 'mode'")
+    
+    index = get_crop_calendar_index(calendar)
+    min_lon, max_lon = sorted((top_left[0], bottom_right[0]))
+    min_lat, max_lat = sorted((top_left[1], bottom_right[1]))
+    start_days, end_days = index.zonal_day_of_year(min_lon, min_lat, max_lon, max_lat, season_type)
+    if start_days.size == 0:
+        raise ValueError(f"No {season_type} crop calendar data within the area of interest")
+    
+    sos_stats = day_of_year_stats(start_days)
+    eos_stats = day_of_year_stats(end_days)
+    start_day = sos_stats[statistic]
+    end_day = eos_stats[statistic]
+    
+    # Handle crop calendars that span across years, like a season starting in September and ending in March
+    end_year = year + 1 if end_day < start_day else year
+    
+    too_spread = max(sos_stats['spread'], eos_stats['spread']) > ZONAL_MAX_SPREAD_DAYS
+    warning = None
+    if too_spread:
+        warning = (f"Season dates vary across the area (SOS spread {sos_stats['spread']:.0f} days, "
+                   f"EOS spread {eos_stats['spread']:.0f} days); one window pair will not fit all of it.")
+    
+    return {
+        'start_date': get_date_from_day_of_year(start_day, year),
+        'end_date': get_date_from_day_of_year(end_day, end_year),
+        'sos': sos_stats,
+        'eos': eos_stats,
+        'too_spread': too_spread,
+        'warning': warning,
     }
 
-    def find_best_image(start_date, end_date, cloud_threshold):
-        time_range = f"{start_date}/{end_date}"
-        print(f"Searching for images between {start_date} and {end_date} with cloud cover < {cloud_threshold}%")
-        
-        search = catalog.search(
-            collections=[COLLECTION_ID],
-            intersects=bbox_geom,
-            datetime=time_range,
-            query={"eo:cloud_cover": {"lt": cloud_threshold}},
-        )
+def _label_rectangles(labels):
+    """
+    Merge a 2D grid of labels into rectangles of equal label.
 
-        items = search.item_collection()
-        if len(items) == 0:
-            print(f"No images found with cloud cover < {cloud_threshold}%")
-            return None
-            
-        best_item = min(items, key=lambda item: item.properties.get("eo:cloud_cover", 100))
-        cloud_cover = best_item.properties.get("eo:cloud_cover", 100)
-        print(f"Found image from {best_item.datetime.date()} with {cloud_cover}% cloud coverage")
-        return best_item.id
-
-    # Try different cloud cover thresholds if needed
-    cloud_thresholds = [max_cloud_cover, 50, 70, 100]
-    win_a_id = None
-    win_b_id = None
-    
-    for threshold in cloud_thresholds:
-        if win_a_id is None:
-            win_a_id = find_best_image(win_a_start, win_a_end, threshold)
-        if win_b_id is None:
-            win_b_id = find_best_image(win_b_start, win_b_end, threshold)
-        if win_a_id is not None and win_b_id is not None:
-            break
-            
-    if win_a_id is None:
-        raise ValueError(f"Could not find suitable images for window A ({win_a_start} to {win_a_end}) even with 100% cloud cover")
-    if win_b_id is None:
-        raise ValueError(f"Could not find suitable images for window B ({win_b_start} to {win_b_end}) even with 100% cloud cover")
-
-    return win_a_id, win_b_id, [min_lon, min_lat, max_lon, max_lat]
-
-if __name__ == "__main__":
-    # Get command line arguments
-    top_left = eval(sys.argv[1])  # Convert string tuple to actual tuple
-    bottom_right = eval(sys.argv[2])  # Convert string tuple to actual tuple
-    win_a_start = sys.argv[3]
-    win_a_end = sys.argv[4]
-    win_b_start = sys.argv[5]
-    win_b_end = sys.argv[6]
-    output_dir = sys.argv[7]
-    output_filename = sys.argv[8]
-    max_cloud_cover = int(sys.argv[9])
-    conda_env = sys.argv[10] if len(sys.argv) > 10 else None
-
-    # Get best image IDs and bbox
-    win_a_id, win_b_id, bbox_list = get_best_image_ids(
-        top_left, bottom_right,
-        win_a_start, win_a_end,
-        win_b_start, win_b_end,
-        max_cloud_cover
-    )
-
-    # Format bbox as string
-    bbox_str = ",".join(map(str, bbox_list))
-
-    # Create output directory if it doesn't exist
-    os.makedirs(output_dir, exist_ok=True)
-
-    # Determine ftw command path
-    if conda_env:
-        if os.name == 'nt':  # Windows
-            ftw_cmd = os.path.join(conda_env, 'Scripts', 'ftw.exe')
-        else:  # Unix-like
-            ftw_cmd = os.path.join(conda_env, 'bin', 'ftw')
+    Returns:
+        list of (label, row_start, row_stop, col_start, col_stop), stops exclusive
+    """
+    rectangles = []
+    open_runs = {}  # (label, col_start, col_stop) -> row_start
+    for row_index in range(labels.shape[0] + 1):
+        runs = set()
+        if row_index < labels.shape[0]:
+            row = labels[row_index]
+            breaks = np.flatnonzero(np.diff(row)) + 1
+            starts = np.concatenate([[0], breaks])
+            stops = np.concatenate([breaks, [row.size]])
+            runs = {(int(row[start]), int(start), int(stop)) for start, stop in zip(starts, stops)}
+        # Runs that do not continue into this row close their rectangle
+        for run in list(open_runs):
+            if run not in runs:
+                label, col_start, col_stop = run
+                rectangles.append((label, open_runs.pop(run), row_index, col_start, col_stop))
+        for run in runs:
+            open_runs.setdefault(run, row_index)
+    return rectangles
+
+def split_roi_by_calendar_zones(top_left, bottom_right, calendar, season_type='winter', year=2020, max_spread_days=ZONAL_MAX_SPREAD_DAYS):
+    """
+    Split an ROI into crop calendar zones that each fit one pair of acquisition windows.
+
+    Calendar pixels in the ROI are grouped by binning their SOS and EOS day-of-year into
+    max_spread_days wide bins. Pixels without calendar data join the largest zone. Each zone's
+    pixels are merged into rectangles clipped to the ROI.
+
+    Args:
+        top_left: (lon, lat) in EPSG:4326
+        bottom_right: (lon, lat) in EPSG:4326
+        calendar: path to the packed crop calendar file, or a {season: {"start": tif_path, "end": tif_path}}
+            mapping of the crop calendar GeoTIFFs
+        season_type: 'winter' or 'summer'
+        year: crop calendar reference year
+        max_spread_days: width of the SOS/EOS bins
+
+    Returns:
+        list of zone dicts, largest first, with 'start_date', 'end_date', 'windows'
+        (win_a_start, win_a_end, win_b_start, win_b_end), 'tiles' (list of
+        [min_lon, min_lat, max_lon, max_lat]), 'bbox' (union of the tiles) and 'pixel_count'
+    """
+    index = get_crop_calendar_index(calendar)
+    min_lon, max_lon = sorted((top_left[0], bottom_right[0]))
+    min_lat, max_lat = sorted((top_left[1], bottom_right[1]))
+    rows, cols = index.window(min_lon, min_lat, max_lon, max_lat)
+    layers = index.seasons[season_type]
+    start_days = np.asarray(layers['start'][rows, cols]).astype(np.int64)
+    end_days = np.asarray(layers['end'][rows, cols]).astype(np.int64)
+    valid = (start_days != index.nodata) & (end_days != index.nodata)
+    if not valid.any():
+        raise ValueError(f"No {season_type} crop calendar data within the area of interest")
+    
+    # Bin SOS and EOS (unwrapped around the new year) and use the bin pair as zone label
+    sos = unwrap_day_of_year(start_days[valid])
+    eos = unwrap_day_of_year(end_days[valid])
+    bins = np.stack([
+        np.floor((sos - sos.min()) / max_spread_days),
+        np.floor((eos - eos.min()) / max_spread_days),
+    ], axis=1)
+    _, zone_of_pixel = np.unique(bins, axis=0, return_inverse=True)
+    zone_of_pixel = zone_of_pixel.ravel()
+    labels = np.empty(start_days.shape, dtype=np.int64)
+    labels[valid] = zone_of_pixel
+    labels[~valid] = np.bincount(zone_of_pixel).argmax()
+    
+    # Pixel edges of the calendar window, with the outer edges stretched to cover the whole ROI
+    a, _, c, _, e, f = index.transform
+    lon_edges = c + a * np.arange(cols.start, cols.stop + 1)
+    lat_edges = f + e * np.arange(rows.start, rows.stop + 1)
+    lon_edges[0], lon_edges[-1] = min(lon_edges[0], min_lon), max(lon_edges[-1], max_lon)
+    lat_edges[0], lat_edges[-1] = max(lat_edges[0], max_lat), min(lat_edges[-1], min_lat)
+    
+    zones = {}
+    for label, row_start, row_stop, col_start, col_stop in _label_rectangles(labels):
+        tile = [
+            max(lon_edges[col_start], min_lon), max(lat_edges[row_stop], min_lat),
+            min(lon_edges[col_stop], max_lon), min(lat_edges[row_start], max_lat),
+        ]
+        if tile[0] < tile[2] and tile[1] < tile[3]:
+            zones.setdefault(label, []).append([float(v) for v in tile])
+    
+    result = []
+    for label, tiles in zones.items():
+        in_zone = valid & (labels == label)
+        if not in_zone.any():
+            continue
+        start_day = day_of_year_stats(start_days[in_zone])['median']
+        end_day = day_of_year_stats(end_days[in_zone])['median']
+        end_year = year + 1 if end_day < start_day else year
+        start_date = get_date_from_day_of_year(start_day, year)
+        end_date = get_date_from_day_of_year(end_day, end_year)
+        tile_array = np.array(tiles)
+        result.append({
+            'start_date': start_date,
+            'end_date': end_date,
+            'windows': calculate_window_dates(start_date, end_date),
+            'tiles': tiles,
+            'bbox': [float(tile_array[:, 0].min()), float(tile_array[:, 1].min()),
+                     float(tile_array[:, 2].max()), float(tile_array[:, 3].max())],
+            'pixel_count': int(in_zone.sum()),
+        })
+    
+    result.sort(key=lambda zone: zone['pixel_count'], reverse=True)
+    return result
+
+# Size of the grid cells used to restrict downloads to a polygon AOI, in degrees (about 5 km)
+AOI_TILE_SIZE_DEG = 0.05
+
+def parse_aoi_geometry(text, source_authid='EPSG:4326'):
+    """
+    Parse a polygon AOI given as WKT or GeoJSON (geometry, Feature or FeatureCollection).
+
+    Returns:
+        shapely geometry in EPSG:4326
+    """
+    from shapely import wkt
+    from shapely.geometry import shape
+    from shapely.ops import unary_union
+    
+    text = text.strip()
+    if text.startswith('{'):
+        geojson = json.loads(text)
+        if geojson.get('type') == 'FeatureCollection':
+            geometry = unary_union([shape(feature['geometry']) for feature in geojson['features']])
+        elif geojson.get('type') == 'Feature':
+            geometry = shape(geojson['geometry'])
+        else:
+            geometry = shape(geojson)
     else:
-        ftw_cmd = 'ftw'  # Try to use system ftw
-
-    # Check if ftw command exists
-    if not os.path.exists(ftw_cmd):
-        raise FileNotFoundError(f"ftw command not found at {ftw_cmd}. Please ensure it is installed in the conda environment.")
-
-    # Run ftw command
-    cmd = [
-        ftw_cmd, "inference", "download",
-        "--win_a", win_a_id,
-        "--win_b", win_b_id,
-        "--out", os.path.join(output_dir, output_filename),
-        "--bbox", bbox_str,
-        "--overwrite"
+        geometry = wkt.loads(text)
+    
+    if source_authid != 'EPSG:4326':
+        geometry = _transform_geometry_wkt(geometry.wkt, source_authid)
+    return _validate_aoi_geometry(geometry)
+
+def aoi_from_layer(layer, selected_only=False):
+    """
+    Build a polygon AOI from the features of a vector layer.
+
+    Args:
+        layer: QgsVectorLayer with polygon features
+        selected_only: only use the selected features
+
+    Returns:
+        shapely geometry in EPSG:4326
+    """
+    from qgis.core import QgsGeometry
+    
+    features = layer.selectedFeatures() if selected_only else layer.getFeatures()
+    geometries = [feature.geometry() for feature in features if feature.hasGeometry()]
+    if not geometries:
+        raise ValueError(f"Layer {layer.name()} has no features to use as area of interest")
+    
+    geometry = QgsGeometry.unaryUnion(geometries)
+    return _validate_aoi_geometry(_transform_geometry_wkt(geometry.asWkt(), layer.crs().authid()))
+
+def aois_from_layer_features(layer, selected_only=False):
+    """
+    Build one AOI per feature of a vector layer, e.g. to queue their downloads.
+
+    Args:
+        layer: QgsVectorLayer
+        selected_only: only use the selected features
+
+    Returns:
+        list of (name, shapely geometry in EPSG:4326); names are the feature ids
+    """
+    features = layer.selectedFeatures() if selected_only else layer.getFeatures()
+    aois = [
+        (f"{layer.name()} #{feature.id()}", _transform_geometry_wkt(feature.geometry().asWkt(), layer.crs().authid()))
+        for feature in features if feature.hasGeometry()
     ]
+    if not aois:
+        raise ValueError(f"Layer {layer.name()} has no features to download")
+    return aois
+
+def _transform_geometry_wkt(geometry_wkt, source_authid):
+    """Reproject a WKT geometry to EPSG:4326 with QGIS and return it as a shapely geometry."""
+    from qgis.core import QgsGeometry
+    from shapely import wkt
     
-    result = subprocess.run(cmd, check=True, capture_output=True, text=True)
-    print(os.path.join(output_dir, output_filename))
-"""
-        
-        # Create a temporary script file
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as f:
-            f.write(script_content)
-            script_path = f.name
-        
-        # Get the Python executable from the conda environment
-        if conda_env:
-            if os.name == 'nt':  # Windows
-                python_exe = os.path.join(conda_env, 'python.exe')
-            else:  # Unix-like
-                python_exe = os.path.join(conda_env, 'bin', 'python')
-        else:
-            python_exe = sys.executable
-        
-        # Run the script
-        cmd = [
-            python_exe,
-            script_path,
-            str(top_left),  # Convert tuple to string
-            str(bottom_right),  # Convert tuple to string
-            win_a_start,
-            win_a_end,
-            win_b_start,
-            win_b_end,
-            output_dir,
-            output_filename,
-            str(max_cloud_cover),
-            conda_env if conda_env else ""  # Pass conda_env path if available
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True)
+    geometry = QgsGeometry.fromWkt(geometry_wkt)
+    if source_authid != 'EPSG:4326':
+        geometry.transform(get_coordinate_transform(source_authid))
+    return wkt.loads(geometry.asWkt())
+
+def _validate_aoi_geometry(geometry):
+    """Check that an AOI geometry is a non-empty (multi)polygon, repairing invalid rings."""
+    if geometry.is_empty or geometry.geom_type not in ('Polygon', 'MultiPolygon'):
+        raise ValueError("The area of interest must be a Polygon or MultiPolygon")
+    if not geometry.is_valid:
+        geometry = geometry.buffer(0)
+    return geometry
+
+def restrict_tiles_to_aoi(tiles, geometry, tile_size=AOI_TILE_SIZE_DEG):
+    """
+    Restrict bbox tiles to the parts that intersect a polygon AOI.
+
+    Each tile is cut into a grid of at most tile_size cells; cells that intersect the (prepared)
+    AOI are kept and merged back into as few rectangles as possible.
+
+    Args:
+        tiles: list of [min_lon, min_lat, max_lon, max_lat]
+        geometry: shapely AOI geometry in EPSG:4326
+
+    Returns:
+        list of [min_lon, min_lat, max_lon, max_lat] tiles covering the AOI
+    """
+    import shapely
+    
+    shapely.prepare(geometry)
+    result = []
+    for min_lon, min_lat, max_lon, max_lat in tiles:
+        n_cols = max(int(np.ceil((max_lon - min_lon) / tile_size)), 1)
+        n_rows = max(int(np.ceil((max_lat - min_lat) / tile_size)), 1)
+        lon_edges = np.linspace(min_lon, max_lon, n_cols + 1)
+        lat_edges = np.linspace(max_lat, min_lat, n_rows + 1)  # North to south, like raster rows
         
-        # Clean up the temporary script
-        os.unlink(script_path)
+        # All cells of the tile are tested at once, (n_rows, n_cols)
+        cells = shapely.box(lon_edges[None, :-1], lat_edges[1:, None], lon_edges[None, 1:], lat_edges[:-1, None])
+        inside = shapely.intersects(cells, geometry).astype(np.int64)
         
-        # Check for errors
-        if result.returncode != 0:
-            raise RuntimeError(f"Script failed: {result.stderr}")
+        for label, row_start, row_stop, col_start, col_stop in _label_rectangles(inside):
+            if label:
+                result.append([float(lon_edges[col_start]), float(lat_edges[row_stop]),
+                               float(lon_edges[col_stop]), float(lat_edges[row_start])])
+    return result
+
+def restrict_zones_to_aoi(zones, geometry, tile_size=AOI_TILE_SIZE_DEG):
+    """
+    Restrict the tiles of split_roi_by_calendar_zones() zones to a polygon AOI.
+
+    Zones whose tiles do not intersect the AOI are dropped, and each zone's bbox is
+    recomputed from its remaining tiles.
+    """
+    result = []
+    for zone in zones:
+        tiles = restrict_tiles_to_aoi(zone['tiles'], geometry, tile_size)
+        if not tiles:
+            continue
+        tile_array = np.array(tiles)
+        result.append(dict(
+            zone,
+            tiles=tiles,
+            bbox=[float(tile_array[:, 0].min()), float(tile_array[:, 1].min()),
+                  float(tile_array[:, 2].max()), float(tile_array[:, 3].max())]
+        ))
+    return result
+
+def mask_to_aoi(raster_path, geometry, output_path, storage_profile=None, block_size=None):
+    """
+    Write a copy of a raster with every pixel outside a polygon AOI set to nodata (0).
+
+    Args:
+        raster_path: input raster (GeoTIFF or VRT)
+        geometry: shapely AOI geometry in EPSG:4326
+        output_path: masked GeoTIFF to write
+        storage_profile: Layout of the output, one of STORAGE_PROFILES, None for the default one
+        block_size: Side of the output's internal tiles, in pixels
+
+    Returns:
+        output_path
+    """
+    from osgeo import gdal
+    
+    with tempfile.NamedTemporaryFile(mode='w', suffix='.geojson', delete=False) as f:
+        json.dump({
+            "type": "FeatureCollection",
+            "features": [{"type": "Feature", "properties": {}, "geometry": geometry.__geo_interface__}]
+        }, f)
+        cutline_path = f.name
+    
+    driver, options = gdal_creation_options(storage_profile or DEFAULT_STORAGE_PROFILE, block_size or DEFAULT_STORAGE_BLOCK_SIZE)
+    try:
+        result = gdal.Warp(
+            output_path, raster_path,
+            format=driver,
+            cutlineDSName=cutline_path,
+            cutlineSRS='EPSG:4326',
+            srcNodata=0,
+            dstNodata=0,
+            creationOptions=options
+        )
+        if result is None:
+            raise RuntimeError(f"Failed to mask {raster_path} to the area of interest")
+        result = None  # Flush the output to disk
+    finally:
+        os.unlink(cutline_path)
+    
+    return output_path
+
+def extract_zone_patches(zones, output_dir, output_filename, max_cloud_cover=20, conda_env=None, options=None):
+    """
+    Extract the patches of each calendar zone from split_roi_by_calendar_zones().
+
+    Each zone runs one scene search with its own window dates and downloads its tiles to
+    output_filename suffixed with _zone<N>_<M>. options are extract_patch's.
+
+    Returns:
+        list of output files
+    """
+    stem, ext = os.path.splitext(output_filename)
+    output_files = []
+    for i, zone in enumerate(zones):
+        min_lon, min_lat, max_lon, max_lat = zone['bbox']
+        win_a_start, win_a_end, win_b_start, win_b_end = zone['windows']
+        output_files.extend(extract_patch(
+            top_left=(min_lon, max_lat),
+            bottom_right=(max_lon, min_lat),
+            win_a_start=win_a_start,
+            win_a_end=win_a_end,
+            win_b_start=win_b_start,
+            win_b_end=win_b_end,
+            output_dir=output_dir,
+            output_filename=f"{stem}_zone{i + 1}{ext}",
+            max_cloud_cover=max_cloud_cover,
+            conda_env=conda_env,
+            tiles=zone['tiles'],
+            options=options
+        ))
+    return output_files
+
+def mosaic_patches(patch_files, output_path, storage_profile=None, block_size=None):
+    """
+    Stitch patch files into one virtual mosaic (VRT).
+
+    With a storage_profile, one of STORAGE_PROFILES, the mosaic is written instead as a GeoTIFF
+    in that layout, next to output_path with a .tif extension, and the VRT is removed.
+
+    Returns:
+        the mosaic path, or None if the patches cannot be mosaicked (e.g. they are in different UTM zones)
+    """
+    from osgeo import gdal
+    
+    # A VRT needs all sources in one CRS
+    projections = {gdal.Open(path).GetProjection() for path in patch_files}
+    if len(projections) != 1:
+        return None
+    
+    vrt = gdal.BuildVRT(output_path, patch_files)
+    if vrt is None:
+        return None
+    vrt = None  # Flush the VRT to disk
+    if storage_profile is None:
+        return output_path
+    
+    tif_path = os.path.splitext(output_path)[0] + ".tif"
+    driver, options = gdal_creation_options(storage_profile, block_size or DEFAULT_STORAGE_BLOCK_SIZE)
+    try:
+        result = gdal.Translate(tif_path, output_path, format=driver, creationOptions=options)
+        if result is None:
+            raise RuntimeError(f"Failed to write the mosaic {tif_path}")
+        result = None  # Flush the mosaic to disk
+    finally:
+        os.remove(output_path)
+    return tif_path
+
+# Number of top scenes vetted with their quicklooks when vetting is enabled
+QUICKLOOK_CANDIDATES = 5
+
+# Number of scenes per window composited when compositing is enabled
+COMPOSITE_SCENES = 4
+
+# Download options of extract_patch and their defaults, passed as is to the worker (see scene_search.extract)
+DOWNLOAD_OPTIONS = {
+    'stac_source': None,
+    'quicklook_candidates': 0,
+    'composite_scenes': 0,
+    'native_reader': False,
+    'preview_resolution': None,
+    'storage_profile': None,
+    'block_size': None,
+    'max_bytes_per_second': None,
+    'rate_file': None,
+}
+
+# Pixel sizes of preview downloads, in meters; Sentinel-2 COGs have overviews at each of them
+PREVIEW_RESOLUTIONS = (20, 40, 80)
+
+# Scene search and download worker, run with the Python of the FTW conda environment
+SCENE_SEARCH_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scene_search.py")
+
+# Number of worker log lines kept to explain failures
+WORKER_LOG_LINES = 200
+
+# A worker that neither answers nor logs anything for this long is considered hung and killed
+WORKER_IDLE_TIMEOUT_SECONDS = 30 * 60
+WORKER_POLL_SECONDS = 1.0
+
+def get_conda_python(conda_env=None):
+    """Return the Python executable of a conda environment, or the current one."""
+    if conda_env:
+        if os.name == 'nt':  # Windows
+            return os.path.join(conda_env, 'python.exe')
+        return os.path.join(conda_env, 'bin', 'python')
+    return sys.executable
+
+class SceneSearchWorker:
+    """
+    Long-lived scene_search.py process in the FTW conda environment.
+
+    It is started on the first request and answers JSON requests over stdin/stdout, so the
+    interpreter start-up and the pystac_client/planetary_computer imports are paid once per
+    session. Requests are sent one at a time; a worker that died or hung is restarted on the
+    next one. Responses are read by a thread, so waiting for one can time out.
+    """
+
+    def __init__(self, python_exe):
+        self.python_exe = python_exe
+        self.process = None
+        self.log = deque(maxlen=WORKER_LOG_LINES)
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._responses = None
+        self._last_activity = time.monotonic()
+
+    def _start(self):
+        self.process = subprocess.Popen(
+            [self.python_exe, SCENE_SEARCH_SCRIPT],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            text=True, encoding='utf-8', bufsize=1,
+            cwd=os.path.dirname(SCENE_SEARCH_SCRIPT)
+        )
+        # Drain progress messages so the worker never blocks on a full stderr pipe
+        threading.Thread(target=self._read_log, args=(self.process.stderr,), daemon=True).start()
+        self._responses = queue.Queue()
+        threading.Thread(target=self._read_responses, args=(self.process.stdout, self._responses), daemon=True).start()
+
+    def _read_log(self, stream):
+        for line in stream:
+            self._last_activity = time.monotonic()
+            self.log.append(line.rstrip())
+
+    def _read_responses(self, stream, responses):
+        for line in stream:
+            self._last_activity = time.monotonic()
+            responses.put(line)
+        responses.put('')  # The worker exited
+
+    def _read_response(self, request_id, on_progress=None):
+        # Wait for the response to request_id while the worker shows signs of life
+        while True:
+            try:
+                line = self._responses.get(timeout=WORKER_POLL_SECONDS)
+            except queue.Empty:
+                if time.monotonic() - self._last_activity > WORKER_IDLE_TIMEOUT_SECONDS:
+                    self.process.kill()
+                    self.process.wait()
+                    raise RuntimeError(
+                        f"Scene search worker did not respond for {WORKER_IDLE_TIMEOUT_SECONDS} s:\n"
+                        + '\n'.join(list(self.log)[-20:])
+                    )
+                continue
+            if not line:
+                self.process.wait()
+                raise RuntimeError("Scene search worker exited:\n" + '\n'.join(list(self.log)[-20:]))
+            response = json.loads(line)
+            if 'progress' in response:
+                if response.get('id') == request_id and on_progress is not None:
+                    on_progress(response['progress'])
+                continue
+            if response.get('id') == request_id:
+                return response
+            self.log.append(f"Skipped a response to request {response.get('id')}, waiting for {request_id}")
+
+    def request(self, command, params=None, with_stats=False, on_progress=None):
+        """
+        Send a request and wait for its result.
+
+        The worker runs one request at a time, so the lock is held until the response arrives
+        and concurrent callers wait for their turn; concurrent downloads use a worker per slot
+        instead (see get_scene_search_worker).
+
+        Args:
+            with_stats: Return (result, stats) instead, stats being the worker's
+                {'bytes_read', 'seconds'} of an extract request
+            on_progress: Called with the {'bytes_read', 'seconds'} so far of an extract
+                request about every second while it runs, from the calling thread
+
+        Raises:
+            RuntimeError: if the request failed, or the worker exited or hung
+        """
+        with self._lock:
+            if self.process is None or self.process.poll() is not None:
+                self.log.clear()
+                self._start()
+            self._next_id += 1
+            request_id = self._next_id
+            self._last_activity = time.monotonic()
+            try:
+                self.process.stdin.write(json.dumps({'id': request_id, 'command': command, 'params': params or {}}) + '\n')
+                self.process.stdin.flush()
+            except OSError:
+                pass  # The worker exited; its end of output is read below
+            response = self._read_response(request_id, on_progress)
+        if not response['ok']:
+            raise RuntimeError(response['error'])
+        if with_stats:
+            return response['result'], response.get('stats', {})
+        return response['result']
+
+    def close(self):
+        with self._lock:
+            if self.process is not None and self.process.poll() is None:
+                self.process.stdin.close()
+                try:
+                    self.process.wait(timeout=5)
+                except subprocess.TimeoutExpired:
+                    self.process.kill()
+            self.process = None
+
+_scene_search_workers = {}
+_scene_search_workers_lock = threading.Lock()
+
+def get_scene_search_worker(conda_env=None, slot=0):
+    """
+    Return a session-wide scene search worker of a conda environment.
+
+    Each worker runs one request at a time; concurrent downloads (see download_queue.py) use
+    one slot, and so one worker process, each.
+    """
+    python_exe = get_conda_python(conda_env)
+    with _scene_search_workers_lock:
+        worker = _scene_search_workers.get((python_exe, slot))
+        if worker is None:
+            worker = _scene_search_workers[(python_exe, slot)] = SceneSearchWorker(python_exe)
+        return worker
+
+def shutdown_scene_search_workers():
+    """Stop the scene search workers, e.g. when the plugin is unloaded."""
+    with _scene_search_workers_lock:
+        workers = list(_scene_search_workers.values())
+        _scene_search_workers.clear()
+    for worker in workers:
+        worker.close()
+
+def extract_patch(top_left, bottom_right, win_a_start, win_a_end, win_b_start, win_b_end, output_dir, output_filename, max_cloud_cover=20, conda_env=None, tiles=None, options=None, worker_slot=0, stats=None, progress=None):
+    """
+    Extract a patch of Sentinel-2 data using the specified parameters.
+
+    Scenes are searched once for the top_left/bottom_right bbox. If tiles is given, a list of
+    [min_lon, min_lat, max_lon, max_lat] bboxes within it, each tile is downloaded from those
+    scenes to output_filename suffixed with _1, _2, ... and the list of output files is returned
+    instead of a single path.
+
+    When no single scene covers the bbox, scenes are combined and each bbox is downloaded in
+    parts suffixed with _part1, _part2, ...; the list of output files is returned then too.
+
+    The search and download run in the session's scene_search.py worker (see
+    SceneSearchWorker). Searches are cached on disk (see stac_cache.py), so repeated and
+    overlapping ROIs do not hit the STAC API again.
+
+    options is a mapping of the DOWNLOAD_OPTIONS, the missing ones taking their default:
+
+    - stac_source selects where scenes are searched: "planetary-computer" (the default), a
+      STAC API URL, or a local static catalog/directory (see stac_backends.py).
+    - With quicklook_candidates > 1, that many top scenes are vetted with their quicklook over
+      the bbox (see quicklook.py) and the clearest is downloaded.
+    - With composite_scenes > 1, up to that many scenes per window are composited pixel by
+      pixel from their clear (SCL) observations instead (see composite.py).
+    - With native_reader, the bands are read straight from the scenes' COGs, fetching only the
+      blocks within the bbox (see cog_reader.py), instead of with `ftw inference download`.
+      These downloads are checkpointed: running an interrupted request again only fetches
+      what is missing (see download_manifest.py).
+    - With preview_resolution, one of PREVIEW_RESOLUTIONS, a smaller 8-band stack is read at
+      that pixel size from the COG overviews, with the native reader, to look at an area
+      before downloading it at full resolution.
+    - storage_profile, one of STORAGE_PROFILES, and block_size select the layout of the output
+      GeoTIFF (see storage_profiles.py); by default the native reader writes tiled DEFLATE and
+      the ftw CLI keeps its own layout.
+    - max_bytes_per_second caps the bandwidth of the native reader, and the cap is read again
+      from rate_file while downloading if given.
+
+    worker_slot selects the worker process, so several patches can download concurrently. If
+    stats is a dict, it is updated with the 'bytes_read' and 'seconds' of the download;
+    progress, if given, is called with the same dict so far while it runs.
+    """
+    options = dict(options or {})
+    unknown = set(options) - set(DOWNLOAD_OPTIONS)
+    if unknown:
+        raise ValueError(f"Unknown download options: {', '.join(sorted(unknown))}")
+    try:
+        # Search and download in the session's worker process
+        output_files, request_stats = get_scene_search_worker(conda_env, worker_slot).request('extract', dict(
+            DOWNLOAD_OPTIONS,
+            top_left=list(top_left),
+            bottom_right=list(bottom_right),
+            windows={'A': [win_a_start, win_a_end], 'B': [win_b_start, win_b_end]},
+            output_dir=output_dir,
+            output_filename=output_filename,
+            max_cloud_cover=max_cloud_cover,
+            conda_env=conda_env,
+            tiles=tiles,
+            **options
+        ), with_stats=True, on_progress=progress)
+        if stats is not None:
+            stats.update(request_stats)
         
-        # Get the output file path from the last line of output
-        output_file = result.stdout.strip().split('\n')[-1]
+        if tiles or len(output_files) > 1:
+            return output_files
         
-        return output_file
+        return output_files[0]
         
     except Exception as e:
         raise RuntimeError(f"Failed to extract patch: {str(e)}") 
\ No newline at end of file
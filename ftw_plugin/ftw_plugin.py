@@ -31,6 +31,7 @@ from .resources import *
 # Import the code for the dialog
 from .ftw_plugin_dialog import FTWDialog
 import os.path
+import sys
 
 
 class FTW:
@@ -180,6 +181,11 @@ class FTW:
                 action)
             self.iface.removeToolBarIcon(action)
 
+        # Stop the scene search workers started by downloads, if any
+        download_utils = sys.modules.get(__package__ + '.download_utils')
+        if download_utils is not None:
+            download_utils.shutdown_scene_search_workers()
+
     def load_and_display_tif(self, file_path, window_option):
         """Load a GeoTIFF file and display selected bands based on the window option.
         
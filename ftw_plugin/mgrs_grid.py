@@ -0,0 +1,281 @@
+"""
+Local index of the Sentinel-2 MGRS tile grid.
+
+Sentinel-2 L2A scenes are cut into 109.8 km tiles laid on the 100 km squares of the
+Military Grid Reference System (MGRS). The tiles of ESA's tiling grid are bundled as a small
+packed array (zone, latitude band, 100 km column and row per tile); footprints are derived
+from it with numpy on load and bucketed on a 1 degree grid, so finding the tiles and UTM
+zones an AOI touches needs no network round-trip.
+
+Only numpy is needed, at runtime and to build the bundled file from ESA's KML
+(python mgrs_grid.py tiling_grid.kml [output]).
+"""
+import os
+import re
+import sys
+import threading
+
+import numpy as np
+
+SENTINEL2_TILES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sentinel2_tiles.npz")
+
+# MGRS latitude bands, 8 degrees each from 80S, except X which spans 72N to 84N
+LATITUDE_BANDS = "CDEFGHJKLMNPQRSTUVWX"
+# 100 km square column letters, cycling every 3 zones, and row letters, cycling every 2000 km
+COLUMN_LETTERS = ("ABCDEFGH", "JKLMNPQR", "STUVWXYZ")
+ROW_LETTERS = "ABCDEFGHJKLMNPQRSTUV"
+
+MGRS_SQUARE_M = 100000
+# Sentinel-2 tiles start at the west edge of their square, extend 9.8 km past its east
+# edge, 20 m past its north edge and 9.78 km past its south edge (ESA's tiles are within
+# 40 m of this)
+S2_TILE_SIZE_M = 109800
+S2_TILE_NORTH_OVERLAP_M = 20
+
+# Cell size of the bucket grid used to find candidate tiles
+INDEX_CELL_DEG = 1.0
+
+# WGS84 ellipsoid and UTM projection parameters
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+UTM_K0 = 0.9996
+UTM_FALSE_EASTING = 500000.0
+UTM_FALSE_NORTHING_SOUTH = 10000000.0
+
+_E2 = WGS84_F * (2 - WGS84_F)
+_EP2 = _E2 / (1 - _E2)
+_M_COEFFS = (
+    1 - _E2 / 4 - 3 * _E2 ** 2 / 64 - 5 * _E2 ** 3 / 256,
+    3 * _E2 / 8 + 3 * _E2 ** 2 / 32 + 45 * _E2 ** 3 / 1024,
+    15 * _E2 ** 2 / 256 + 45 * _E2 ** 3 / 1024,
+    35 * _E2 ** 3 / 3072,
+)
+
+
+def central_meridian(zone):
+    return -183.0 + 6.0 * np.asarray(zone, dtype=float)
+
+
+def utm_inverse(easting, northing, zone, south):
+    """
+    Unproject UTM eastings/northings to WGS84 longitudes/latitudes (Snyder's series, vectorized).
+
+    Returns:
+        tuple: (lon, lat) arrays in degrees
+    """
+    e1 = (1 - np.sqrt(1 - _E2)) / (1 + np.sqrt(1 - _E2))
+    m = (np.asarray(northing, dtype=float) - np.where(south, UTM_FALSE_NORTHING_SOUTH, 0.0)) / UTM_K0
+    mu = m / (WGS84_A * _M_COEFFS[0])
+    phi1 = (mu + (3 * e1 / 2 - 27 * e1 ** 3 / 32) * np.sin(2 * mu)
+            + (21 * e1 ** 2 / 16 - 55 * e1 ** 4 / 32) * np.sin(4 * mu)
+            + (151 * e1 ** 3 / 96) * np.sin(6 * mu)
+            + (1097 * e1 ** 4 / 512) * np.sin(8 * mu))
+
+    sin_phi1, cos_phi1, tan_phi1 = np.sin(phi1), np.cos(phi1), np.tan(phi1)
+    c1 = _EP2 * cos_phi1 ** 2
+    t1 = tan_phi1 ** 2
+    n1 = WGS84_A / np.sqrt(1 - _E2 * sin_phi1 ** 2)
+    r1 = WGS84_A * (1 - _E2) / (1 - _E2 * sin_phi1 ** 2) ** 1.5
+    d = (np.asarray(easting, dtype=float) - UTM_FALSE_EASTING) / (n1 * UTM_K0)
+
+    phi = phi1 - (n1 * tan_phi1 / r1) * (
+        d ** 2 / 2 - (5 + 3 * t1 + 10 * c1 - 4 * c1 ** 2 - 9 * _EP2) * d ** 4 / 24
+        + (61 + 90 * t1 + 298 * c1 + 45 * t1 ** 2 - 252 * _EP2 - 3 * c1 ** 2) * d ** 6 / 720)
+    lam = (d - (1 + 2 * t1 + c1) * d ** 3 / 6
+           + (5 - 2 * c1 + 28 * t1 - 3 * c1 ** 2 + 8 * _EP2 + 24 * t1 ** 2) * d ** 5 / 120) / cos_phi1
+    return central_meridian(zone) + np.degrees(lam), np.degrees(phi)
+
+
+def tile_ids(zone, band, column, row):
+    """
+    Build Sentinel-2 tile ids such as '31TCJ'.
+
+    Args:
+        zone: UTM zone numbers
+        band: Latitude band indices into LATITUDE_BANDS
+        column: 100 km column numbers (easting // 100 km, 1 to 8)
+        row: 100 km row numbers (northing // 100 km, including the southern false northing)
+    """
+    return np.array([
+        f"{z:02d}{LATITUDE_BANDS[b]}{COLUMN_LETTERS[(z - 1) % 3][c - 1]}{ROW_LETTERS[(r + (5 if z % 2 == 0 else 0)) % 20]}"
+        for z, b, c, r in zip(np.asarray(zone).tolist(), np.asarray(band).tolist(),
+                              np.asarray(column).tolist(), np.asarray(row).tolist())
+    ])
+
+
+def read_esa_tile_grid(kml_path):
+    """
+    Read the Sentinel-2 tiles of ESA's tiling grid KML
+    (S2A_OPER_GIP_TILPAR_MPC__20151209T095117_V20150622T000000_21000101T000000_B00.kml).
+
+    ESA's grid only has the tiles over land and coastal waters, and follows the Norway and
+    Svalbard UTM zone exceptions (32V, 31X to 37X), so it is used as is rather than derived
+    from the MGRS definition.
+
+    Returns:
+        dict of 'zone', 'band', 'column' and 'row' arrays
+    """
+    from xml.etree import ElementTree
+
+    namespace = "{http://www.opengis.net/kml/2.2}"
+    zones, bands, columns, rows = [], [], [], []
+    for _, element in ElementTree.iterparse(kml_path):
+        if element.tag != f"{namespace}Placemark":
+            continue
+        tile_id = element.findtext(f"{namespace}name").strip()
+        # The tile's UTM outline: its west and north edges are within 40 m of its 100 km square's
+        outline = re.search(r"UTM_WKT.*?\(\(\(([^)]*)\)", element.findtext(f"{namespace}description"))
+        eastings, northings = np.array([point.split() for point in outline.group(1).split(",")], dtype=float).T
+        zones.append(int(tile_id[:2]))
+        bands.append(LATITUDE_BANDS.index(tile_id[2]))
+        columns.append(int(round(eastings.min() / MGRS_SQUARE_M)))
+        rows.append(int(round(northings.max() / MGRS_SQUARE_M)) - 1)
+        element.clear()
+    return {
+        "zone": np.array(zones, dtype=np.uint8),
+        "band": np.array(bands, dtype=np.uint8),
+        "column": np.array(columns, dtype=np.uint8),
+        "row": np.array(rows, dtype=np.uint8),
+    }
+
+
+class SentinelTileIndex:
+    """
+    In-memory index of Sentinel-2 tile footprints.
+
+    Footprints are kept as lon/lat bounding boxes of the tile outline; tiles on the zone 1
+    and 60 edges may extend past +/-180 degrees and are matched across the antimeridian.
+    """
+
+    def __init__(self, zone, band, column, row):
+        self.zone = np.asarray(zone, dtype=np.int64)
+        self.band = np.asarray(band, dtype=np.int64)
+        self.column = np.asarray(column, dtype=np.int64)
+        self.row = np.asarray(row, dtype=np.int64)
+        self.south = self.band < LATITUDE_BANDS.index("N")
+        self.ids = tile_ids(self.zone, self.band, self.column, self.row)
+        self.outlines = self._outlines()
+        self.bounds = np.column_stack([
+            self.outlines[..., 0].min(axis=1), self.outlines[..., 1].min(axis=1),
+            self.outlines[..., 0].max(axis=1), self.outlines[..., 1].max(axis=1),
+        ])
+        self._build_buckets()
+
+    @classmethod
+    def from_packed(cls, path=SENTINEL2_TILES_FILE):
+        with np.load(path) as data:
+            return cls(data["zone"], data["band"], data["column"], data["row"])
+
+    def _outlines(self, points_per_edge=3):
+        # Tile outlines in lon/lat: corners and points along each edge, (n_tiles, n_points, 2)
+        steps = np.linspace(0, 1, points_per_edge)[:-1]
+        offsets = np.concatenate([
+            np.column_stack([steps, np.zeros_like(steps)]),
+            np.column_stack([np.ones_like(steps), steps]),
+            np.column_stack([1 - steps, np.ones_like(steps)]),
+            np.column_stack([np.zeros_like(steps), 1 - steps]),
+        ]) * S2_TILE_SIZE_M
+        west = self.column * MGRS_SQUARE_M
+        south = (self.row + 1) * MGRS_SQUARE_M + S2_TILE_NORTH_OVERLAP_M - S2_TILE_SIZE_M
+        eastings = west[:, None] + offsets[None, :, 0]
+        northings = south[:, None] + offsets[None, :, 1]
+        lons, lats = utm_inverse(eastings, northings, self.zone[:, None], self.south[:, None])
+        return np.stack([lons, lats], axis=-1)
+
+    def _cells(self, lon_min, lat_min, lon_max, lat_max):
+        # Bucket grid cell ranges of bboxes, longitudes wrapping around the antimeridian
+        n_lon = int(round(360 / INDEX_CELL_DEG))
+        n_lat = int(round(180 / INDEX_CELL_DEG))
+        col0 = np.floor((np.asarray(lon_min) + 180) / INDEX_CELL_DEG).astype(np.int64)
+        col1 = np.floor((np.asarray(lon_max) + 180) / INDEX_CELL_DEG).astype(np.int64)
+        row0 = np.clip(np.floor((np.asarray(lat_min) + 90) / INDEX_CELL_DEG).astype(np.int64), 0, n_lat - 1)
+        row1 = np.clip(np.floor((np.asarray(lat_max) + 90) / INDEX_CELL_DEG).astype(np.int64), 0, n_lat - 1)
+        return n_lon, col0, col1, row0, row1
+
+    def _build_buckets(self):
+        n_lon, col0, col1, row0, row1 = self._cells(*self.bounds.T)
+        cells, tiles = [], []
+        for d_col in range(int((col1 - col0).max()) + 1):
+            for d_row in range(int((row1 - row0).max()) + 1):
+                keep = (col0 + d_col <= col1) & (row0 + d_row <= row1)
+                cells.append((row0[keep] + d_row) * n_lon + (col0[keep] + d_col) % n_lon)
+                tiles.append(np.flatnonzero(keep))
+        cells = np.concatenate(cells)
+        tiles = np.concatenate(tiles)
+        order = np.argsort(cells, kind="stable")
+        self._bucket_tiles = tiles[order]
+        self._bucket_offsets = np.searchsorted(cells[order], np.arange(n_lon * int(round(180 / INDEX_CELL_DEG)) + 1))
+
+    def query(self, bbox):
+        """
+        Find the tiles whose footprint bbox intersects a bbox.
+
+        Args:
+            bbox: [min_lon, min_lat, max_lon, max_lat] in EPSG:4326
+
+        Returns:
+            numpy array of tile indices
+        """
+        min_lon, min_lat, max_lon, max_lat = bbox
+        if min_lon > max_lon:
+            # Bbox crossing the antimeridian, e.g. 179.9 to -179.9: query both sides
+            return np.union1d(self.query([min_lon, min_lat, 180.0, max_lat]),
+                              self.query([-180.0, min_lat, max_lon, max_lat]))
+        n_lon, col0, col1, row0, row1 = self._cells(min_lon, min_lat, max_lon, max_lat)
+        cols = np.arange(int(col0), int(col1) + 1) % n_lon
+        rows = np.arange(int(row0), int(row1) + 1)
+        cells = (rows[:, None] * n_lon + cols[None, :]).ravel()
+        buckets = [self._bucket_tiles[self._bucket_offsets[c]:self._bucket_offsets[c + 1]] for c in cells]
+        if not buckets:
+            return np.empty(0, dtype=np.int64)
+        candidates = np.unique(np.concatenate(buckets))
+        bounds = self.bounds[candidates]
+        overlaps = (bounds[:, 1] <= max_lat) & (bounds[:, 3] >= min_lat)
+        lon_overlaps = np.zeros(len(candidates), dtype=bool)
+        for shift in (-360.0, 0.0, 360.0):
+            lon_overlaps |= (bounds[:, 0] + shift <= max_lon) & (bounds[:, 2] + shift >= min_lon)
+        return candidates[overlaps & lon_overlaps]
+
+    def tiles(self, bbox):
+        """Return the ids of the Sentinel-2 tiles intersecting a bbox, sorted."""
+        return sorted(self.ids[self.query(bbox)].tolist())
+
+    def utm_zones(self, bbox):
+        """Return the EPSG codes of the UTM zones of the tiles intersecting a bbox, sorted."""
+        indices = self.query(bbox)
+        return sorted(set((np.where(self.south[indices], 32700, 32600) + self.zone[indices]).tolist()))
+
+    def tiles_for_geometry(self, geometry):
+        """
+        Return the ids of the Sentinel-2 tiles whose outline intersects a shapely geometry in
+        EPSG:4326, sorted.
+        """
+        from shapely.geometry import Polygon
+
+        return sorted(
+            self.ids[i] for i in self.query(geometry.bounds).tolist()
+            if Polygon(self.outlines[i]).intersects(geometry)
+        )
+
+
+_tile_indexes = {}
+# Date lookups run in worker threads; only one of them loads the index
+_tile_indexes_lock = threading.Lock()
+
+
+def get_tile_index(path=SENTINEL2_TILES_FILE):
+    """Return the session-wide SentinelTileIndex, loading it on first use."""
+    with _tile_indexes_lock:
+        index = _tile_indexes.get(path)
+        if index is None:
+            index = _tile_indexes[path] = SentinelTileIndex.from_packed(path)
+    return index
+
+
+if __name__ == "__main__":
+    # Build step: python mgrs_grid.py tiling_grid.kml [output_file]
+    if len(sys.argv) < 2:
+        sys.exit("Usage: python mgrs_grid.py tiling_grid.kml [output_file]")
+    output_path = sys.argv[2] if len(sys.argv) > 2 else SENTINEL2_TILES_FILE
+    np.savez_compressed(output_path, **read_esa_tile_grid(sys.argv[1]))
+    print(output_path)
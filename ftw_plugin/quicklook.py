@@ -0,0 +1,108 @@
+"""
+Quicklook-based scene vetting, run inside the FTW conda environment.
+
+Before committing to a full 8-band download, the small preview of each top candidate is read
+over the AOI and scored for cloud and haze with numpy, so a scene that is hazy over the AOI
+despite a low scene-wide eo:cloud_cover can be passed over for a few KB per candidate.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Assets tried in order; previews are small 8-bit RGB images, 'visual' is read from its overviews
+QUICKLOOK_ASSETS = ("preview", "thumbnail", "rendered_preview", "visual")
+# Longest side, in pixels, a quicklook is read at over the AOI
+QUICKLOOK_MAX_SIZE = 256
+QUICKLOOK_WORKERS = 4
+
+# 8-bit RGB thresholds: clouds are bright in all bands, haze is fairly bright and grey
+CLOUD_MIN_BRIGHTNESS = 170
+HAZE_MIN_BRIGHTNESS = 110
+HAZE_MAX_SATURATION = 25
+HAZE_WEIGHT = 0.5
+
+
+def cloud_haze_score(rgb):
+    """
+    Score an 8-bit RGB quicklook for cloud and haze.
+
+    Args:
+        rgb: Array of shape (3, rows, cols); pixels that are 0 in all bands are nodata
+
+    Returns:
+        float: Fraction of cloudy pixels plus HAZE_WEIGHT times the fraction of hazy ones,
+        from 0 (clear) to 1; 1 if no pixel is valid
+    """
+    rgb = rgb.astype(np.int16)
+    valid = rgb.any(axis=0)
+    if not valid.any():
+        return 1.0
+    low, high = rgb.min(axis=0), rgb.max(axis=0)
+    cloudy = low >= CLOUD_MIN_BRIGHTNESS
+    hazy = ~cloudy & (rgb.mean(axis=0) >= HAZE_MIN_BRIGHTNESS) & (high - low <= HAZE_MAX_SATURATION)
+    n_valid = valid.sum()
+    return float((cloudy & valid).sum() / n_valid + HAZE_WEIGHT * (hazy & valid).sum() / n_valid)
+
+
+def read_quicklook(item, aoi_bounds):
+    """
+    Read the quicklook of an item over an AOI.
+
+    Args:
+        item: Item dict with signed asset hrefs
+        aoi_bounds: (min_lon, min_lat, max_lon, max_lat)
+
+    Returns:
+        (3, rows, cols) uint8 array, or None if the item has no readable quicklook
+    """
+    import rasterio
+    from rasterio.crs import CRS
+    from rasterio.transform import Affine
+    from rasterio.warp import transform_bounds
+    from rasterio.windows import Window, from_bounds
+
+    for name in QUICKLOOK_ASSETS:
+        asset = item.get("assets", {}).get(name)
+        if asset is None:
+            continue
+        try:
+            with rasterio.open(asset["href"]) as src:
+                if src.count < 3:
+                    continue
+                crs, transform = src.crs, src.transform
+                if crs is None:
+                    # Plain PNG/JPEG thumbnails: only usable if the asset's proj: fields place them
+                    code = asset.get("proj:code") or (f"EPSG:{asset['proj:epsg']}" if asset.get("proj:epsg") else None)
+                    shape = asset.get("proj:shape")
+                    if not code or not asset.get("proj:transform") or list(shape or []) != [src.height, src.width]:
+                        print(f"Skipping the {name} quicklook of {item['id']}: it is not georeferenced")
+                        continue
+                    crs, transform = CRS.from_user_input(code), Affine(*asset["proj:transform"][:6])
+                bounds = transform_bounds("EPSG:4326", crs, *aoi_bounds)
+                window = from_bounds(*bounds, transform=transform)
+                window = window.intersection(Window(0, 0, src.width, src.height))
+                scale = min(1.0, QUICKLOOK_MAX_SIZE / max(window.width, window.height))
+                out_shape = (3, max(1, int(window.height * scale)), max(1, int(window.width * scale)))
+                return src.read([1, 2, 3], window=window, out_shape=out_shape)
+        except Exception as e:
+            print(f"Could not read the {name} quicklook of {item['id']}: {e}")
+    return None
+
+
+def vet_scenes(items, aoi_bounds, max_workers=QUICKLOOK_WORKERS):
+    """
+    Score the quicklooks of candidate scenes over an AOI, concurrently.
+
+    Args:
+        items: Item dicts with signed asset hrefs
+        aoi_bounds: (min_lon, min_lat, max_lon, max_lat)
+
+    Returns:
+        list: Cloud/haze score of each item (see cloud_haze_score), None where no quicklook was readable
+    """
+    def score(item):
+        rgb = read_quicklook(item, aoi_bounds)
+        return None if rgb is None else cloud_haze_score(rgb)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(score, items))
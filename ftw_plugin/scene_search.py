@@ -0,0 +1,461 @@
+"""
+Sentinel-2 scene search and download worker, run with the Python of the FTW conda environment.
+
+The plugin starts it once per QGIS session (see SceneSearchWorker in download_utils.py) and
+sends it one JSON request per line on stdin; it answers one JSON line per request on stdout
+(see serve()). Catalog clients, HTTP sessions and the search cache stay warm between downloads.
+
+Scenes are searched in Planetary Computer, a STAC API or a local catalog (see stac_backends.py),
+optionally vetted with their quicklooks (see quicklook.py), and downloaded with the windowed
+COG reader (see cog_reader.py), with `ftw inference download`, or composited pixel by pixel
+(see composite.py).
+"""
+
+import os
+import sys
+import json
+import math
+import shutil
+import subprocess
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import shapely
+from shapely.geometry import box, shape
+
+from block_cache import BlockCache
+from cog_reader import THROTTLE, read_stack
+from composite import COMPOSITE_RESOLUTION_M, write_composite
+from quicklook import vet_scenes
+from stac_backends import cloud_cover_of, get_backend
+from stac_cache import StacCache
+from storage_profiles import DEFAULT_STORAGE_BLOCK_SIZE, DEFAULT_STORAGE_PROFILE, convert
+
+# Search bboxes are snapped outward to this grid, so nearby and overlapping AOIs share
+# cached searches; the items are then filtered against the actual AOI
+SEARCH_BBOX_SNAP_DEG = 0.1
+
+# A scene covering this fraction of the AOI counts as covering all of it
+FULL_COVERAGE_FRACTION = 0.995
+# Scenes adding less than this fraction of the AOI are not worth another download
+MIN_COVERAGE_GAIN = 0.001
+
+# Seconds between the progress lines of a running extract request
+PROGRESS_INTERVAL_SECONDS = 1.0
+
+def snap_bbox(bbox, step=SEARCH_BBOX_SNAP_DEG):
+    """Snap a [min_lon, min_lat, max_lon, max_lat] bbox outward to a grid of the given step."""
+    min_lon, min_lat, max_lon, max_lat = bbox
+    return [
+        round(math.floor(min_lon / step) * step, 6),
+        round(math.floor(min_lat / step) * step, 6),
+        round(math.ceil(max_lon / step) * step, 6),
+        round(math.ceil(max_lat / step) * step, 6),
+    ]
+
+def coverage_fractions(footprints, aoi):
+    """Fraction of the AOI covered by each footprint, computed in one vectorized pass."""
+    if aoi.area == 0:
+        return shapely.intersects(footprints, aoi).astype(float)
+    return shapely.area(shapely.intersection(footprints, aoi)) / aoi.area
+
+def select_scenes(items, footprints, coverage, aoi, max_cloud_cover):
+    """
+    Select the scenes of one window below a cloud cover threshold.
+
+    The least cloudy scene covering the whole AOI is preferred. Otherwise scenes are added
+    greedily by the fraction of the still uncovered AOI they cover clear of clouds,
+    new coverage * (1 - cloud cover), until together they cover it.
+
+    Args:
+        items: Candidate item dicts
+        footprints: Array of their footprint geometries
+        coverage: Fraction of the AOI covered by each footprint
+        aoi: AOI geometry
+        max_cloud_cover: Cloud cover threshold in percent
+
+    Returns:
+        tuple: (indices of the selected items, best first, fraction of the AOI they cover)
+    """
+    cloud = np.array([cloud_cover_of(item) for item in items], dtype=float)
+    eligible = cloud < max_cloud_cover
+
+    full = np.flatnonzero(eligible & (coverage >= FULL_COVERAGE_FRACTION))
+    if full.size:
+        best = full[np.lexsort((-coverage[full], cloud[full]))[0]]
+        return [best], float(coverage[best])
+
+    selected = []
+    remaining = aoi
+    candidates = np.flatnonzero(eligible & (coverage > 0))
+    while candidates.size and 1 - remaining.area / aoi.area < FULL_COVERAGE_FRACTION:
+        gain = coverage_fractions(footprints[candidates], remaining) * remaining.area / aoi.area
+        best = int(np.argmax(gain * (1 - cloud[candidates] / 100)))
+        if gain[best] < MIN_COVERAGE_GAIN:
+            break
+        selected.append(candidates[best])
+        remaining = remaining.difference(footprints[candidates[best]])
+        candidates = np.delete(candidates, best)
+    return selected, 1 - remaining.area / aoi.area
+
+def get_best_images(top_left, bottom_right, win_a_start, win_a_end, win_b_start, win_b_end, max_cloud_cover=20, cache=None, backend=None, quicklook_candidates=0, composite_scenes=0):
+    """
+    Select the scenes of windows A and B for a bbox.
+
+    With composite_scenes > 1, each window gets up to that many scenes for compositing: the
+    selected ones, then the least cloudy others intersecting the bbox.
+
+    With quicklook_candidates > 1, the least cloudy scenes covering the bbox, up to that many,
+    are vetted with their quicklooks over the bbox and the clearest one is picked.
+
+    Returns:
+        tuple: (scenes of window A, scenes of window B, [min_lon, min_lat, max_lon, max_lat]),
+        scenes being (item dict, footprint geometry) pairs, best first. Each window has a single
+        scene unless no scene covers the whole bbox.
+    """
+    # Items are cached unsigned; the backend signs their assets when needed
+    if backend is None:
+        backend = get_backend()
+    if not backend.cacheable:
+        cache = None
+
+    min_lon, min_lat = top_left[0], bottom_right[1]
+    max_lon, max_lat = bottom_right[0], top_left[1]
+    aoi = box(min_lon, min_lat, max_lon, max_lat)
+    search_bbox = snap_bbox([min_lon, min_lat, max_lon, max_lat])
+
+    def search_items(start_date, end_date):
+        time_range = f"{start_date}/{end_date}"
+        key = StacCache.search_key(
+            source=backend.source, collection=backend.collection, bbox=search_bbox, datetime=time_range,
+        )
+        if cache is not None:
+            items = cache.get_search(key)
+            if items is not None:
+                print(f"Using {len(items)} cached search results between {start_date} and {end_date}")
+                return items
+
+        print(f"Searching {backend.source} for images between {start_date} and {end_date}")
+        items = backend.search(search_bbox, time_range)
+        if cache is not None:
+            cache.put_search(key, items)
+        return items
+
+    def find_candidates(start_date, end_date):
+        # One search per window: all candidates at once, with their coverage of the bbox
+        items = [item for item in search_items(start_date, end_date) if item.get("geometry")]
+        footprints = np.array([shape(item["geometry"]) for item in items], dtype=object)
+        coverage = coverage_fractions(footprints, aoi)
+        keep = coverage > 0
+        return [item for item, kept in zip(items, keep) if kept], footprints[keep], coverage[keep]
+
+    def select_best_images(candidates, cloud_thresholds):
+        # Rank the candidates locally, relaxing the cloud cover threshold only if needed
+        items, footprints, coverage = candidates
+        partial = None
+        for threshold in cloud_thresholds:
+            if not any(cloud_cover_of(item) < threshold for item in items):
+                print(f"No images found with cloud cover < {threshold}%")
+                continue
+            selected, covered = select_scenes(items, footprints, coverage, aoi, threshold)
+            if covered >= FULL_COVERAGE_FRACTION:
+                selected_threshold = threshold
+                break
+            print(f"Images with cloud cover < {threshold}% only cover {covered:.0%} of the area")
+            if partial is None or covered > partial[1]:
+                partial = selected, covered, threshold
+        else:
+            if partial is None:
+                return None
+            # The threshold that gave the best partial selection, not the last one tried
+            selected, covered, selected_threshold = partial
+            print(f"Using images covering {covered:.0%} of the area")
+        if quicklook_candidates > 1 and len(selected) == 1:
+            selected = [vet_candidates(items, coverage, selected_threshold, selected[0])]
+        if composite_scenes > len(selected):
+            others = [i for i in np.argsort([cloud_cover_of(item) for item in items], kind="stable")
+                      if i not in selected and cloud_cover_of(items[i]) < selected_threshold]
+            selected = list(selected) + others[:composite_scenes - len(selected)]
+        for i in selected:
+            item = items[i]
+            date = item["properties"].get("datetime", "")[:10]
+            print(f"Found image from {date} with {cloud_cover_of(item)}% cloud coverage "
+                  f"covering {coverage[i]:.0%} of the area")
+        return [(items[i], footprints[i]) for i in selected]
+
+    def vet_candidates(items, coverage, threshold, best):
+        # Check the quicklooks of the least cloudy scenes covering the bbox; eo:cloud_cover
+        # is scene-wide and misses haze, so the clearest over the bbox wins
+        candidates = [i for i in np.argsort([cloud_cover_of(item) for item in items], kind="stable")
+                      if cloud_cover_of(items[i]) < threshold and coverage[i] >= FULL_COVERAGE_FRACTION]
+        candidates = candidates[:quicklook_candidates]
+        if len(candidates) < 2:
+            return best
+        full_items = backend.sign_items(backend.get_items([items[i]["id"] for i in candidates]), cache)
+        scores = dict(zip((item["id"] for item in full_items), vet_scenes(full_items, aoi.bounds)))
+        scored = [(scores[items[i]["id"]], rank, i) for rank, i in enumerate(candidates)
+                  if scores.get(items[i]["id"]) is not None]
+        if not scored:
+            print("No quicklooks available, keeping the least cloudy image")
+            return best
+        for score, _, i in scored:
+            date = items[i]["properties"].get("datetime", "")[:10]
+            print(f"Quicklook of image from {date}: cloud/haze score {score:.2f} over the area")
+        return min(scored)[2]
+
+    # Search both windows concurrently with the shared backend
+    windows = {"A": (win_a_start, win_a_end), "B": (win_b_start, win_b_end)}
+    with ThreadPoolExecutor(max_workers=len(windows)) as executor:
+        searches = {name: executor.submit(find_candidates, start, end) for name, (start, end) in windows.items()}
+
+    # Try different cloud cover thresholds if needed, and report the errors of both windows together
+    cloud_thresholds = [max_cloud_cover, 50, 70, 100]
+    scenes = {}
+    errors = []
+    for name, search in searches.items():
+        start, end = windows[name]
+        try:
+            scenes[name] = select_best_images(search.result(), cloud_thresholds)
+        except Exception as e:
+            errors.append(f"Search for window {name} ({start} to {end}) failed: {e}")
+            continue
+        if scenes[name] is None:
+            errors.append(f"Could not find suitable images for window {name} ({start} to {end}) even with 100% cloud cover")
+    if errors:
+        raise ValueError("\n".join(errors))
+
+    return scenes["A"], scenes["B"], [min_lon, min_lat, max_lon, max_lat]
+
+def plan_download_parts(bbox, scenes_a, scenes_b):
+    """
+    Split a download bbox into parts each covered by one scene of window A and one of window B.
+
+    Args:
+        bbox: [min_lon, min_lat, max_lon, max_lat]
+        scenes_a: (item, footprint) pairs of window A, best first
+        scenes_b: (item, footprint) pairs of window B, best first
+
+    Returns:
+        list of (win_a_id, win_b_id, part bbox); the whole bbox when each window has one scene.
+        Part bboxes can overlap where footprints are not rectangular.
+    """
+    if len(scenes_a) == 1 and len(scenes_b) == 1:
+        return [(scenes_a[0][0]["id"], scenes_b[0][0]["id"], list(bbox))]
+
+    area = box(*bbox)
+    remaining = area
+    parts = []
+    for item_a, footprint_a in scenes_a:
+        for item_b, footprint_b in scenes_b:
+            region = remaining.intersection(footprint_a).intersection(footprint_b)
+            if region.area <= MIN_COVERAGE_GAIN * area.area:
+                continue
+            parts.append((item_a["id"], item_b["id"], list(region.bounds)))
+            remaining = remaining.difference(region)
+    return parts
+
+def find_ftw_command(conda_env=None):
+    """Return the path of the ftw command of a conda environment, or of the system."""
+    if conda_env:
+        if os.name == 'nt':  # Windows
+            ftw_cmd = os.path.join(conda_env, 'Scripts', 'ftw.exe')
+        else:  # Unix-like
+            ftw_cmd = os.path.join(conda_env, 'bin', 'ftw')
+    else:
+        ftw_cmd = shutil.which('ftw') or 'ftw'  # Try to use system ftw
+
+    # Check if ftw command exists
+    if not os.path.exists(ftw_cmd):
+        raise FileNotFoundError(f"ftw command not found at {ftw_cmd}. Please ensure it is installed in the conda environment.")
+    return ftw_cmd
+
+def extract(request, backend, cache, block_cache=None):
+    """
+    Search the scenes of a request and download them.
+
+    Args:
+        request: Dict with 'top_left' and 'bottom_right' [lon, lat], 'windows' {"A": [start, end],
+            "B": [start, end]}, 'output_dir', 'output_filename', 'max_cloud_cover' and optionally
+            'conda_env', 'tiles', 'quicklook_candidates', 'composite_scenes', 'native_reader',
+            'preview_resolution', 'storage_profile' and 'block_size' (see extract_patch in
+            download_utils.py)
+        backend: StacBackend to search
+        cache: StacCache of searches and signed hrefs
+        block_cache: Optional BlockCache of the COG blocks read by the native reader
+
+    Returns:
+        list of output files
+    """
+    (win_a_start, win_a_end), (win_b_start, win_b_end) = request["windows"]["A"], request["windows"]["B"]
+    output_dir = request["output_dir"]
+    output_filename = request["output_filename"]
+    tiles = request.get("tiles")
+    quicklook_candidates = int(request.get("quicklook_candidates") or 0)
+    composite_scenes = int(request.get("composite_scenes") or 0)
+    preview_resolution = request.get("preview_resolution") or None
+    # Previews are read from the COG overviews, which only the native reader can do
+    native_reader = bool(request.get("native_reader")) or preview_resolution is not None
+    # Output layout; None keeps the layout the composite or the ftw CLI writes
+    storage_profile = request.get("storage_profile") or None
+    block_size = int(request.get("block_size") or DEFAULT_STORAGE_BLOCK_SIZE)
+
+    # Get the best scenes and bbox, reusing cached searches of the same area
+    scenes_a, scenes_b, bbox_list = get_best_images(
+        tuple(request["top_left"]), tuple(request["bottom_right"]),
+        win_a_start, win_a_end,
+        win_b_start, win_b_end,
+        int(request["max_cloud_cover"]),
+        cache=cache,
+        backend=backend,
+        quicklook_candidates=quicklook_candidates,
+        composite_scenes=composite_scenes
+    )
+    if composite_scenes > 1:
+        # Compositing reads the assets directly, so it needs full, signed items
+        composite_windows = [
+            backend.sign_items(backend.get_items([item["id"] for item, _ in scenes]), cache)
+            for scenes in (scenes_a, scenes_b)
+        ]
+    elif native_reader:
+        # The COG reader reads the assets directly, so it needs full, signed items
+        ids = list(dict.fromkeys(item["id"] for scenes in (scenes_a, scenes_b) for item, _ in scenes))
+        full_items = {item["id"]: item for item in backend.sign_items(backend.get_items(ids), cache)}
+    else:
+        ftw_cmd = find_ftw_command(request.get("conda_env"))
+
+    # Create output directory if it doesn't exist
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Download the whole bbox, or each tile from the same scenes
+    if tiles is None:
+        outputs = [(bbox_list, os.path.join(output_dir, output_filename))]
+    else:
+        stem, ext = os.path.splitext(output_filename)
+        outputs = [(tile, os.path.join(output_dir, f"{stem}_{i + 1}{ext}")) for i, tile in enumerate(tiles)]
+
+    # Areas no single scene covers are downloaded in parts, one per pair of scenes
+    output_paths = []
+    for tile_bbox, output_path in outputs:
+        if composite_scenes > 1:
+            # Per-pixel composite of the clear observations of all scenes instead
+            write_composite(composite_windows, tile_bbox, output_path,
+                            resolution=preview_resolution or COMPOSITE_RESOLUTION_M, block_cache=block_cache)
+            if storage_profile is not None:
+                convert(output_path, storage_profile, block_size)
+            output_paths.append(output_path)
+            continue
+
+        parts = plan_download_parts(tile_bbox, scenes_a, scenes_b)
+        if len(parts) > 1:
+            stem, ext = os.path.splitext(output_path)
+            part_paths = [f"{stem}_part{k + 1}{ext}" for k in range(len(parts))]
+        else:
+            part_paths = [output_path]
+
+        for (win_a_id, win_b_id, part_bbox), part_path in zip(parts, part_paths):
+            if native_reader:
+                # Only the blocks of the part's bbox that aren't cached yet are fetched from each band
+                read_stack([full_items[win_a_id], full_items[win_b_id]], part_bbox, part_path,
+                           resolution=preview_resolution, block_cache=block_cache,
+                           storage_profile=storage_profile or DEFAULT_STORAGE_PROFILE, block_size=block_size)
+                output_paths.append(part_path)
+                continue
+
+            # Run ftw command
+            cmd = [
+                ftw_cmd, "inference", "download",
+                "--win_a", win_a_id,
+                "--win_b", win_b_id,
+                "--out", part_path,
+                "--bbox", ",".join(map(str, part_bbox)),
+                "--overwrite"
+            ]
+
+            result = subprocess.run(cmd, capture_output=True, text=True)
+            if result.returncode != 0:
+                raise RuntimeError(f"ftw inference download failed: {result.stderr.strip()}")
+            if storage_profile is not None:
+                convert(part_path, storage_profile, block_size)
+            output_paths.append(part_path)
+
+    return output_paths
+
+def serve(requests=sys.stdin, responses=sys.stdout):
+    """
+    Answer JSON requests, one per line, until the input is closed.
+
+    Each request is {"id": ..., "command": "extract" | "ping", "params": {...}}; each response
+    is one line {"id": ..., "ok": true, "result": ...} or {"id": ..., "ok": false, "error": ...}.
+    Extract responses add "stats": {"bytes_read": ..., "seconds": ...}; while an extract request
+    runs, lines {"id": ..., "progress": {"bytes_read": ..., "seconds": ...}} are sent every
+    PROGRESS_INTERVAL_SECONDS before its response. Its params may set "max_bytes_per_second"
+    to cap the bandwidth of the COG reader, and "rate_file" to a file the cap is read from
+    again while the request runs (see cog_reader.Throttle).
+    Backends (and their HTTP clients), the search cache and the block cache stay open between
+    requests.
+    """
+    backends = {}
+    cache = StacCache()
+    cache.prune()
+    block_cache = BlockCache()
+    write_lock = threading.Lock()
+
+    def write(message):
+        with write_lock:
+            responses.write(json.dumps(message) + "\n")
+            responses.flush()
+
+    def report_progress(request_id, start, done):
+        while not done.wait(PROGRESS_INTERVAL_SECONDS):
+            write({"id": request_id, "progress": {"bytes_read": THROTTLE.bytes_read, "seconds": time.monotonic() - start}})
+
+    try:
+        for line in requests:
+            if not line.strip():
+                continue
+            request_id = None
+            stats = None
+            try:
+                request = json.loads(line)
+                request_id = request.get("id")
+                if request["command"] == "ping":
+                    result = "pong"
+                elif request["command"] == "extract":
+                    params = request["params"]
+                    source = params.get("stac_source") or None
+                    if source not in backends:
+                        backends[source] = get_backend(source)
+                    # Bytes read by the COG reader, under the request's bandwidth cap if any
+                    THROTTLE.reset(params.get("max_bytes_per_second") or None, params.get("rate_file"))
+                    start = time.monotonic()
+                    done = threading.Event()
+                    reporter = threading.Thread(target=report_progress, args=(request_id, start, done), daemon=True)
+                    reporter.start()
+                    try:
+                        result = extract(params, backends[source], cache, block_cache)
+                    finally:
+                        done.set()
+                        reporter.join()
+                    stats = {"bytes_read": THROTTLE.bytes_read, "seconds": time.monotonic() - start}
+                else:
+                    raise ValueError(f"Unknown command: {request['command']}")
+                response = {"id": request_id, "ok": True, "result": result}
+                if stats is not None:
+                    response["stats"] = stats
+            except Exception as e:
+                traceback.print_exc(file=sys.stderr)
+                response = {"id": request_id, "ok": False, "error": str(e)}
+            write(response)
+    finally:
+        cache.close()
+        block_cache.close()
+
+if __name__ == "__main__":
+    # Responses get their own copy of stdout; anything else printing to stdout, from Python
+    # or native libraries, goes to stderr so it can never corrupt the protocol
+    responses = os.fdopen(os.dup(sys.stdout.fileno()), "w", encoding="utf-8")
+    sys.stdout.flush()
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    serve(sys.stdin, responses)
@@ -0,0 +1,240 @@
+"""
+STAC backends scenes are searched in: Microsoft Planetary Computer, any STAC API, or a
+local static catalog/directory of items, e.g. a mirror on an airgapped network.
+
+This module runs inside the FTW conda environment, next to scene_search.py. All backends
+return item dicts, least cloudy first, so scene ranking is the same whatever the source.
+"""
+import glob
+import json
+import os
+import threading
+
+import pystac_client
+from pystac_client.conformance import ConformanceClasses
+from pystac_client.exceptions import APIError
+from shapely.geometry import box, shape
+
+MSPC_URL = "https://planetarycomputer.microsoft.com/api/stac/v1"
+COLLECTION_ID = "sentinel-2-l2a"
+SEARCH_PAGE_SIZE = 100
+SEARCH_SORTBY = [{"field": "properties.eo:cloud_cover", "direction": "asc"}]
+SEARCH_FIELDS = {
+    "include": ["id", "type", "stac_version", "collection", "bbox", "geometry",
+                "properties.datetime", "properties.eo:cloud_cover"],
+    "exclude": [],
+}
+
+# Source used when none is given: "planetary-computer", a STAC API URL, or the path of a
+# local catalog.json or directory of item JSON files
+STAC_SOURCE_ENV = "FTW_STAC_SOURCE"
+PLANETARY_COMPUTER = "planetary-computer"
+
+
+def cloud_cover_of(item):
+    return item["properties"].get("eo:cloud_cover", 100)
+
+
+class StacBackend:
+    """
+    Base class of the STAC backends.
+
+    Subclasses implement search(); sign_items() makes asset hrefs readable and is a no-op
+    unless the backend needs signed URLs.
+    """
+
+    # Whether search results are worth caching on disk (see stac_cache.py)
+    cacheable = True
+
+    def __init__(self, collection=COLLECTION_ID):
+        self.collection = collection
+
+    @property
+    def source(self):
+        """Identify the backend in cache keys and messages."""
+        raise NotImplementedError
+
+    def search(self, bbox, time_range, limit=SEARCH_PAGE_SIZE):
+        """
+        Search the items intersecting a bbox in a time range.
+
+        Args:
+            bbox: [min_lon, min_lat, max_lon, max_lat]
+            time_range: 'YYYY-MM-DD/YYYY-MM-DD'
+            limit: Page size of the search
+
+        Returns:
+            list: Item dicts, least cloudy first
+        """
+        raise NotImplementedError
+
+    def get_items(self, ids):
+        """Fetch the full item dicts, with their assets, of item ids, in the same order."""
+        raise NotImplementedError
+
+    def sign_items(self, items, cache=None):
+        return items
+
+
+class StacApiBackend(StacBackend):
+    """A STAC API, searched with pystac_client."""
+
+    def __init__(self, url, collection=COLLECTION_ID):
+        super().__init__(collection)
+        self.url = url
+        # Opened once and shared by concurrent searches
+        self.client = pystac_client.Client.open(url)
+        # Sort server-side and only fetch the fields needed for ranking, where the API supports it
+        self.sorted_search = (self.client.conforms_to(ConformanceClasses.SORT)
+                              and self.client.conforms_to(ConformanceClasses.FIELDS))
+
+    @property
+    def source(self):
+        return self.url
+
+    def search(self, bbox, time_range, limit=SEARCH_PAGE_SIZE):
+        search_kwargs = dict(
+            collections=[self.collection],
+            bbox=bbox,
+            datetime=time_range,
+            limit=limit,
+        )
+        if self.sorted_search:
+            try:
+                search = self.client.search(sortby=SEARCH_SORTBY, fields=SEARCH_FIELDS, **search_kwargs)
+                return list(search.items_as_dicts())
+            except APIError as e:
+                # An API can declare the extensions and still reject these parameters; any
+                # other error (timeout, server or auth error) is not worth a second request
+                if getattr(e, "status_code", None) != 400:
+                    raise
+                print(f"Sorted search rejected ({e}), fetching full items")
+                self.sorted_search = False
+        search = self.client.search(**search_kwargs)
+        return sorted(search.items_as_dicts(), key=cloud_cover_of)
+
+    def get_items(self, ids):
+        items = {item["id"]: item for item in self.client.search(collections=[self.collection], ids=list(ids)).items_as_dicts()}
+        return [items[item_id] for item_id in ids if item_id in items]
+
+
+class PlanetaryComputerBackend(StacApiBackend):
+    """Microsoft Planetary Computer, whose asset hrefs need SAS tokens."""
+
+    def __init__(self, collection=COLLECTION_ID):
+        super().__init__(MSPC_URL, collection)
+
+    @property
+    def source(self):
+        return PLANETARY_COMPUTER
+
+    def sign_items(self, items, cache=None):
+        """
+        Sign the asset hrefs of item dicts in place, reusing the signed hrefs persisted in
+        the cache until their SAS token expires.
+        """
+        import planetary_computer
+
+        assets = [asset for item in items for asset in item.get("assets", {}).values()]
+        signed = cache.get_signed_hrefs([asset["href"] for asset in assets]) if cache is not None else {}
+        new = {}
+        for asset in assets:
+            href = asset["href"]
+            if href not in signed:
+                signed[href] = new[href] = planetary_computer.sign(href)
+            asset["href"] = signed[href]
+        if cache is not None and new:
+            cache.put_signed_hrefs(new)
+        return items
+
+
+class LocalCatalogBackend(StacBackend):
+    """
+    A static STAC catalog (catalog.json / collection.json) or a directory tree of item
+    JSON files on a local or network drive.
+
+    Items are loaded once and searched in memory; asset hrefs are made absolute.
+    """
+
+    cacheable = False
+
+    def __init__(self, path, collection=COLLECTION_ID):
+        super().__init__(collection)
+        self.path = os.path.abspath(path)
+        self._items = None
+        self._footprints = None
+        self._lock = threading.Lock()
+
+    @property
+    def source(self):
+        return self.path
+
+    def _load_items(self):
+        if os.path.isdir(self.path):
+            items = []
+            for path in glob.glob(os.path.join(self.path, "**", "*.json"), recursive=True):
+                with open(path) as f:
+                    item = json.load(f)
+                if item.get("type") == "Feature":
+                    items.append(self._absolute_hrefs(item, os.path.dirname(path)))
+        else:
+            import pystac
+            catalog = pystac.read_file(self.path)
+            items = [item.to_dict(transform_hrefs=True) for item in catalog.get_items(recursive=True)]
+        return [item for item in items if item.get("collection", self.collection) == self.collection]
+
+    @staticmethod
+    def _absolute_hrefs(item, base_dir):
+        for asset in item.get("assets", {}).values():
+            href = asset.get("href", "")
+            if href and "://" not in href and not os.path.isabs(href):
+                asset["href"] = os.path.normpath(os.path.join(base_dir, href))
+        return item
+
+    def _load(self):
+        # Both windows are searched concurrently; only the first search loads the catalog
+        with self._lock:
+            if self._items is None:
+                items = self._load_items()
+                self._footprints = [shape(item["geometry"]) if item.get("geometry") else box(*item["bbox"])
+                                    for item in items]
+                self._items = items
+                print(f"Loaded {len(items)} items from {self.path}")
+        return self._items, self._footprints
+
+    def search(self, bbox, time_range, limit=SEARCH_PAGE_SIZE):
+        start, end = time_range.split("/")
+        area = box(*bbox)
+        items, footprints = self._load()
+        matches = [
+            item for item, footprint in zip(items, footprints)
+            if start <= item["properties"].get("datetime", "")[:10] <= end and footprint.intersects(area)
+        ]
+        return sorted(matches, key=cloud_cover_of)
+
+    def get_items(self, ids):
+        items, _ = self._load()
+        by_id = {item["id"]: item for item in items}
+        return [by_id[item_id] for item_id in ids if item_id in by_id]
+
+
+def get_backend(source=None, collection=COLLECTION_ID):
+    """
+    Get the backend of a STAC source.
+
+    Args:
+        source: "planetary-computer", a STAC API URL, or the path of a local catalog or
+            directory. Defaults to the FTW_STAC_SOURCE environment variable, then Planetary Computer.
+        collection: Collection to search
+
+    Returns:
+        StacBackend
+    """
+    source = source or os.environ.get(STAC_SOURCE_ENV) or PLANETARY_COMPUTER
+    if source == PLANETARY_COMPUTER:
+        return PlanetaryComputerBackend(collection)
+    if source.startswith(("http://", "https://")):
+        return StacApiBackend(source, collection)
+    if not os.path.exists(source):
+        raise FileNotFoundError(f"STAC catalog not found: {source}")
+    return LocalCatalogBackend(source, collection)
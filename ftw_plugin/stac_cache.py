@@ -0,0 +1,144 @@
+"""
+Persistent SQLite cache of STAC searches, items and signed asset hrefs.
+
+This module runs inside the FTW conda environment, next to scene_search.py, and only
+depends on the standard library.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import parse_qs, urlparse
+
+# Directory of the cache database, overridable with the FTW_STAC_CACHE_DIR environment variable
+CACHE_DIR_ENV = "FTW_STAC_CACHE_DIR"
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "ftw_plugin")
+CACHE_FILENAME = "stac_cache.sqlite"
+
+# How long search results stay valid; new scenes keep being ingested for recent windows
+SEARCH_TTL_SECONDS = 24 * 3600
+
+# Signed hrefs are dropped this many seconds before their token expires, to leave time to use them
+TOKEN_EXPIRY_MARGIN_SECONDS = 300
+# Hrefs looked up per query, under SQLite's limit on query parameters
+SIGNED_HREFS_PER_QUERY = 500
+
+
+def default_cache_path():
+    return os.path.join(os.environ.get(CACHE_DIR_ENV, DEFAULT_CACHE_DIR), CACHE_FILENAME)
+
+
+def signed_href_expiry(href):
+    """Return the expiry timestamp of a SAS-signed href, from its 'se' parameter, or None."""
+    values = parse_qs(urlparse(href).query).get("se")
+    if not values:
+        return None
+    try:
+        expiry = datetime.fromisoformat(values[0].replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if expiry.tzinfo is None:
+        expiry = expiry.replace(tzinfo=timezone.utc)
+    return expiry.timestamp()
+
+
+class StacCache:
+    """
+    SQLite-backed cache of STAC search results and item JSON, with a TTL, plus signed
+    asset hrefs kept until their token expires.
+
+    Searches store the ids of their items; item JSON is stored once per id, so overlapping
+    searches share it. The connection is shared between threads behind a lock.
+    """
+
+    def __init__(self, path=None, ttl=SEARCH_TTL_SECONDS):
+        self.path = path or default_cache_path()
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.executescript("""
+                CREATE TABLE IF NOT EXISTS searches (key TEXT PRIMARY KEY, item_ids TEXT NOT NULL, created REAL NOT NULL);
+                CREATE TABLE IF NOT EXISTS items (id TEXT PRIMARY KEY, item TEXT NOT NULL, created REAL NOT NULL);
+                CREATE TABLE IF NOT EXISTS signed_hrefs (href TEXT PRIMARY KEY, signed_href TEXT NOT NULL, expiry REAL NOT NULL);
+            """)
+
+    @staticmethod
+    def search_key(**params):
+        """Build the cache key of a search from its parameters (collection, bbox, datetime, query, ...)."""
+        return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def get_search(self, key):
+        """Return the cached item dicts of a search, or None if it is missing or older than the TTL."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT item_ids FROM searches WHERE key = ? AND created > ?", (key, time.time() - self.ttl)
+            ).fetchone()
+            if row is None:
+                return None
+            item_ids = json.loads(row[0])
+            items = {}
+            for item_id, item in self._connection.execute(
+                f"SELECT id, item FROM items WHERE id IN ({','.join('?' * len(item_ids))})", item_ids
+            ):
+                items[item_id] = json.loads(item)
+        if len(items) != len(item_ids):
+            return None
+        return [items[item_id] for item_id in item_ids]
+
+    def put_search(self, key, items):
+        """Store the item dicts of a search, in order."""
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO items (id, item, created) VALUES (?, ?, ?)",
+                [(item["id"], json.dumps(item), now) for item in items]
+            )
+            self._connection.execute(
+                "INSERT OR REPLACE INTO searches (key, item_ids, created) VALUES (?, ?, ?)",
+                (key, json.dumps([item["id"] for item in items]), now)
+            )
+
+    def get_signed_hrefs(self, hrefs):
+        """Return {href: signed href} of the hrefs whose signed href is still valid."""
+        hrefs = list(set(hrefs))
+        signed = {}
+        with self._lock:
+            for start in range(0, len(hrefs), SIGNED_HREFS_PER_QUERY):
+                chunk = hrefs[start:start + SIGNED_HREFS_PER_QUERY]
+                signed.update(self._connection.execute(
+                    f"SELECT href, signed_href FROM signed_hrefs WHERE href IN ({','.join('?' * len(chunk))}) AND expiry > ?",
+                    chunk + [time.time() + TOKEN_EXPIRY_MARGIN_SECONDS]
+                ).fetchall())
+        return signed
+
+    def put_signed_hrefs(self, signed):
+        """Store {href: signed href}; hrefs without a SAS expiry (not signed) are skipped."""
+        rows = [(href, signed_href, signed_href_expiry(signed_href)) for href, signed_href in signed.items()]
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO signed_hrefs (href, signed_href, expiry) VALUES (?, ?, ?)",
+                [row for row in rows if row[2] is not None]
+            )
+
+    def prune(self):
+        """Delete expired searches and signed hrefs, and items no search refers to anymore."""
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM searches WHERE created <= ?", (now - self.ttl,))
+            self._connection.execute("DELETE FROM signed_hrefs WHERE expiry <= ?", (now,))
+            referenced = set()
+            for (item_ids,) in self._connection.execute("SELECT item_ids FROM searches"):
+                referenced.update(json.loads(item_ids))
+            stale = [(item_id,) for (item_id,) in self._connection.execute("SELECT id FROM items")
+                     if item_id not in referenced]
+            self._connection.executemany("DELETE FROM items WHERE id = ?", stale)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
@@ -0,0 +1,181 @@
+"""
+Storage profiles of the downloaded 8-band stacks: GeoTIFF layout, compression and block size.
+
+The stacks are read again and again by QGIS rendering, visualize_bands and inference, so
+their layout is a choice between file size, write time and read speed. The profile names
+are shared with the plugin (see download_utils.py); writing and converting run inside the
+FTW conda environment with rasterio.
+
+Benchmark the profiles on a downloaded stack with:
+
+    python storage_profiles.py stack.tif [profile ...]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+# Creation options of each profile, without the block size. Predictor 2 (horizontal
+# differencing) suits the integer reflectances; COG profiles add internal overviews, so QGIS
+# draws zoomed-out views from them instead of decoding every full-resolution block.
+STORAGE_PROFILES = {
+    "deflate": {"driver": "GTiff", "compress": "deflate", "predictor": 2},
+    "zstd": {"driver": "GTiff", "compress": "zstd", "predictor": 2, "zstd_level": 9},
+    "cog-deflate": {"driver": "COG", "compress": "deflate", "predictor": "yes", "overview_resampling": "average"},
+    "cog-zstd": {"driver": "COG", "compress": "zstd", "predictor": "yes", "level": 9, "overview_resampling": "average"},
+    "uncompressed": {"driver": "GTiff", "compress": "none"},
+}
+DEFAULT_STORAGE_PROFILE = "deflate"
+STORAGE_BLOCK_SIZES = (256, 512, 1024)
+DEFAULT_STORAGE_BLOCK_SIZE = 512
+
+# Side of the windows read by the random-access benchmark, as QGIS reads tiles when panning
+BENCHMARK_WINDOW_SIZE = 256
+BENCHMARK_WINDOWS = 64
+
+
+def creation_options(profile=DEFAULT_STORAGE_PROFILE, block_size=DEFAULT_STORAGE_BLOCK_SIZE):
+    """
+    Return the rasterio creation options of a profile.
+
+    Args:
+        profile: One of STORAGE_PROFILES
+        block_size: Side of the internal tiles, in pixels
+
+    Returns:
+        dict including 'driver'
+    """
+    if profile not in STORAGE_PROFILES:
+        raise ValueError(f"Unknown storage profile: {profile}")
+    options = dict(STORAGE_PROFILES[profile], bigtiff="if_safer")
+    if options["driver"] == "COG":
+        options["blocksize"] = block_size
+    else:
+        options.update(tiled=True, blockxsize=block_size, blockysize=block_size)
+    return options
+
+
+def gdal_creation_options(profile=DEFAULT_STORAGE_PROFILE, block_size=DEFAULT_STORAGE_BLOCK_SIZE):
+    """
+    Return the GDAL driver and creation options of a profile, e.g. for gdal.Warp in QGIS.
+
+    Returns:
+        tuple: (driver, list of 'KEY=VALUE' strings)
+    """
+    options = creation_options(profile, block_size)
+    driver = options.pop("driver")
+    return driver, [f"{key.upper()}={'YES' if value is True else value}" for key, value in options.items()]
+
+
+def incremental_options(profile=DEFAULT_STORAGE_PROFILE, block_size=DEFAULT_STORAGE_BLOCK_SIZE):
+    """
+    Return GTiff creation options to write a stack of a profile block by block.
+
+    The COG driver can only copy a complete dataset, so COG profiles are written as a tiled
+    GTiff with the same compression first and converted with save_as().
+    """
+    options = creation_options(profile, block_size)
+    if options["driver"] != "COG":
+        return options
+    return dict(creation_options(DEFAULT_STORAGE_PROFILE, block_size), compress=options["compress"])
+
+
+def needs_copy(profile):
+    return creation_options(profile)["driver"] == "COG"
+
+
+def save_as(src_path, dst_path, profile=DEFAULT_STORAGE_PROFILE, block_size=DEFAULT_STORAGE_BLOCK_SIZE):
+    """Copy a raster to dst_path in a storage profile."""
+    from rasterio.shutil import copy
+
+    copy(src_path, dst_path, **creation_options(profile, block_size))
+    return dst_path
+
+
+def convert(path, profile=DEFAULT_STORAGE_PROFILE, block_size=DEFAULT_STORAGE_BLOCK_SIZE):
+    """Rewrite a raster in place in a storage profile."""
+    stem, ext = os.path.splitext(path)
+    temp_path = f"{stem}.converting{ext}"
+    try:
+        save_as(path, temp_path, profile, block_size)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return path
+
+
+def benchmark(path, profiles=None, block_sizes=STORAGE_BLOCK_SIZES):
+    """
+    Write a stack in each profile and block size and measure it.
+
+    Args:
+        path: Stack to benchmark, e.g. a downloaded 8-band GeoTIFF
+        profiles: Profile names, defaults to all of STORAGE_PROFILES
+
+    Returns:
+        list of dicts with 'profile', 'block_size', 'size_mb', 'write_s', 'read_mb_s' (whole
+        stack), 'window_mb_s' (random windows) and 'overview_s' (whole stack at 1/8 resolution)
+    """
+    import numpy as np
+    import rasterio
+    from rasterio.windows import Window
+
+    rng = np.random.default_rng(0)
+    results = []
+    directory = tempfile.mkdtemp(prefix="ftw_storage_benchmark_")
+    try:
+        for profile in profiles or STORAGE_PROFILES:
+            for block_size in block_sizes:
+                out_path = os.path.join(directory, f"{profile}_{block_size}.tif")
+                start = time.perf_counter()
+                save_as(path, out_path, profile, block_size)
+                write_s = time.perf_counter() - start
+
+                # Each read opens the file again, so GDAL's block cache doesn't carry over
+                with rasterio.open(out_path) as src:
+                    count, width, height = src.count, src.width, src.height
+                    itemsize = np.dtype(src.dtypes[0]).itemsize
+                    start = time.perf_counter()
+                    src.read()
+                    read_s = time.perf_counter() - start
+
+                size = min(BENCHMARK_WINDOW_SIZE, width, height)
+                windows = [Window(int(rng.integers(0, width - size + 1)), int(rng.integers(0, height - size + 1)), size, size)
+                           for _ in range(BENCHMARK_WINDOWS)]
+                with rasterio.open(out_path) as src:
+                    start = time.perf_counter()
+                    for window in windows:
+                        src.read(window=window)
+                    window_s = time.perf_counter() - start
+
+                with rasterio.open(out_path) as src:
+                    start = time.perf_counter()
+                    src.read(out_shape=(count, max(1, height // 8), max(1, width // 8)))
+                    overview_s = time.perf_counter() - start
+
+                stack_mb = count * width * height * itemsize / 1024 ** 2
+                window_mb = BENCHMARK_WINDOWS * count * size * size * itemsize / 1024 ** 2
+                results.append({
+                    "profile": profile,
+                    "block_size": block_size,
+                    "size_mb": os.path.getsize(out_path) / 1024 ** 2,
+                    "write_s": write_s,
+                    "read_mb_s": stack_mb / read_s,
+                    "window_mb_s": window_mb / window_s,
+                    "overview_s": overview_s,
+                })
+                os.remove(out_path)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit("Usage: python storage_profiles.py stack.tif [profile ...]")
+    print(f"{'profile':<14}{'block':>6}{'size MB':>10}{'write s':>9}{'read MB/s':>11}{'windows MB/s':>14}{'1/8 view s':>12}")
+    for result in benchmark(sys.argv[1], sys.argv[2:] or None):
+        print(f"{result['profile']:<14}{result['block_size']:>6}{result['size_mb']:>10.1f}{result['write_s']:>9.2f}"
+              f"{result['read_mb_s']:>11.0f}{result['window_mb_s']:>14.0f}{result['overview_s']:>12.3f}")
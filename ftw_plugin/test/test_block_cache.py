@@ -0,0 +1,82 @@
+# coding=utf-8
+"""Block cache test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'Fields of The World Team'
+__date__ = '2026-10-17'
+__copyright__ = 'Copyright 2025, Fields of The World Team'
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from block_cache import BlockCache
+
+
+class BlockCacheTest(unittest.TestCase):
+    """Test the LRU cache of COG blocks."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.directory = tempfile.mkdtemp()
+        self.cache = BlockCache(self.directory, max_bytes=10000)
+
+    def tearDown(self):
+        """Runs after each test."""
+        self.cache.close()
+        shutil.rmtree(self.directory)
+
+    def key(self, index):
+        return BlockCache.block_key("scene", "B04", 0, index)
+
+    def test_get_put(self):
+        """Test a stored block is returned as is."""
+        self.assertIsNone(self.cache.get(self.key(0)))
+        self.cache.put(self.key(0), b"block")
+        self.assertEqual(self.cache.get(self.key(0)), b"block")
+        self.assertEqual(self.cache.total_bytes, 5)
+
+    def test_lru_eviction(self):
+        """Test the least recently used blocks are evicted above the size cap."""
+        for index in range(10):
+            self.cache.put(self.key(index), bytes(1000))
+            time.sleep(0.001)
+        # Block 0 is used again, so block 1 is now the least recently used
+        self.assertIsNotNone(self.cache.get(self.key(0)))
+        self.cache.put(self.key(10), bytes(1000))
+        self.assertLessEqual(self.cache.total_bytes, 10000)
+        self.assertIsNotNone(self.cache.get(self.key(0)))
+        self.assertIsNone(self.cache.get(self.key(1)))
+        self.assertIsNotNone(self.cache.get(self.key(10)))
+        self.assertFalse(os.path.exists(self.cache._path(self.key(1))))
+
+    def test_shared_index(self):
+        """Test the size cap holds across caches sharing an index, like the queue's workers."""
+        other = BlockCache(self.directory, max_bytes=10000)
+        try:
+            for index in range(30):
+                (self.cache if index % 2 else other).put(self.key(index), bytes(1000))
+            self.assertLessEqual(self.cache.total_bytes, 10000)
+            self.assertEqual(other.total_bytes, self.cache.total_bytes)
+        finally:
+            other.close()
+
+    def test_corrupt_block(self):
+        """Test a block whose file doesn't match its hash is a miss."""
+        self.cache.put(self.key(0), b"block")
+        with open(self.cache._path(self.key(0)), "wb") as f:
+            f.write(b"other")
+        self.assertIsNone(self.cache.get(self.key(0)))
+        self.assertEqual(self.cache.total_bytes, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
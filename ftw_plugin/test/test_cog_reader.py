@@ -0,0 +1,283 @@
+# coding=utf-8
+"""COG reader test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'Fields of The World Team'
+__date__ = '2026-10-17'
+__copyright__ = 'Copyright 2025, Fields of The World Team'
+
+import functools
+import os
+import re
+import shutil
+import tempfile
+import threading
+import unittest
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import numpy as np
+
+try:
+    import rasterio
+    from rasterio.shutil import copy
+    from rasterio.transform import from_origin
+    from rasterio.warp import transform_bounds
+
+    from cog_reader import HTTP_RETRIES, CogReader, read_stack, unit_strips
+except ImportError:
+    # The COG reader runs in the FTW conda environment
+    rasterio = None
+
+SIZE = 1500
+ORIGIN = (300000, 5000020)
+
+
+def write_cog(path, data, compress, predictor=None, **creation_options):
+    """Write a single-band COG with 256 pixel blocks and overviews."""
+    temp_path = path + ".src.tif"
+    with rasterio.open(temp_path, "w", driver="GTiff", width=data.shape[1], height=data.shape[0], count=1,
+                       dtype=data.dtype, crs="EPSG:32631", transform=from_origin(*ORIGIN, 10, 10), nodata=0) as dst:
+        dst.write(data, 1)
+    options = dict(driver="COG", compress=compress, blocksize=256, overview_resampling="average")
+    if predictor:
+        options["predictor"] = predictor
+    options.update(creation_options)
+    copy(temp_path, path, **options)
+    os.remove(temp_path)
+    return path
+
+
+@unittest.skipIf(rasterio is None, "the FTW conda environment is not available")
+class CogReaderTest(unittest.TestCase):
+    """Test the native COG reader against GDAL."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        rng = np.random.default_rng(0)
+        cls.data = rng.integers(1, 10000, (SIZE, SIZE)).astype(np.uint16)
+        cls.paths = {
+            "deflate_predictor": write_cog(os.path.join(cls.directory, "B04.tif"), cls.data, "deflate", 2),
+            "deflate": write_cog(os.path.join(cls.directory, "B03.tif"), cls.data, "deflate"),
+            "none": write_cog(os.path.join(cls.directory, "B02.tif"), cls.data, "none"),
+        }
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def test_header(self):
+        """Test the parsed header."""
+        reader = CogReader(self.paths["deflate_predictor"])
+        self.assertEqual(reader.epsg, 32631)
+        self.assertEqual(reader.transform, (ORIGIN[0], 10.0, ORIGIN[1], 10.0))
+        self.assertEqual(reader.dtype.itemsize, 2)
+        self.assertEqual(reader.predictor, 2)
+        self.assertEqual((reader.levels[0].width, reader.levels[0].tile_width), (SIZE, 256))
+        self.assertGreater(len(reader.levels), 1)
+
+    def test_read_window(self):
+        """Test windows of every level decode like GDAL reads them."""
+        for name, path in self.paths.items():
+            reader = CogReader(path)
+            with rasterio.open(path) as src:
+                np.testing.assert_array_equal(reader.read_window(200, 300, 700, 500), self.data[300:800, 200:900],
+                                              err_msg=name)
+                # Past the image edge is nodata
+                edge = reader.read_window(SIZE - 10, 0, 20, 5)
+                np.testing.assert_array_equal(edge[:, 10:], 0)
+                for level in range(1, len(reader.levels)):
+                    info = reader.levels[level]
+                    with rasterio.open(path, overview_level=level - 1) as overview:
+                        np.testing.assert_array_equal(reader.read_window(0, 0, info.width, info.height, level),
+                                                      overview.read(1), err_msg=f"{name} level {level}")
+                    self.assertAlmostEqual(reader.level_resolution(level), src.res[0] * SIZE / info.width)
+
+    def test_unit_strips(self):
+        """Test strips start on tile rows and cover the stack once."""
+        strips = unit_strips(1500, 100, 256)
+        self.assertEqual(strips[0], [0, 156])
+        self.assertTrue(all((100 + row_off) % 256 == 0 for row_off, _ in strips[1:]))
+        self.assertEqual(sum(rows for _, rows in strips), 1500)
+
+
+class PlainHandler(SimpleHTTPRequestHandler):
+    """Serve files whole, ignoring range requests, after failing the first server.failures requests."""
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests.append(self.headers.get("Range"))
+        if self.server.failures > 0:
+            self.server.failures -= 1
+            self.send_error(503)
+            return
+        self.serve()
+
+    def serve(self):
+        super().do_GET()
+
+
+class RangeHandler(PlainHandler):
+    """Serve single byte ranges with 206 responses."""
+
+    def serve(self):
+        match = re.fullmatch(r"bytes=(\d+)-(\d+)", self.headers.get("Range") or "")
+        if match is None:
+            return super().serve()
+        path = self.translate_path(self.path)
+        size = os.path.getsize(path)
+        start, end = int(match.group(1)), min(int(match.group(2)), size - 1)
+        with open(path, "rb") as f:
+            f.seek(start)
+            data = f.read(end - start + 1)
+        self.send_response(206)
+        self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@unittest.skipIf(rasterio is None, "the FTW conda environment is not available")
+class CogHttpTest(unittest.TestCase):
+    """Test the native COG reader over HTTP, with and without range requests."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        rng = np.random.default_rng(2)
+        cls.data = rng.integers(1, 10000, (SIZE, SIZE)).astype(np.uint16)
+        write_cog(os.path.join(cls.directory, "B04.tif"), cls.data, "deflate", 2)
+        write_cog(os.path.join(cls.directory, "B08.tif"), cls.data, "deflate", 2, bigtiff="YES")
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def serve(self, handler, failures=0):
+        """Serve the test directory in a background thread and return its base URL."""
+        server = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(handler, directory=self.directory))
+        server.requests = []
+        server.failures = failures
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.server = server
+        return f"http://127.0.0.1:{server.server_address[1]}"
+
+    def test_range_reads(self):
+        """Test only the header and the blocks of a window are fetched with range requests."""
+        url = self.serve(RangeHandler)
+        reader = CogReader(f"{url}/B04.tif")
+        self.assertIsNone(reader.source._spool)
+        self.server.requests.clear()
+        np.testing.assert_array_equal(reader.read_window(200, 200, 300, 200), self.data[200:400, 200:500])
+        # Two block rows by two block columns
+        self.assertEqual(len(self.server.requests), 4)
+        self.assertTrue(all(requested.startswith("bytes=") for requested in self.server.requests))
+        self.assertIsNone(reader.source._spool)
+
+    def test_spooled_without_range_support(self):
+        """Test a server answering 200 to range requests is downloaded once and read from the spool."""
+        url = self.serve(PlainHandler)
+        reader = CogReader(f"{url}/B04.tif")
+        self.assertIsNotNone(reader.source._spool)
+        np.testing.assert_array_equal(reader.read_window(200, 300, 700, 500), self.data[300:800, 200:900])
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_retries(self):
+        """Test failed requests are retried, and the last failure is raised."""
+        import requests
+
+        url = self.serve(RangeHandler, failures=HTTP_RETRIES - 1)
+        with mock.patch("cog_reader.time.sleep") as sleep:
+            reader = CogReader(f"{url}/B04.tif")
+        self.assertEqual(sleep.call_count, HTTP_RETRIES - 1)
+        self.assertEqual(len(self.server.requests), HTTP_RETRIES)
+        np.testing.assert_array_equal(reader.read_window(0, 0, 100, 100), self.data[:100, :100])
+
+        self.server.failures = HTTP_RETRIES
+        self.server.requests.clear()
+        with mock.patch("cog_reader.time.sleep"):
+            with self.assertRaises(requests.HTTPError):
+                reader.read_window(1000, 1000, 100, 100)
+        self.assertEqual(len(self.server.requests), HTTP_RETRIES)
+
+    def test_bigtiff(self):
+        """Test a BigTIFF COG is parsed and read over range requests."""
+        url = self.serve(RangeHandler)
+        reader = CogReader(f"{url}/B08.tif")
+        self.assertTrue(reader._big)
+        self.assertGreater(len(reader.levels), 1)
+        np.testing.assert_array_equal(reader.read_window(1200, 1100, 300, 400), self.data[1100:1500, 1200:1500])
+        with rasterio.open(os.path.join(self.directory, "B08.tif"), overview_level=0) as overview:
+            level = reader.levels[1]
+            np.testing.assert_array_equal(reader.read_window(0, 0, level.width, level.height, 1), overview.read(1))
+
+
+@unittest.skipIf(rasterio is None, "the FTW conda environment is not available")
+class ReadStackResumeTest(unittest.TestCase):
+    """Test an interrupted stack download resumes from its finished units."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.directory = tempfile.mkdtemp()
+        rng = np.random.default_rng(1)
+        self.bands = {band: rng.integers(1, 10000, (SIZE, SIZE)).astype(np.uint16) for band in ("B04", "B08")}
+        item = {"id": "scene", "assets": {}}
+        for band, data in self.bands.items():
+            item["assets"][band] = {"href": write_cog(os.path.join(self.directory, f"{band}.tif"), data, "deflate", 2)}
+        self.items = [item]
+        self.bbox = transform_bounds("EPSG:32631", "EPSG:4326", 302000, 4988000, 309000, 4997000)
+        self.output = os.path.join(self.directory, "stack.tif")
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.directory)
+
+    def test_resume(self):
+        """Test only the missing units are read again and the output is complete."""
+        original = CogReader.read_window
+        calls = []
+        fail_at = [3]
+
+        def counting_read_window(reader, *args, **kwargs):
+            calls.append(args)
+            if len(calls) == fail_at[0]:
+                raise IOError("Connection lost")
+            return original(reader, *args, **kwargs)
+
+        with mock.patch.object(CogReader, "read_window", counting_read_window):
+            with self.assertRaises(IOError):
+                read_stack(self.items, self.bbox, self.output, bands=("B04", "B08"))
+        self.assertFalse(os.path.exists(self.output))
+        self.assertTrue(os.path.isdir(self.output + ".parts"))
+
+        calls.clear()
+        fail_at[0] = None
+        with mock.patch.object(CogReader, "read_window", counting_read_window):
+            read_stack(self.items, self.bbox, self.output, bands=("B04", "B08"))
+        self.assertFalse(os.path.exists(self.output + ".parts"))
+
+        with rasterio.open(self.output) as src:
+            stack = src.read()
+            col = round((src.transform.c - ORIGIN[0]) / 10)
+            row = round((ORIGIN[1] - src.transform.f) / 10)
+        n_units = 2 * len(unit_strips(stack.shape[1], row, 256))
+        # The 2 units finished before the interruption are not read again
+        self.assertEqual(len(calls), n_units - 2)
+        for i, band in enumerate(("B04", "B08")):
+            np.testing.assert_array_equal(stack[i], self.bands[band][row:row + stack.shape[1], col:col + stack.shape[2]])
+
+
+if __name__ == "__main__":
+    unittest.main()
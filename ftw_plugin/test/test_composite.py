@@ -0,0 +1,52 @@
+# coding=utf-8
+"""Composite test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'Fields of The World Team'
+__date__ = '2026-10-17'
+__copyright__ = 'Copyright 2025, Fields of The World Team'
+
+import unittest
+
+import numpy as np
+
+from composite import COMPOSITE_NODATA, composite_block
+
+
+class CompositeBlockTest(unittest.TestCase):
+    """Test the per-pixel composite of clear observations."""
+
+    def setUp(self):
+        """Runs before each test."""
+        # 3 scenes, 1 band, 1 x 4 pixels, best ranked scene first
+        self.values = np.array([[[[10, 20, 30, 0]]], [[[12, 22, 0, 0]]], [[[14, 90, 50, 0]]]], dtype=np.uint16)
+        self.clear = np.array([[[True, False, False, True]],
+                               [[True, True, True, True]],
+                               [[True, True, False, True]]])
+
+    def test_median(self):
+        """Test the median of the clear observations with data."""
+        result = composite_block(self.values, self.clear, "median")
+        self.assertEqual(result.dtype, np.uint16)
+        # Pixel 2: no clear observation with data, falls back to the first scene with data
+        np.testing.assert_array_equal(result[0, 0], [12, 56, 30, COMPOSITE_NODATA])
+
+    def test_first(self):
+        """Test the clear observation of the best ranked scene."""
+        result = composite_block(self.values, self.clear, "first")
+        np.testing.assert_array_equal(result[0, 0], [10, 22, 30, COMPOSITE_NODATA])
+
+    def test_unknown_method(self):
+        """Test an unknown method is rejected."""
+        with self.assertRaises(ValueError):
+            composite_block(self.values, self.clear, "mean")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,170 @@
+# coding=utf-8
+"""Crop calendar index test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'Fields of The World Team'
+__date__ = '2026-10-17'
+__copyright__ = 'Copyright 2025, Fields of The World Team'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from crop_calendar import CropCalendarIndex, nearest_valid_index, pack_crop_calendars
+
+try:
+    import rasterio
+except ImportError:
+    rasterio = None
+
+# 1 degree calendar over 10E-20E, 40N-48N
+TRANSFORM = (1.0, 0.0, 10.0, 0.0, -1.0, 48.0)
+
+
+def make_seasons():
+    """Start/end of season layers with a few pixels without data."""
+    rng = np.random.default_rng(0)
+    seasons = {}
+    for season in ("summer", "winter"):
+        start = rng.integers(1, 366, (8, 10)).astype(np.uint16)
+        end = rng.integers(1, 366, (8, 10)).astype(np.uint16)
+        start[0, :3] = 0
+        end[5, 5] = 0
+        seasons[season] = {"start": start, "end": end}
+    # A winter season crossing into a leap year
+    seasons["winter"]["start"][1, 1] = 300
+    seasons["winter"]["end"][1, 1] = 60
+    return seasons
+
+
+def write_seasons(seasons, directory):
+    """Write season layers as GeoTIFFs and return their {season: {kind: path}} mapping."""
+    paths = {}
+    for season, layers in seasons.items():
+        paths[season] = {}
+        for kind, data in layers.items():
+            path = os.path.join(directory, f"{season}_{kind}.tif")
+            with rasterio.open(path, "w", driver="GTiff", width=10, height=8, count=1, dtype="uint16",
+                               crs="EPSG:4326", transform=rasterio.Affine(*TRANSFORM), nodata=0) as dst:
+                dst.write(data, 1)
+            paths[season][kind] = path
+    return paths
+
+
+class NearestValidIndexTest(unittest.TestCase):
+    """Test the nearest-valid-pixel fallback."""
+
+    def test_nearest_valid_index(self):
+        """Test pixels map to themselves, their nearest valid pixel or -1."""
+        valid = np.zeros((5, 9), dtype=bool)
+        valid[2, 2] = True
+        valid[0, 8] = True
+        nearest = nearest_valid_index(valid, 3)
+        self.assertEqual(nearest.dtype, np.int32)
+        self.assertEqual(nearest[2, 2], 2 * 9 + 2)
+        self.assertEqual(nearest[0, 8], 8)
+        self.assertEqual(nearest[3, 3], 2 * 9 + 2)
+        self.assertEqual(nearest[1, 7], 8)
+        # Farther than 3 pixels from both valid pixels
+        self.assertEqual(nearest[4, 5], -1)
+
+    def test_matches_brute_force(self):
+        """Test the propagated index against the distance to every valid pixel."""
+        valid = np.random.default_rng(1).random((12, 15)) < 0.1
+        nearest = nearest_valid_index(valid, 4)
+        valid_rows, valid_cols = np.nonzero(valid)
+        for row in range(valid.shape[0]):
+            for col in range(valid.shape[1]):
+                distance2 = (valid_rows - row) ** 2 + (valid_cols - col) ** 2
+                if distance2.min() > 16:
+                    self.assertEqual(nearest[row, col], -1)
+                else:
+                    found_row, found_col = divmod(int(nearest[row, col]), valid.shape[1])
+                    self.assertEqual((found_row - row) ** 2 + (found_col - col) ** 2, distance2.min())
+
+
+class CropCalendarIndexTest(unittest.TestCase):
+    """Test date lookups in the resident calendar index."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.seasons = make_seasons()
+        self.index = CropCalendarIndex(self.seasons, TRANSFORM)
+
+    def test_dates(self):
+        """Test day-of-year and dates, including a season ending in the next (leap) year."""
+        self.assertEqual(self.index.day_of_year(13.5, 45.5, "summer"),
+                         (int(self.seasons["summer"]["start"][2, 3]), int(self.seasons["summer"]["end"][2, 3])))
+        self.assertEqual(self.index.dates(11.5, 46.5, "winter", 2023), ("2023-10-27", "2024-02-29"))
+
+    def test_batch_matches_scalar(self):
+        """Test day_of_year_batch against day_of_year for every pixel centre."""
+        lons, lats = np.meshgrid(np.arange(10.5, 20), np.arange(47.5, 40, -1))
+        for season in ("summer", "winter"):
+            for nearest_valid in (True, False):
+                start, end, valid = self.index.day_of_year_batch(lons, lats, season, nearest_valid)
+                for lon, lat, s, e, v in zip(lons.ravel(), lats.ravel(), start.ravel(), end.ravel(), valid.ravel()):
+                    try:
+                        expected = self.index.day_of_year(lon, lat, season, nearest_valid)
+                    except ValueError:
+                        self.assertFalse(v)
+                        continue
+                    self.assertTrue(v)
+                    self.assertEqual((int(s), int(e)), expected)
+
+    def test_outside(self):
+        """Test coordinates outside the calendar."""
+        with self.assertRaises(ValueError):
+            self.index.day_of_year(0.0, 45.0, "summer")
+        _, _, valid = self.index.day_of_year_batch(np.array([0.0]), np.array([45.0]), "summer")
+        self.assertFalse(valid[0])
+
+
+@unittest.skipIf(rasterio is None, "rasterio is not installed")
+class PackedCalendarTest(unittest.TestCase):
+    """Test the packed calendar file round trip."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.directory = tempfile.mkdtemp()
+        self.seasons = make_seasons()
+        self.paths = write_seasons(self.seasons, self.directory)
+        self.packed = pack_crop_calendars(self.paths, os.path.join(self.directory, "calendar.ftwcal"))
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        """Test the packed file holds the GeoTIFF layers and geotransform."""
+        index = CropCalendarIndex.from_packed(self.packed)
+        self.assertEqual(index.transform, TRANSFORM)
+        for season, layers in self.seasons.items():
+            for kind, data in layers.items():
+                np.testing.assert_array_equal(index.seasons[season][kind], data)
+        self.assertEqual(index.dates(15.5, 44.5, "summer", 2024),
+                         CropCalendarIndex.from_tifs(self.paths).dates(15.5, 44.5, "summer", 2024))
+
+    def test_checksum(self):
+        """Test a corrupt packed file is rejected."""
+        with open(self.packed, "r+b") as f:
+            f.seek(-1, os.SEEK_END)
+            last = f.read(1)
+            f.seek(-1, os.SEEK_END)
+            f.write(bytes([last[0] ^ 0xFF]))
+        with self.assertRaises(ValueError):
+            CropCalendarIndex.from_packed(self.packed)
+        CropCalendarIndex.from_packed(self.packed, verify=False)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+# coding=utf-8
+"""Download manifest test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'Fields of The World Team'
+__date__ = '2026-10-17'
+__copyright__ = 'Copyright 2025, Fields of The World Team'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from download_manifest import DownloadManifest
+
+
+class DownloadManifestTest(unittest.TestCase):
+    """Test the checkpoints of resumable downloads."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.directory = tempfile.mkdtemp()
+        self.output = os.path.join(self.directory, "stack.tif")
+        self.signature = {"assets": [["scene", "B04"]], "bbox": [1.0, 2.0, 3.0, 4.0], "grid": ("EPSG:32631", 10)}
+        self.data = np.arange(12, dtype=np.uint16).reshape(3, 4)
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.directory)
+
+    def test_resume(self):
+        """Test a unit saved by one manifest is loaded by the next one with the same signature."""
+        DownloadManifest(self.output, self.signature).save_unit("0/0", self.data)
+        manifest = DownloadManifest(self.output, self.signature)
+        np.testing.assert_array_equal(manifest.load_unit("0/0", (3, 4), np.uint16), self.data)
+        self.assertIsNone(manifest.load_unit("0/1", (3, 4), np.uint16))
+
+    def test_other_signature(self):
+        """Test the units of another request are discarded."""
+        DownloadManifest(self.output, self.signature).save_unit("0/0", self.data)
+        manifest = DownloadManifest(self.output, dict(self.signature, bbox=[1.0, 2.0, 3.0, 5.0]))
+        self.assertIsNone(manifest.load_unit("0/0", (3, 4), np.uint16))
+        self.assertEqual(os.listdir(manifest.directory), [])
+
+    def test_corrupt_unit(self):
+        """Test a unit failing its checksum is downloaded again."""
+        manifest = DownloadManifest(self.output, self.signature)
+        manifest.save_unit("0/0", self.data)
+        with open(manifest._unit_path("0/0"), "ab") as f:
+            f.write(b"\0")
+        manifest = DownloadManifest(self.output, self.signature)
+        self.assertIsNone(manifest.load_unit("0/0", (3, 4), np.uint16))
+        self.assertNotIn("0/0", manifest.units)
+
+    def test_remove(self):
+        """Test the manifest and its units are deleted once the output is complete."""
+        manifest = DownloadManifest(self.output, self.signature)
+        manifest.save_unit("0/0", self.data)
+        manifest.remove()
+        self.assertFalse(os.path.exists(manifest.directory))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+# coding=utf-8
+"""Download utilities test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'Fields of The World Team'
+__date__ = '2026-10-17'
+__copyright__ = 'Copyright 2025, Fields of The World Team'
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+try:
+    import rasterio
+    from ftw_plugin.download_utils import calculate_window_dates, calculate_window_dates_batch, get_season_windows_batch
+    from ftw_plugin.crop_calendar import get_crop_calendar_index
+except ImportError:
+    # download_utils runs inside QGIS
+    rasterio = None
+
+# 1 degree calendar over 10E-20E, 40N-48N
+TRANSFORM = (1.0, 0.0, 10.0, 0.0, -1.0, 48.0)
+
+
+@unittest.skipIf(rasterio is None, "QGIS or rasterio is not available")
+class WindowDatesBatchTest(unittest.TestCase):
+    """Test the vectorized window lookups against the scalar calculate_window_dates."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.directory = tempfile.mkdtemp()
+        rng = np.random.default_rng(0)
+        self.calendar = {}
+        for season in ("summer", "winter"):
+            self.calendar[season] = {}
+            for kind in ("start", "end"):
+                data = rng.integers(1, 366, (8, 10)).astype(np.uint16)
+                data[0, :3] = 0
+                path = os.path.join(self.directory, f"{season}_{kind}.tif")
+                with rasterio.open(path, "w", driver="GTiff", width=10, height=8, count=1, dtype="uint16",
+                                   crs="EPSG:4326", transform=rasterio.Affine(*TRANSFORM), nodata=0) as dst:
+                    dst.write(data, 1)
+                self.calendar[season][kind] = path
+
+    def tearDown(self):
+        """Runs after each test."""
+        shutil.rmtree(self.directory)
+
+    def test_calculate_window_dates_batch(self):
+        """Test dates across month, year and leap day boundaries."""
+        sos = ["2020-01-10", "2020-03-01", "2021-12-25", "2024-02-29"]
+        eos = ["2020-06-15", "2021-01-20", "2022-03-01", "2024-12-31"]
+        batch = calculate_window_dates_batch(sos, eos)
+        for i, (s, e) in enumerate(zip(sos, eos)):
+            self.assertEqual(tuple(str(window[i]) for window in batch), calculate_window_dates(s, e))
+        win_a_start, _, _, win_b_end = calculate_window_dates_batch(["NaT"], ["NaT"])
+        self.assertTrue(np.isnat(win_a_start[0]) and np.isnat(win_b_end[0]))
+
+    def test_get_season_windows_batch(self):
+        """Test every pixel centre, and a point outside the calendar, against the scalar lookup."""
+        lons, lats = np.meshgrid(np.arange(10.5, 20), np.arange(47.5, 40, -1))
+        lons = np.append(lons.ravel(), 0.0)
+        lats = np.append(lats.ravel(), 45.0)
+        index = get_crop_calendar_index(self.calendar)
+        for season in ("summer", "winter"):
+            result = get_season_windows_batch(lons, lats, self.calendar, season, 2023)
+            for i, (lon, lat) in enumerate(zip(lons, lats)):
+                windows = tuple(str(result[key][i]) for key in ("win_a_start", "win_a_end", "win_b_start", "win_b_end"))
+                try:
+                    sos, eos = index.dates(lon, lat, season, 2023)
+                except ValueError:
+                    self.assertFalse(result["valid"][i])
+                    self.assertTrue(all(window == "NaT" for window in windows))
+                    continue
+                self.assertTrue(result["valid"][i])
+                self.assertEqual((str(result["sos"][i]), str(result["eos"][i])), (sos, eos))
+                self.assertEqual(windows, calculate_window_dates(sos, eos))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+# coding=utf-8
+"""Sentinel-2 tile index test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'Fields of The World Team'
+__date__ = '2026-10-17'
+__copyright__ = 'Copyright 2025, Fields of The World Team'
+
+import unittest
+
+from mgrs_grid import get_tile_index
+
+
+class SentinelTileIndexTest(unittest.TestCase):
+    """Test the tile index finds the tiles of a bbox."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.index = get_tile_index()
+
+    def test_tiles(self):
+        """Test a bbox in one UTM zone."""
+        # Around Paris, zone 31 band U
+        tiles = self.index.tiles([2.2, 48.8, 2.4, 48.9])
+        self.assertIn('31UDQ', tiles)
+        self.assertEqual(self.index.utm_zones([2.2, 48.8, 2.4, 48.9]), [32631])
+
+    def test_zone_exceptions(self):
+        """Test the Norway and Svalbard UTM zone exceptions of the Sentinel-2 grid."""
+        # Bergen is in the widened zone 32V, not in 31V
+        self.assertEqual(self.index.tiles([5.30, 60.38, 5.34, 60.40]), ['32VKM', '32VKN', '32VLN'])
+        self.assertEqual(self.index.utm_zones([5.30, 60.38, 5.34, 60.40]), [32632])
+        # Longyearbyen is in zone 33X; zone 32X doesn't exist
+        self.assertEqual(self.index.utm_zones([15.6, 78.2, 15.7, 78.25]), [32633])
+        self.assertFalse(any(tile.startswith('32X') for tile in self.index.ids))
+
+    def test_antimeridian(self):
+        """Test a bbox crossing the antimeridian gets tiles from both sides."""
+        tiles = self.index.tiles([179.9, -17.0, -179.9, -16.9])
+        zones = {tile[:2] for tile in tiles}
+        self.assertIn('60', zones)
+        self.assertIn('01', zones)
+        self.assertEqual(self.index.utm_zones([179.9, -17.0, -179.9, -16.9]), [32701, 32760])
+
+    def test_empty(self):
+        """Test a bbox with no cells returns no tiles."""
+        self.assertEqual(self.index.tiles([10.0, 5.0, 11.0, 4.0]), [])
+
+
+if __name__ == "__main__":
+    suite = unittest.makeSuite(SentinelTileIndexTest)
+    runner = unittest.TextTestRunner(verbosity=2)
+    runner.run(suite)
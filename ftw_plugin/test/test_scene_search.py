@@ -0,0 +1,77 @@
+# coding=utf-8
+"""Scene selection test.
+
+.. note:: This program is free software; you can redistribute it and/or modify
+     it under the terms of the GNU General Public License as published by
+     the Free Software Foundation; either version 2 of the License, or
+     (at your option) any later version.
+
+"""
+
+__author__ = 'Fields of The World Team'
+__date__ = '2026-10-17'
+__copyright__ = 'Copyright 2025, Fields of The World Team'
+
+import unittest
+
+import numpy as np
+
+try:
+    from shapely.geometry import box
+
+    from scene_search import coverage_fractions, select_scenes
+except ImportError:
+    # The scene search runs in the FTW conda environment
+    select_scenes = None
+
+
+def make_scene(bounds, cloud_cover):
+    """Item dict and footprint of a scene."""
+    return {"properties": {"eo:cloud_cover": cloud_cover}}, box(*bounds)
+
+
+@unittest.skipIf(select_scenes is None, "the FTW conda environment is not available")
+class SelectScenesTest(unittest.TestCase):
+    """Test the selection of the scenes of one window."""
+
+    def setUp(self):
+        """Runs before each test."""
+        self.aoi = box(0, 0, 10, 10)
+
+    def select(self, scenes, max_cloud_cover=50):
+        items = [item for item, _ in scenes]
+        footprints = np.array([footprint for _, footprint in scenes], dtype=object)
+        return select_scenes(items, footprints, coverage_fractions(footprints, self.aoi), self.aoi, max_cloud_cover)
+
+    def test_least_cloudy_full_scene(self):
+        """Test the least cloudy scene covering the whole AOI wins."""
+        selected, covered = self.select([
+            make_scene((-1, -1, 11, 11), 30),
+            make_scene((-1, -1, 11, 11), 10),
+            make_scene((0, 0, 5, 10), 0),
+        ])
+        self.assertEqual(selected, [1])
+        self.assertEqual(covered, 1.0)
+
+    def test_greedy_cover(self):
+        """Test partial scenes are combined until they cover the AOI."""
+        selected, covered = self.select([
+            make_scene((0, 0, 6, 10), 5),
+            make_scene((4, 0, 10, 10), 5),
+            make_scene((0, 0, 3, 10), 0),
+        ])
+        self.assertEqual(sorted(int(i) for i in selected), [0, 1])
+        self.assertAlmostEqual(covered, 1.0)
+
+    def test_cloud_threshold(self):
+        """Test scenes above the threshold are left out."""
+        selected, covered = self.select([
+            make_scene((-1, -1, 11, 11), 80),
+            make_scene((0, 0, 5, 10), 10),
+        ])
+        self.assertEqual([int(i) for i in selected], [1])
+        self.assertAlmostEqual(covered, 0.5)
+
+
+if __name__ == "__main__":
+    unittest.main()